@@ -1,7 +1,4 @@
-try:
-  import usocket as socket
-except:
-  import socket
+import uasyncio as asyncio
 import network
 import esp
 esp.osdebug(None)
@@ -11,6 +8,9 @@ import sys
 import os
 import machine
 import ubinascii
+import utime
+import journal
+import template
 
 SSID = 'AP-M5DiabConf'
 PASSWORD = '123456789'
@@ -34,10 +34,18 @@ DEFAULT_CONFIG = {
     "beeperEndTime": "23:59:59",
     "oldData": 15,
     "oldDataEmergenc": 1440,
+    "transport": 0,
+    "mirrors": [],
     "wifi": []
 }
 
 ipconfig = None
+savedConfig = None # encoded config as last saved, later saves journal only the changes
+MAX_JOURNALED_CONFIG = 112 # bytes of changes, more and config.json is rewritten
+pendingConfig = {} # key -> value set with setConfigValue(), not saved yet
+pendingConfigRef = None
+pendingSince = 0
+encodedSecrets = {} # plain secret -> encoded, secrets are XORed once
 
 def xor_data(data):
   try:
@@ -56,8 +64,11 @@ def xor_data(data):
 
 def encode_val(val):
   if not val: return ""
+  if val in encodedSecrets: return encodedSecrets[val]
   try:
-    return ubinascii.hexlify(xor_data(val)).decode()
+    encoded = ubinascii.hexlify(xor_data(val)).decode()
+    encodedSecrets[val] = encoded
+    return encoded
   except:
     return val
 
@@ -68,25 +79,96 @@ def decode_val(val):
   except:
     return val
 
-def saveConfigFile(config):
-  try:
-    encoded_config = ujson.loads(ujson.dumps(config))
+def encodeConfig(config):
+  encoded_config = ujson.loads(ujson.dumps(config))
+  
+  if "api-token" in encoded_config:
+    encoded_config["api-token"] = encode_val(encoded_config["api-token"])
     
-    if "api-token" in encoded_config:
-      encoded_config["api-token"] = encode_val(encoded_config["api-token"])
-      
-    if "wifi" in encoded_config:
-      for entry in encoded_config["wifi"]:
-        if "password" in entry:
-          entry["password"] = encode_val(entry["password"])
+  if "wifi" in encoded_config:
+    for entry in encoded_config["wifi"]:
+      if "password" in entry:
+        entry["password"] = encode_val(entry["password"])
+
+  for entry in encoded_config.get("mirrors", []):
+    if "api-token" in entry:
+      entry["api-token"] = encode_val(entry["api-token"])
+  return encoded_config
+
+def configChanges(old, new):
+  # keys of new that differ from old, None when a key was removed
+  if old == None: return None
+  for k in old:
+    if k not in new: return None
+  changes = {}
+  for k in new:
+    if k not in old or old[k] != new[k]: changes[k] = new[k]
+  return changes
 
-    with open(CONFIG_FILE, 'w') as confFile:
-      ujson.dump(encoded_config, confFile) 
+def saveConfigFile(config):
+  # small changes (brightness, screen mode, ...) are appended to the journal,
+  # anything else rewrites config.json
+  global savedConfig
+  try:
+    encoded_config = encodeConfig(config)
+    changes = configChanges(savedConfig, encoded_config)
+    if changes == {}:
+      return
+    data = ujson.dumps(changes) if changes != None else None
+    if data != None and len(data) <= MAX_JOURNALED_CONFIG:
+      journal.get().append(journal.CONFIG, data.encode())
+    else:
+      writeConfigFile(encoded_config)
+      journal.get().append(journal.CONFIG_CHECKPOINT, b"")
+    savedConfig = encoded_config
+    # a full save supersedes deferred values of the same keys
+    for k in encoded_config:
+      pendingConfig.pop(k, None)
     print("Successfully saved config file")
   except Exception as e:
     sys.print_exception(e) 
 
+def setConfigValue(config, key, value):
+  # sets a plain (not secret) config value now and saves it later with
+  # flushConfig(), cheap enough for timer callbacks
+  global pendingConfigRef, pendingSince
+  config[key] = value
+  pendingConfig[key] = value
+  pendingConfigRef = config
+  pendingSince = utime.ticks_ms()
+
+def flushConfig(quietMs=0):
+  # saves the values set since the last flush once nothing changed for
+  # quietMs, all of them in one write; returns True when it wrote
+  global pendingConfig
+  if len(pendingConfig) == 0 or utime.ticks_diff(utime.ticks_ms(), pendingSince) < quietMs:
+    return False
+  changes = pendingConfig
+  pendingConfig = {}
+  try:
+    if savedConfig == None:
+      saveConfigFile(pendingConfigRef)
+    else:
+      journal.get().append(journal.CONFIG, ujson.dumps(changes).encode())
+      savedConfig.update(changes)
+      print("Successfully saved config changes " + str(list(changes)))
+    return True
+  except Exception as e:
+    sys.print_exception(e)
+    return False
+
+def writeConfigFile(encoded_config):
+  with open(CONFIG_FILE, 'w') as confFile:
+    ujson.dump(encoded_config, confFile) 
+
+def compactConfig():
+  # journal compaction: fold the journaled changes into config.json
+  if savedConfig != None:
+    writeConfigFile(savedConfig)
+  return []
+
 def readConfigFile():
+  global savedConfig
   try:
     config = {}
     if CONFIG_FILE in os.listdir():
@@ -95,12 +177,28 @@ def readConfigFile():
     else:
       return DEFAULT_CONFIG
 
+    store = journal.get()
+    for type, payload in store.replay((journal.CONFIG, journal.CONFIG_CHECKPOINT)):
+      if type == journal.CONFIG_CHECKPOINT:
+        # config.json already holds everything before it
+        with open(CONFIG_FILE, 'r') as confFile:
+          config = ujson.loads(confFile.read())
+      else:
+        config.update(ujson.loads(payload))
+    savedConfig = ujson.loads(ujson.dumps(config))
+    if compactConfig not in store.compactors:
+      store.compactors.append(compactConfig)
+
     if "api-token" in config:
       config["api-token"] = decode_val(config["api-token"])
       
     for entry in config["wifi"]:
       if "password" in entry:
         entry["password"] = decode_val(entry["password"])
+
+    for entry in config.get("mirrors", []):
+      if "api-token" in entry:
+        entry["api-token"] = decode_val(entry["api-token"])
           
     return config
   except Exception as e:
@@ -111,43 +209,31 @@ def randstr(length=20):
   source = 'abcdefghijklmnopqrstuvwxyz1234567890'
   return ''.join([source[x] for x in [(uos.urandom(1)[0] % len(source)) for _ in range(length)]])
 
-def readHtmlFile(filename):
-  try:
-    with open(filename, 'r') as htmlFile:
-      html = htmlFile.read()
-    return html
-  except Exception as e:
-    sys.print_exception(e) 
-    return "<html><body>Error loading page</body></html>"
-  
 def readHtmlConfigFile(filename):
+  # chunks of the config page with the saved configuration filled in
   try:
-    with open(filename, 'r') as htmlFile:
-      html = htmlFile.read()
     config = readConfigFile()
     
-    ignore = ["config","brightness","screen-mode","beeper","locale", "wifi"]
+    ignore = ["config","brightness","screen-mode","beeper","locale", "wifi", "transport", "mirrors"]
+    values = {}
+    for key, value in config.items():
+      if key not in ignore:
+        values[key] = value
     if config.get("beeper") == 0:
-      config["beeper_disabled"] = "selected"
-      config["beeper_enabled"] = ""
+      values["beeper_disabled"] = "selected"
     else:
-      config["beeper_enabled"] = "selected"
-      config["beeper_disabled"] = ""    
-    
-    for key, value in config.items():
-      if key in ignore:
-        continue
-      placeholder = "{{" + key + "}}"
-      if placeholder in html:
-        html = html.replace(placeholder, str(value))
-    
-    wifi_json = ujson.dumps(config.get("wifi", []))
-    html = html.replace("{{wifi_json}}", wifi_json)
+      values["beeper_enabled"] = "selected"
+    if config.get("transport", 0) == 1:
+      values["transport_push"] = "selected"
+    else:
+      values["transport_poll"] = "selected"
+    values["wifi_json"] = ujson.dumps(config.get("wifi", []))
+    values["mirrors_json"] = ujson.dumps(config.get("mirrors", []))
     
-    return html
+    return template.render(template.load(filename), values)
   except Exception as e:
     sys.print_exception(e)
-    return "<html><body>Error loading page</body></html>"  
+    return [template.ERROR_PAGE]
 
 def unquote(string):
     if not string:
@@ -168,13 +254,114 @@ def unquote(string):
         try:
             append(int(item[:2], 16))
             extend(item[2:])
-        except KeyError:
-            append(b'%')
+        except ValueError:
+            extend(b'%')
             extend(item)
 
     return bytes(res)
 
-def open_access_point(successCallback):
+def parseForm(body):
+  # application/x-www-form-urlencoded: (name, value) pairs in order
+  fields = []
+  for entry in body.split(b'&'):
+    k, sep, v = entry.partition(b'=')
+    if not sep: continue
+    fields.append((unquote(k.replace(b'+', b' ')).decode(), unquote(v.replace(b'+', b' ')).decode()))
+  return fields
+
+def parseConfigForm(body):
+  wifi_ssids = []
+  wifi_passwords = []
+  mirror_urls = []
+  mirror_tokens = []
+  config = {}
+  
+  for k, value in parseForm(body):
+    if k == 'ssid':
+        if value: wifi_ssids.append(value)
+    elif k == 'wifi_password':
+        wifi_passwords.append(value)
+    elif k == 'mirror_url':
+        mirror_urls.append(value)
+    elif k == 'mirror_token':
+        mirror_tokens.append(value)
+    else:
+        if value.isdigit(): value = int(value) 
+        config[k] = value
+        print("Saved config parameter " + k)
+        
+  config["wifi"] = []
+  for i in range(len(wifi_ssids)):
+      config["wifi"].append({
+          "ssid": wifi_ssids[i],
+          "password": wifi_passwords[i] if i < len(wifi_passwords) else ""
+      })
+      print("Saved wifi: " + wifi_ssids[i])
+
+  config["mirrors"] = []
+  for i in range(len(mirror_urls)):
+      if not mirror_urls[i]: continue
+      config["mirrors"].append({
+          "api-endpoint": mirror_urls[i],
+          "api-token": mirror_tokens[i] if i < len(mirror_tokens) else ""
+      })
+      print("Saved mirror: " + mirror_urls[i])
+      
+  config[CONFIG] = 1
+  config["brightness"] = 1
+  config["screen-mode"] = 0
+  return config
+
+# web server of the access point
+MAX_HEADERS = 32
+MAX_BODY = 8192 # a form with many wifi networks and mirrors stays far below
+REQUEST_TIMEOUT_SEC = 10 # idle connections (browsers open some ahead) are dropped after this
+SEND_CHUNK = 2048 # bytes written per drain, the socket buffer stays small
+
+async def readRequest(reader):
+  # (method, path, headers, body), the body read up to its Content-Length
+  line = await reader.readline()
+  request = line.decode().split()
+  if len(request) < 2:
+    return None
+  headers = {}
+  for _ in range(MAX_HEADERS):
+    line = await reader.readline()
+    if not line or line == b'\r\n' or line == b'\n':
+      break
+    k, _, v = line.decode().partition(':')
+    headers[k.strip().lower()] = v.strip()
+  length = int(headers.get('content-length', '0'))
+  if length > MAX_BODY:
+    raise ValueError('request body of %d bytes' % length)
+  body = await reader.readexactly(length) if length > 0 else b''
+  return request[0], request[1].split('?')[0], headers, body
+
+def acceptsGzip(headers):
+  # Accept-Encoding lists gzip without q=0
+  for item in headers.get('accept-encoding', '').split(','):
+    name, _, params = item.partition(';')
+    if name.strip().lower() in ('gzip', '*'):
+      q = params.strip()
+      if not q.startswith('q='):
+        return True
+      try:
+        return float(q[2:]) > 0
+      except ValueError:
+        return False
+  return False
+
+async def sendResponse(writer, status, body, gzipped=False, contentType='text/html'):
+  # body: bytes, sent from the buffer in SEND_CHUNK slices
+  writer.write(('HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%sConnection: close\r\n\r\n'
+    % (status, contentType, len(body), 'Content-Encoding: gzip\r\n' if gzipped else '')).encode())
+  view = memoryview(body)
+  for i in range(0, len(body), SEND_CHUNK):
+    writer.write(view[i:i + SEND_CHUNK])
+    await writer.drain()
+  await writer.drain()
+
+async def open_access_point(successCallback):
 
   ap = network.WLAN(network.AP_IF)
   ap.active(True)
@@ -183,79 +370,50 @@ def open_access_point(successCallback):
   ap.config(max_clients=1) 
 
   while ap.active() == False:
-    pass
+    await asyncio.sleep_ms(100)
   
   ipconfig = ap.ifconfig()
 
   print('AP config: ' + str(ipconfig))
 
-  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-  s.bind(('', 80))
-  s.listen(5)
-
-  configHtml = readHtmlConfigFile('config.html')
-  successHtml = readHtmlFile('success.html')
+  # both pages are rendered once, requests are answered from the buffers
+  configHtml = ''.join(readHtmlConfigFile('config.html')).encode()
+  successHtml, successGzipped = template.loadStatic('success.html')
+  if isinstance(successHtml, str):
+    successHtml = successHtml.encode()
+  successPlain = template.loadStatic('success.html', False)[0].encode() if successGzipped else successHtml
 
-  print('Web server is running on port 80')
+  async def serve(reader, writer):
+    try:
+      print('Got a connection from %s' % str(writer.get_extra_info('peername')))
+      request = await asyncio.wait_for(readRequest(reader), REQUEST_TIMEOUT_SEC)
+      if request == None:
+        return
+      method, path, headers, body = request
+      print('%s %s, %d bytes' % (method, path, len(body)))
 
-  while True:
-    conn, addr = s.accept()
-    print('Got a connection from %s' % str(addr))
-    request = conn.recv(1024)
-    contentStr = request.decode()
-    print('Content = %s' % contentStr)
-    splittedRequest = contentStr.split()
-    if not splittedRequest:
-        conn.close()
-        continue
-    #rmethod = splittedRequest[0]
-    rurl = splittedRequest[1]
-  
-    conn.send('HTTP/1.1 200 OK\n')
-    conn.send('Content-Type: text/html\n')
-    conn.send('Connection: close\n\n')
-
-    if rurl.find("/config") != -1:
-      splittedRequest = contentStr.split('\r\n')
-      configParams = splittedRequest[len(splittedRequest)-1]
-      print('Config params: ' + configParams) 
-      entries = configParams.split('&') 
-      
-      wifi_ssids = []
-      wifi_passwords = []
-      config = {}
-      
-      for entry in entries:
-        parts = entry.split('=')
-        if len(parts) != 2: continue
-        k = parts[0]
-        v = parts[1]
-        value = unquote(v).decode()
-        if k == 'ssid':
-            if value: wifi_ssids.append(value)
-        elif k == 'wifi_password':
-            wifi_passwords.append(value)
+      if method == 'POST' and path == '/config':
+        saveConfigFile(parseConfigForm(body))
+        successCallback()
+        if successGzipped and acceptsGzip(headers):
+          await sendResponse(writer, '200 OK', successHtml, True)
         else:
-            if value.isdigit(): value = int(value) 
-            config[k] = value
-            print("Saved config parameter " + k)
-            
-      config["wifi"] = []
-      for i in range(len(wifi_ssids)):
-          config["wifi"].append({
-              "ssid": wifi_ssids[i],
-              "password": wifi_passwords[i] if i < len(wifi_passwords) else ""
-          })
-          print("Saved wifi: " + wifi_ssids[i])
-          
-      config[CONFIG] = 1
-      config["brightness"] = 1
-      config["screen-mode"] = 0
-      saveConfigFile(config)   
-      
-      successCallback()
-      conn.send(successHtml)   
-    else: 
-      conn.send(configHtml)
-      
-    conn.close()
\ No newline at end of file
+          await sendResponse(writer, '200 OK', successPlain)
+      elif method == 'GET' and path == '/favicon.ico':
+        await sendResponse(writer, '404 Not Found', b'', contentType='text/plain')
+      elif method == 'GET':
+        # any other page, captive portal checks of phones included
+        await sendResponse(writer, '200 OK', configHtml)
+      else:
+        await sendResponse(writer, '405 Method Not Allowed', b'', contentType='text/plain')
+    except Exception as e:
+      sys.print_exception(e)
+    finally:
+      writer.close()
+      await writer.wait_closed()
+
+  # every connection is served by its own task, concurrently with the
+  # others and the rest of the app on the same loop
+  server = await asyncio.start_server(serve, '0.0.0.0', 80, 5)
+  print('Web server is running on port 80')
+  await server.wait_closed()
@@ -0,0 +1,85 @@
+# Predicts when the next reading shows up on the server. A reading is
+# dated by the uploader and becomes visible some seconds later (uploader
+# batching, phone to server latency), and the readings are not exactly 5
+# minutes apart. Both are learned from the readings seen: the delay from an
+# entry's date to the moment the device got it and the interval between
+# consecutive entries. The poll time and long-poll timeout come from
+# percentiles of the recent delays, the interval is their median.
+from array import array
+
+DELAY_SAMPLES = 24 # two hours of readings
+INTERVAL_SAMPLES = 12
+MIN_SAMPLES = 3 # below this the defaults apply
+LOW_PERCENTILE = 10
+HIGH_PERCENTILE = 90
+MIN_TIMEOUT_SEC = 10
+
+class ArrivalPredictor:
+  """
+  observe(entryTime, previousTime, seenTime, held) records a new reading
+  (all local seconds), pollTime(lastEntryTime) and timeout() plan the next
+  long-poll, nextArrival(lastEntryTime) is the predicted arrival and
+  overdue(lastEntryTime, now) tells a reading later than usual. `interval`,
+  `leadTime` and `maxTimeout` are the defaults used until enough readings
+  were seen, `maxTimeout` also caps the learned timeout.
+  """
+  def __init__(self, interval, leadTime, maxTimeout):
+    self.defaultInterval = interval
+    self.leadTime = leadTime
+    self.maxTimeout = maxTimeout
+    self.delays = array('H', [0] * DELAY_SAMPLES)
+    self.delayCount = 0
+    self.intervals = array('H', [0] * INTERVAL_SAMPLES)
+    self.intervalCount = 0
+    self.interval = interval
+    self.low = 0 # delay percentiles, seconds
+    self.median = 0
+    self.high = maxTimeout - 2 * leadTime
+
+  def observe(self, entryTime, previousTime, seenTime, held):
+    # `held`: the server answered a long-poll when the reading came in, so
+    # seenTime is its arrival. Otherwise the reading was already there and
+    # arrived earlier than seen: it is recorded leadTime earlier, the poll
+    # window creeps earlier until the server holds the poll again.
+    if previousTime > 0:
+      interval = entryTime - previousTime
+      if self.defaultInterval // 2 <= interval <= self.defaultInterval * 3 // 2:
+        self.intervals[self.intervalCount % INTERVAL_SAMPLES] = interval
+        self.intervalCount += 1
+    delay = seenTime - entryTime
+    if not held:
+      delay -= self.leadTime
+    if delay < 0 or delay > self.interval:
+      return # clocks off or a reading missed during an outage
+    self.delays[self.delayCount % DELAY_SAMPLES] = delay
+    self.delayCount += 1
+    self.update()
+
+  def update(self):
+    n = min(self.intervalCount, INTERVAL_SAMPLES)
+    if n >= MIN_SAMPLES:
+      self.interval = percentile(self.intervals, n, 50)
+    n = min(self.delayCount, DELAY_SAMPLES)
+    if n >= MIN_SAMPLES:
+      self.low = percentile(self.delays, n, LOW_PERCENTILE)
+      self.median = percentile(self.delays, n, 50)
+      self.high = percentile(self.delays, n, HIGH_PERCENTILE)
+
+  def nextArrival(self, lastEntryTime):
+    return lastEntryTime + self.interval + self.median
+
+  def pollTime(self, lastEntryTime):
+    # leadTime before the earliest usual arrival
+    return lastEntryTime + self.interval + self.low - self.leadTime
+
+  def overdue(self, lastEntryTime, now):
+    # later than leadTime after the latest usual arrival
+    return now > lastEntryTime + self.interval + self.high + self.leadTime
+
+  def timeout(self):
+    # covers the usual arrivals, from pollTime() to leadTime after the latest
+    return min(self.maxTimeout, max(MIN_TIMEOUT_SEC, self.high - self.low + 2 * self.leadTime))
+
+def percentile(samples, n, p):
+  s = sorted(samples[:n])
+  return s[(n - 1) * p // 100]
@@ -0,0 +1,155 @@
+# Trend arrow. The arrow outlines are rotated once, at startup, for every
+# angle on a STEP_DEG grid between up and down (the 7 directions all lie on
+# it), and kept as integer vertex lists: drawing needs no trig. A resting
+# arrow is rasterised once per (direction, colour) into an off-screen canvas
+# and then painted with a single push, a direction change rotates the arrow
+# across the grid angles in between.
+
+import math
+import render
+
+ANGLES = {"DoubleUp": 0, "DoubleDown": 180, "SingleUp": 0, "SingleDown": 180, "Flat": 90, "FortyFiveUp": 45, "FortyFiveDown": 135}
+STEP_DEG = 15 # rotation per animation frame
+SPRITE_CACHE = 4 # resting arrows kept rasterised per widget, the least recently used one is dropped
+
+def shape(radius, angle, isDouble):
+  """
+  (circleR, triangles) of the arrow centered on (0, 0) and pointing at
+  `angle` degrees clockwise from up: the radius of the black disc behind it
+  and the (x0, y0, x1, y1, x2, y2) triangles of the heads and the stem.
+  """
+  # Base radius for length calculations
+  r = radius + 16
+
+  if isDouble:
+    tri_h = r * 0.7
+    tri_w = r * 0.9
+    stem_l = r * 0.4
+    stem_w = r * 0.3
+    # Head 1 tip at off1, Head 2 tip at off2, overlapping by half
+    off1 = r * 0.5
+    off2 = off1 - tri_h * 0.5
+    heads = (off1, off2)
+    # Total span: from (off2 - tri_h - stem_l) to off1
+    total_len = off1 - (off2 - tri_h - stem_l)
+    shift = off1 - total_len / 2
+  else:
+    tri_h = r * 0.75
+    tri_w = r * 1.0
+    stem_l = r * 0.6
+    stem_w = r * 0.3
+    heads = (r,)
+    total_len = tri_h + stem_l
+    # Tip is at 'r', end is at 'r - total_len', shifted to center the span
+    shift = r - total_len / 2
+  circleR = int(total_len / 2) + 6
+
+  rad = math.radians(angle - 90)
+  cos = math.cos(rad)
+  sin = math.sin(rad)
+
+  def rotated(px, py):
+    px -= shift
+    return int(round(px * cos - py * sin)), int(round(px * sin + py * cos))
+
+  triangles = []
+  for off in heads:
+    triangles.append(rotated(off, 0) + rotated(off - tri_h, -tri_w/2) + rotated(off - tri_h, tri_w/2))
+  # stem from the base of the last head
+  s_off = heads[-1] - tri_h
+  s1 = rotated(s_off, -stem_w/2)
+  s2 = rotated(s_off, stem_w/2)
+  s3 = rotated(s_off - stem_l, stem_w/2)
+  s4 = rotated(s_off - stem_l, -stem_w/2)
+  triangles.append(s1 + s2 + s3)
+  triangles.append(s1 + s3 + s4)
+  return circleR, tuple(triangles)
+
+class ArrowWidget(render.Widget):
+  """
+  Value is a (direction, color) tuple, directions not in ANGLES show the
+  empty disc. With `animate` set a new direction is reached in STEP_DEG
+  steps: moving() tells whether the arrow is on its way, step() advances it
+  by one frame.
+  """
+  def __init__(self, x, y, w, h, radius):
+    super().__init__(x, y, w, h)
+    self.radius = radius
+    self.shapes = {} # (angle, isDouble) -> shape()
+    for angle in range(0, 180 + STEP_DEG, STEP_DEG):
+      for isDouble in (False, True):
+        self.shapes[(angle, isDouble)] = shape(radius, angle, isDouble)
+    # one square for every arrow: the disc of the double arrow is the larger one
+    self.side = 2 * max(s[0] for s in self.shapes.values()) + 1
+    self.sprites = {} # (angle, isDouble, color) -> canvas
+    self.used = [] # their keys, least recently used first
+    self.spritesOk = True
+    self.angle = None # painted, differs from target while rotating
+    self.target = None
+    self.animate = False
+
+  def set(self, value):
+    if value == self.value:
+      return
+    self.value = value
+    self.dirty = True
+    self.target = ANGLES.get(value[0]) if value != None else None
+    if not self.animate or self.angle == None or self.target == None:
+      self.angle = self.target
+
+  def moving(self):
+    return self.angle != self.target
+
+  def step(self):
+    if self.angle == self.target:
+      return False
+    if self.target > self.angle:
+      self.angle = min(self.target, self.angle + STEP_DEG)
+    else:
+      self.angle = max(self.target, self.angle - STEP_DEG)
+    self.dirty = True
+    return self.angle != self.target
+
+  def draw(self, gfx):
+    cx = self.x + int(self.w / 2)
+    cy = self.y + int(self.h / 2)
+    if self.angle == None:
+      gfx.fillCircle(cx, cy, int(self.w / 2), render.BLACK)
+      return
+    direction, color = self.value
+    isDouble = direction.startswith("Double")
+    if self.angle == self.target and self.spritesOk:
+      sprite = self.sprite(gfx, isDouble, color)
+      if sprite != None:
+        half = self.side // 2
+        sprite.push(cx - half, cy - half)
+        return
+    self.paint(gfx, cx, cy, self.angle, isDouble, color)
+
+  def paint(self, gfx, cx, cy, angle, isDouble, color):
+    circleR, triangles = self.shapes[(angle, isDouble)]
+    gfx.fillCircle(cx, cy, circleR, render.BLACK)
+    for t in triangles:
+      gfx.fillTriangle(cx + t[0], cy + t[1], cx + t[2], cy + t[3], cx + t[4], cy + t[5], color)
+
+  def sprite(self, gfx, isDouble, color):
+    key = (self.angle, isDouble, color)
+    sprite = self.sprites.get(key)
+    if sprite != None:
+      self.used.remove(key)
+    else:
+      if len(self.used) >= SPRITE_CACHE:
+        self.sprites.pop(self.used.pop(0)).delete()
+      try:
+        sprite = gfx.newCanvas(self.side, self.side, 16, True)
+      except Exception as e:
+        # no canvas support or no memory left: draw the outlines directly
+        print("Arrow sprites disabled:", e)
+        self.spritesOk = False
+        return None
+      half = self.side // 2
+      sprite.fillRect(0, 0, self.side, self.side, render.BLACK)
+      self.paint(sprite, half, half, self.angle, isDouble, color)
+      self.sprites[key] = sprite
+    self.used.append(key)
+    return sprite
@@ -0,0 +1,76 @@
+# Battery state read from the PMIC once per sample period and shared by
+# every reader. A reading is four I2C transactions (voltage, level, charging,
+# current); the screen, the emergency checks and the beeper used to do them
+# on every call, several times a second. The level shown is the moving
+# average of the last samples, the charge/discharge rate comes from one
+# averaged level per minute over the last RATE_MINUTES.
+from array import array
+import utime
+
+SAMPLE_MS = 10000
+AVERAGE_SAMPLES = 6 # a minute of samples
+RATE_MINUTES = 30
+NO_BATTERY = 101 # level reported when no battery is present
+
+class BatterySampler:
+  """
+  sample() reads the PMIC, everything else is cached: `level` (0..100,
+  NO_BATTERY without a battery), `charging`, `voltage` (mV), `current` (mA)
+  and `rate` (percent per hour, negative while discharging).
+  """
+  def __init__(self, power, periodMs=SAMPLE_MS):
+    self.power = power
+    self.periodMs = periodMs
+    self.samples = array('B', [0] * AVERAGE_SAMPLES)
+    self.count = 0
+    self.minutes = array('B', [0] * RATE_MINUTES) # ring of per minute levels
+    self.minuteCount = 0
+    self.minuteTicks = 0
+    self.voltage = 0
+    self.current = 0
+    self.charging = False
+    self.level = NO_BATTERY
+    self.rate = 0
+
+  def sample(self):
+    p = self.power
+    self.voltage = p.getBatteryVoltage()
+    raw = p.getBatteryLevel()
+    self.charging = p.isCharging()
+    self.current = p.getBatteryCurrent()
+    if not (5800 < self.voltage < 8500 and abs(self.current) > 10):
+      # no battery present, forget the history of the last one
+      self.level = NO_BATTERY
+      self.count = 0
+      self.minuteCount = 0
+      self.rate = 0
+      return
+    raw = min(100, max(0, raw))
+    self.samples[self.count % AVERAGE_SAMPLES] = raw
+    self.count += 1
+    n = min(self.count, AVERAGE_SAMPLES)
+    total = 0
+    for i in range(n):
+      total += self.samples[i]
+    self.level = (total + n // 2) // n
+    now = utime.ticks_ms()
+    if self.minuteCount == 0 or utime.ticks_diff(now, self.minuteTicks) >= 60000:
+      self.minuteTicks = now
+      self.minutes[self.minuteCount % RATE_MINUTES] = self.level
+      self.minuteCount += 1
+      self.updateRate()
+
+  def updateRate(self):
+    n = min(self.minuteCount, RATE_MINUTES)
+    if n < 2:
+      self.rate = 0
+      return
+    newest = self.minutes[(self.minuteCount - 1) % RATE_MINUTES]
+    oldest = self.minutes[(self.minuteCount - n) % RATE_MINUTES]
+    self.rate = (newest - oldest) * 60 / (n - 1)
+
+  def timeToEmpty(self):
+    # minutes left at the current discharge rate, None when not discharging
+    if self.level == NO_BATTERY or self.charging or self.rate >= 0:
+      return None
+    return int(self.level * 60 / -self.rate)
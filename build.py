@@ -0,0 +1,91 @@
+"""
+Builds what copyBuild.sh deploys, into build/:
+
+- the device modules cross-compiled to .mpy with mpy-cross, so the device
+  loads bytecode instead of compiling the source on every boot. main.py
+  becomes app.mpy plus a main.py that imports it: the file run at boot is
+  always compiled from source.
+- the HTML pages without their indentation, those with {{name}} slots
+  pre-split into static chunks and slot names (page.parts, see
+  template.py), the static ones with --gzip also gzipped (page.gz).
+
+  python build.py [--gzip] [--mpy-cross PATH] [--out DIR]
+
+mpy-cross has to match the firmware's MicroPython version (pip install
+mpy-cross==<version>). Without it the modules are copied as source.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+
+import template
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ("main.py", "ap.py", "template.py", "render.py", "chart.py", "httpclient.py", "jsonstream.py", "history.py",
+  "journal.py", "scheduler.py", "battery.py", "power.py", "arrival.py", "push.py", "endpoints.py", "wifi.py", "arrow.py", "glyphs.py", "environment.py", "forecast.py")
+PAGES = ("config.html", "success.html")
+APP_MODULE = "app" # main.py compiled under this name
+LOADER = "import " + APP_MODULE + "\n"
+
+def findMpyCross(path):
+  if path:
+    return [path]
+  if shutil.which("mpy-cross"):
+    return ["mpy-cross"]
+  try:
+    import mpy_cross # pip install mpy-cross
+    return [sys.executable, "-m", "mpy_cross"]
+  except ImportError:
+    return None
+
+def buildModules(out, mpyCross):
+  for name in MODULES:
+    src = os.path.join(REPO_DIR, name)
+    base = APP_MODULE if name == "main.py" else name[:-3]
+    if mpyCross is None:
+      shutil.copy(src, os.path.join(out, base + ".py"))
+    else:
+      subprocess.run(mpyCross + ["-o", os.path.join(out, base + ".mpy"), src], check=True)
+  with open(os.path.join(out, "main.py"), "w") as f:
+    f.write(LOADER)
+
+def buildPages(out, gz):
+  for name in PAGES:
+    with open(os.path.join(REPO_DIR, name), "r", encoding="utf-8") as f:
+      # line breaks are kept, scripts may rely on them
+      html = "\n".join(line.lstrip() for line in f.read().split("\n"))
+    parts = template.split(html)
+    if len(parts) > 1:
+      with open(os.path.join(out, name + ".parts"), "w", encoding="utf-8") as f:
+        f.write(template.SEPARATOR.join(parts))
+    else:
+      if gz:
+        with open(os.path.join(out, name + ".gz"), "wb") as f:
+          f.write(gzip.compress(html.encode("utf-8"), 9, mtime=0))
+      # served to clients not accepting gzip
+      with open(os.path.join(out, name), "w", encoding="utf-8") as f:
+        f.write(html)
+
+def main():
+  parser = argparse.ArgumentParser(description="Builds the device files into an output directory.")
+  parser.add_argument("--gzip", action="store_true", help="gzip the pages without slots")
+  parser.add_argument("--mpy-cross", help="mpy-cross executable, found on PATH or as the pip package otherwise")
+  parser.add_argument("--out", default=os.path.join(REPO_DIR, "build"))
+  args = parser.parse_args()
+
+  mpyCross = findMpyCross(args.mpy_cross)
+  if mpyCross is None:
+    print("mpy-cross not found, modules are copied as source", file=sys.stderr)
+  if os.path.isdir(args.out):
+    shutil.rmtree(args.out)
+  os.makedirs(args.out)
+  buildModules(args.out, mpyCross)
+  buildPages(args.out, args.gzip)
+  for name in sorted(os.listdir(args.out)):
+    print("%-24s %6d" % (name, os.path.getsize(os.path.join(args.out, name))))
+
+if __name__ == "__main__":
+  main()
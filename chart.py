@@ -0,0 +1,143 @@
+# Glucose history chart drawn as a sweep: x is the reading time modulo the
+# chart window, so the plot never has to be scrolled. A new reading erases a
+# narrow band ahead of the cursor, restores the threshold lines across it and
+# draws one segment, a handful of primitives instead of a full repaint.
+
+from array import array
+import render
+
+CHART_WINDOW_SEC = 3 * 3600
+MIN_SGV = 40
+MAX_SGV = 400
+GAP_PX = 40 # erased band ahead of the cursor
+DOT_R = 4
+MAX_SEGMENT_SEC = 900 # don't connect readings further apart (sensor gaps)
+LABEL_W = 70
+
+class ChartWidget(render.Widget):
+  """
+  Value is the timestamp of the newest reading, setting a newer one makes
+  the next flush append it. `source()` returns [(seconds, sgv), ...] sorted
+  oldest first, timestamps in local epoch seconds.
+  """
+  def __init__(self, x, y, w, h, source, font=None):
+    super().__init__(x, y, w, h)
+    self.source = source
+    self.font = font
+    self.painted = False
+    self.last = None # (seconds, x, y) of the newest plotted reading
+    self.changed = [] # rects the last draw changed
+    self.yLut = None
+
+  def configure(self, low, high, emergencyLow, emergencyHigh, colors, window=CHART_WINDOW_SEC):
+    # colors: (low, inRange, high, band); y pixels are precomputed per sgv value
+    self.window = window
+    self.colors = colors
+    self.px0 = self.x + LABEL_W
+    self.pw = self.w - LABEL_W - 10
+    top = self.y + 10
+    ph = self.h - 20
+    self.yLut = array('H', [0] * (MAX_SGV - MIN_SGV + 1))
+    for v in range(MIN_SGV, MAX_SGV + 1):
+      self.yLut[v - MIN_SGV] = top + ph - 1 - ((v - MIN_SGV) * (ph - 1)) // (MAX_SGV - MIN_SGV)
+    self.bands = []
+    for v, c in ((emergencyLow, colors[0]), (low, colors[3]), (high, colors[3]), (emergencyHigh, colors[2])):
+      self.bands.append((v, self.yOf(v), c))
+    self.low = low
+    self.high = high
+    self.painted = False
+    self.dirty = True
+
+  def yOf(self, sgv):
+    if sgv < MIN_SGV: sgv = MIN_SGV
+    elif sgv > MAX_SGV: sgv = MAX_SGV
+    return self.yLut[sgv - MIN_SGV]
+
+  def xOf(self, seconds):
+    return self.px0 + ((seconds % self.window) * self.pw) // self.window
+
+  def colorOf(self, sgv):
+    if sgv < self.low: return self.colors[0]
+    if sgv > self.high: return self.colors[2]
+    return self.colors[1]
+
+  def invalidate(self):
+    self.painted = False
+
+  def damage(self):
+    return self.changed
+
+  def draw(self, gfx):
+    self.changed = []
+    points = self.source()
+    if self.painted and self.last != None:
+      new = [p for p in points if p[0] > self.last[0]]
+      if new and new[-1][0] - self.last[0] < self.window - GAP_PX * self.window // self.pw:
+        for p in new:
+          self.append(gfx, p[0], p[1])
+        return
+      if not new:
+        return
+    self.full(gfx, points)
+
+  def full(self, gfx, points):
+    bg = render.BLACK
+    gfx.fillRect(self.x, self.y, self.w, self.h, bg)
+    self.changed = [(self.x, self.y, self.w, self.h)]
+    if self.font != None:
+      gfx.setFont(self.font)
+      gfx.setTextSize(1)
+      fh = gfx.fontHeight()
+    for v, y, c in self.bands:
+      gfx.drawLine(self.px0, y, self.px0 + self.pw - 1, y, c)
+      if self.font != None:
+        gfx.setTextColor(c, bg)
+        gfx.drawString(str(v), self.x + 5, y - int(fh / 2))
+    # replay the last window exactly as the sweep would have drawn it, so
+    # a full repaint and the incrementally maintained plot are identical
+    self.last = None
+    if points:
+      newest = points[-1][0]
+      for p in points:
+        if newest - p[0] < self.window:
+          self.append(gfx, p[0], p[1])
+    self.painted = True
+
+  def erase(self, gfx, x0, x1):
+    # clears columns x0..x1, taken modulo the plot width, and restores the bands
+    px0 = self.px0
+    pw = self.pw
+    right = px0 + pw
+    if x1 - x0 + 1 >= pw:
+      spans = ((px0, right - 1),)
+    else:
+      a = px0 + (x0 - px0) % pw
+      b = a + x1 - x0
+      if b < right:
+        spans = ((a, b),)
+      else:
+        spans = ((a, right - 1), (px0, b - pw))
+    for a, b in spans:
+      self.changed.append((a, self.y, b - a + 1, self.h))
+      gfx.fillRect(a, self.y, b - a + 1, self.h, render.BLACK)
+      for v, y, c in self.bands:
+        gfx.drawLine(a, y, b, y, c)
+
+  def append(self, gfx, seconds, sgv):
+    x = self.xOf(seconds)
+    y = self.yOf(sgv)
+    c = self.colorOf(sgv)
+    last = self.last
+    if last == None:
+      self.erase(gfx, x - DOT_R, x + GAP_PX)
+    elif x < last[1]:
+      # wrapped, erase from the old cursor around the right edge
+      self.erase(gfx, last[1] + DOT_R + 1, x + self.pw + GAP_PX)
+    else:
+      self.erase(gfx, last[1] + DOT_R + 1, x + GAP_PX)
+    if last != None and x > last[1] and seconds - last[0] <= MAX_SEGMENT_SEC:
+      gfx.drawLine(last[1], last[2], x, y, c)
+      self.changed.append((last[1], min(last[2], y), x - last[1] + 1, abs(y - last[2]) + 1))
+    gfx.fillCircle(x, y, DOT_R, c)
+    self.changed.append((x - DOT_R, y - DOT_R, 2 * DOT_R + 1, 2 * DOT_R + 1))
+    self.last = (seconds, x, y)
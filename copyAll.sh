@@ -1,4 +1,22 @@
 ampy --port /dev/ttyACM0 put main.py
 ampy --port /dev/ttyACM0 put ap.py
+ampy --port /dev/ttyACM0 put template.py
+ampy --port /dev/ttyACM0 put render.py
+ampy --port /dev/ttyACM0 put chart.py
+ampy --port /dev/ttyACM0 put httpclient.py
+ampy --port /dev/ttyACM0 put jsonstream.py
+ampy --port /dev/ttyACM0 put history.py
+ampy --port /dev/ttyACM0 put journal.py
+ampy --port /dev/ttyACM0 put scheduler.py
+ampy --port /dev/ttyACM0 put battery.py
+ampy --port /dev/ttyACM0 put power.py
+ampy --port /dev/ttyACM0 put arrival.py
+ampy --port /dev/ttyACM0 put push.py
+ampy --port /dev/ttyACM0 put endpoints.py
+ampy --port /dev/ttyACM0 put wifi.py
+ampy --port /dev/ttyACM0 put arrow.py
+ampy --port /dev/ttyACM0 put glyphs.py
+ampy --port /dev/ttyACM0 put environment.py
+ampy --port /dev/ttyACM0 put forecast.py
 ampy --port /dev/ttyACM0 put config.html
 ampy --port /dev/ttyACM0 put success.html
@@ -0,0 +1,9 @@
+python3 build.py "$@" || exit 1
+cd build
+# a .py left on the device would be imported instead of the .mpy
+for f in *.mpy; do
+  ampy --port /dev/ttyACM0 rm "${f%.mpy}.py" 2>/dev/null
+done
+for f in *; do
+  ampy --port /dev/ttyACM0 put "$f"
+done
@@ -0,0 +1,88 @@
+# Nightscout endpoints in the configured order, the primary first and then
+# its mirrors, each with its own token, kept connection and health: a
+# moving average of the request time and of the error rate. Requests go to
+# the healthiest endpoint. One that failed is skipped for a cooldown that
+# doubles with each consecutive failure, so a stalled primary costs one
+# timeout now and then instead of one per poll, and its error rate fades
+# while it is not used so it gets another chance.
+import httpclient
+import utime
+
+AVERAGE_WEIGHT = 4 # moving averages over about this many requests
+ERROR_PENALTY_MS = 20000 # an error rate of 1 weighs like this much request time
+ERROR_HALF_LIFE_SEC = 600 # the error rate halves in this time without requests
+MIN_COOLDOWN_SEC = 30
+MAX_COOLDOWN_SEC = 600
+ORDER_MARGIN_MS = 500 # a later endpoint has to be this much faster to be preferred
+
+class Endpoint:
+  def __init__(self, url, token, index):
+    self.url = url
+    self.token = token
+    self.index = index
+    self.host = httpclient.splitUrl(url)[1]
+    self.client = httpclient.KeepAliveClient()
+    self.latencyMs = 0 # unknown until the first request
+    self.errorRate = 0
+    self.errorTime = 0
+    self.failures = 0 # consecutive
+    self.downUntil = 0
+    self.requests = 0
+    self.errors = 0
+
+  def currentErrorRate(self, now):
+    if self.errorRate == 0:
+      return 0
+    return self.errorRate * 0.5 ** ((now - self.errorTime) / ERROR_HALF_LIFE_SEC)
+
+  def score(self, now):
+    return self.latencyMs + self.currentErrorRate(now) * ERROR_PENALTY_MS + self.index * ORDER_MARGIN_MS
+
+  def succeeded(self, ms=None):
+    # ms: request time, None for long-polls (their time is the server's wait)
+    now = utime.time()
+    self.requests += 1
+    if ms != None:
+      self.latencyMs = ms if self.latencyMs == 0 else self.latencyMs + (ms - self.latencyMs) // AVERAGE_WEIGHT
+    rate = self.currentErrorRate(now)
+    self.errorRate = rate - rate / AVERAGE_WEIGHT
+    self.errorTime = now
+    self.failures = 0
+    self.downUntil = 0
+
+  def failed(self):
+    now = utime.time()
+    self.requests += 1
+    self.errors += 1
+    rate = self.currentErrorRate(now)
+    self.errorRate = rate + (1 - rate) / AVERAGE_WEIGHT
+    self.errorTime = now
+    self.failures += 1
+    self.downUntil = now + min(MAX_COOLDOWN_SEC, MIN_COOLDOWN_SEC * 2 ** (self.failures - 1))
+    self.client.close() # state of the kept connection is unknown
+
+class EndpointPool:
+  """
+  ranked() lists the endpoints to try, healthiest first. Endpoints in
+  their cooldown are left out unless all of them are, then the one coming
+  back first is tried. The caller reports every request's outcome to the
+  endpoint with succeeded(ms) or failed().
+  """
+  def __init__(self, endpoints):
+    # endpoints: (url, token) pairs, the primary first
+    self.endpoints = [Endpoint(url, token, i) for i, (url, token) in enumerate(endpoints)]
+
+  def ranked(self):
+    now = utime.time()
+    up = [e for e in self.endpoints if e.downUntil <= now]
+    if len(up) == 0:
+      return [min(self.endpoints, key=lambda e: e.downUntil)]
+    return sorted(up, key=lambda e: e.score(now))
+
+  def close(self):
+    for e in self.endpoints:
+      e.client.close()
+
+  def report(self):
+    for e in self.endpoints:
+      print("Endpoint %s: %d ms, %d/%d errors, error rate %.2f" % (e.host, e.latencyMs, e.errors, e.requests, e.currentErrorRate(utime.time())))
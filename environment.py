@@ -0,0 +1,63 @@
+# ENV unit (temperature, pressure, humidity) sampled by its own task. The
+# unit sits on a 40 kHz I2C bus and every read waits for a conversion, so
+# it is read once per sample period instead of on every screen update. The
+# values shown are the moving average of the last samples, the trends
+# (change per hour) come from the averages over the last TREND_SAMPLES.
+from array import array
+
+SAMPLE_MS = 60000
+AVERAGE_SAMPLES = 5
+TREND_SAMPLES = 60 # an hour of averages at the default period
+TREND_MIN_SAMPLES = 10 # fewer averages give no trend
+
+class EnvSampler:
+  """
+  sample() reads the unit, everything else is cached: `temperature` (C),
+  `pressure` (hPa) and `humidity` (%) as averages, None before the first
+  sample or after a failed one, and `temperatureTrend` and `pressureTrend`
+  per hour, 0 while there are too few averages.
+  """
+  def __init__(self, unit, periodMs=SAMPLE_MS):
+    self.unit = unit
+    self.periodMs = periodMs
+    self.samples = (array('f', [0] * AVERAGE_SAMPLES), array('f', [0] * AVERAGE_SAMPLES), array('f', [0] * AVERAGE_SAMPLES))
+    self.count = 0
+    self.history = (array('f', [0] * TREND_SAMPLES), array('f', [0] * TREND_SAMPLES)) # temperature, pressure averages
+    self.historyCount = 0
+    self.temperature = None
+    self.pressure = None
+    self.humidity = None
+    self.temperatureTrend = 0
+    self.pressureTrend = 0
+
+  def sample(self):
+    u = self.unit
+    try:
+      values = (u.read_temperature(), u.read_pressure(), u.read_humidity())
+    except Exception as e:
+      print("ENV unit read failed:", e)
+      self.temperature = self.pressure = self.humidity = None
+      return False
+    i = self.count % AVERAGE_SAMPLES
+    for k in range(3):
+      self.samples[k][i] = values[k]
+    self.count += 1
+    n = min(self.count, AVERAGE_SAMPLES)
+    averages = [sum(self.samples[k][j] for j in range(n)) / n for k in range(3)]
+    self.temperature, self.pressure, self.humidity = averages
+
+    h = self.historyCount % TREND_SAMPLES
+    self.history[0][h] = self.temperature
+    self.history[1][h] = self.pressure
+    self.historyCount += 1
+    self.temperatureTrend = self.trend(self.history[0])
+    self.pressureTrend = self.trend(self.history[1])
+    return True
+
+  def trend(self, ring):
+    n = min(self.historyCount, TREND_SAMPLES)
+    if n < TREND_MIN_SAMPLES:
+      return 0
+    newest = ring[(self.historyCount - 1) % TREND_SAMPLES]
+    oldest = ring[(self.historyCount - n) % TREND_SAMPLES]
+    return (newest - oldest) * 3600000 / ((n - 1) * self.periodMs)
@@ -0,0 +1,128 @@
+# Local glucose trend and short-term prediction. The newest readings are
+# kept in a small fixed ring of integers; rate of change and predictions
+# come from a least-squares line through the readings of the last
+# FIT_WINDOW_SEC, computed in integers (minutes relative to the newest
+# reading, mg/dL relative to its value) so the sums stay small ints and an
+# update costs a few dozen integer operations. A predicted low or high is
+# only an alert once it is confirmed, see Forecaster.
+from array import array
+
+CAPACITY = 8 # readings kept, more than a fit window of 5 minute readings
+FIT_WINDOW_SEC = 25 * 60 # readings this much older than the newest are not fitted
+MIN_READINGS = 3 # fewer in the window and there is no trend
+ALERT_MIN = 15 # predicted this far ahead
+ALERT_CONFIRM = 2 # readings in a row predicting the same low or high
+ALERT_MARGIN = 20 # mg/dL, a reading further than this from the limit is not alerted on
+# Nightscout's direction limits in mg/dL per minute, times 10
+DIRECTIONS = ((-30, "DoubleDown"), (-20, "SingleDown"), (-10, "FortyFiveDown"), (10, "Flat"), (20, "FortyFiveUp"), (30, "SingleUp"))
+
+class Forecaster:
+  """
+  add(seconds, sgv) records a reading, readings not newer than the newest
+  one are ignored. After each add `rate10` is the rate of change in
+  mg/dL per minute times 10 (None without enough readings), predict(min)
+  the sgv expected that many minutes after the newest reading and
+  direction() the Nightscout direction of the rate. With limits set by
+  configure(low, high) `alert` is the sgv predicted ALERT_MIN ahead while it
+  is at or below low or above high for ALERT_CONFIRM readings in a row, the
+  newest of them within ALERT_MARGIN of the limit, None otherwise.
+  """
+  def __init__(self):
+    self.times = array('I', [0] * CAPACITY)
+    self.values = array('H', [0] * CAPACITY)
+    self.head = 0
+    self.count = 0
+    self.rate10 = None
+    # the fit: sums over n readings, x in minutes and y in mg/dL from the newest
+    self.n = 0
+    self.sx = 0
+    self.sy = 0
+    self.num = 0 # n*sxy - sx*sy
+    self.den = 0 # n*sxx - sx*sx
+    self.low = None
+    self.high = None
+    self.alert = None
+    self.alertKind = 0 # -1 low, 1 high, 0 none predicted by the newest reading
+    self.alertRun = 0 # readings in a row predicting it
+
+  def configure(self, low, high):
+    self.low = low
+    self.high = high
+
+  def newest(self):
+    if self.count == 0:
+      return -1
+    return self.times[(self.head - 1) % CAPACITY]
+
+  def add(self, seconds, sgv):
+    if seconds <= self.newest():
+      return False
+    self.times[self.head] = seconds
+    self.values[self.head] = sgv
+    self.head = (self.head + 1) % CAPACITY
+    self.count = min(self.count + 1, CAPACITY)
+    self.fit()
+    self.checkAlert(sgv)
+    return True
+
+  def fit(self):
+    t0 = self.newest()
+    v0 = self.values[(self.head - 1) % CAPACITY]
+    n = sx = sy = sxx = sxy = 0
+    for i in range(self.count):
+      s = (self.head - 1 - i) % CAPACITY
+      dt = t0 - self.times[s]
+      if dt > FIT_WINDOW_SEC:
+        break
+      x = -((dt + 30) // 60)
+      y = self.values[s] - v0
+      n += 1
+      sx += x
+      sy += y
+      sxx += x * x
+      sxy += x * y
+    self.n = n
+    self.sx = sx
+    self.sy = sy
+    self.num = n * sxy - sx * sy
+    self.den = n * sxx - sx * sx
+    if n < MIN_READINGS or self.den == 0:
+      self.rate10 = None
+    else:
+      self.rate10 = div(10 * self.num, self.den)
+
+  def checkAlert(self, sgv):
+    predicted = self.predict(ALERT_MIN)
+    kind = 0
+    if predicted != None and self.low != None:
+      # the fit lags a turn: the step from the previous reading, extended
+      # as far, has to cross the limit too
+      prev = (self.head - 2) % CAPACITY
+      last = sgv + div((sgv - self.values[prev]) * ALERT_MIN * 60, self.newest() - self.times[prev])
+      if predicted <= self.low and last <= self.low and sgv <= self.low + ALERT_MARGIN:
+        kind = -1
+      elif predicted > self.high and last > self.high and sgv > self.high - ALERT_MARGIN:
+        kind = 1
+    self.alertRun = self.alertRun + 1 if kind != 0 and kind == self.alertKind else (1 if kind != 0 else 0)
+    self.alertKind = kind
+    self.alert = predicted if self.alertRun >= ALERT_CONFIRM else None
+
+  def predict(self, minutes):
+    if self.rate10 == None:
+      return None
+    # the fitted line at `minutes`: (sy*den + num*(n*minutes - sx)) / (n*den)
+    v0 = self.values[(self.head - 1) % CAPACITY]
+    n = self.n
+    return v0 + div(self.sy * self.den + self.num * (n * minutes - self.sx), n * self.den)
+
+  def direction(self):
+    if self.rate10 == None:
+      return "NONE"
+    for limit, name in DIRECTIONS:
+      if self.rate10 < limit:
+        return name
+    return "DoubleUp"
+
+def div(a, b):
+  # a / b rounded to the nearest integer, b > 0
+  return (2 * a + b) // (2 * b)
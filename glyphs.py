@@ -0,0 +1,162 @@
+# Digit atlas for the big numerals. Scaled font glyphs are slow to
+# rasterise, and laying out a string asks the font for its width. The
+# characters of SGV values and the clock are rendered once per font, size
+# and colour into small off-screen canvases and their advances measured
+# once: a GlyphWidget lays out its text from the cached advances and
+# repaints only the characters that changed, each with one push.
+
+import render
+
+CHARS = "0123456789:+-()"
+GLYPH_CACHE = 16 # glyph canvases kept per atlas, the least recently used one is dropped
+
+class GlyphAtlas:
+  """
+  Glyphs of CHARS in one font and size on a `bg` background. metrics(gfx)
+  measures them (once), width(text) is the advance of a text made of CHARS
+  only and None otherwise, glyph(gfx, ch, color) is the canvas of one
+  character, None without canvas support.
+  """
+  def __init__(self, font, size, bg=render.BLACK):
+    self.font = font
+    self.size = size
+    self.bg = bg
+    self.advances = None # char -> width
+    self.height = 0
+    self.sprites = {} # (char, color) -> canvas
+    self.used = [] # their keys, least recently used first
+    self.spritesOk = True
+
+  def metrics(self, gfx):
+    if self.advances != None:
+      return
+    gfx.setFont(self.font)
+    gfx.setTextSize(self.size)
+    self.advances = {}
+    for ch in CHARS:
+      self.advances[ch] = gfx.textWidth(ch)
+    self.height = gfx.fontHeight()
+    gfx.setTextSize(1)
+
+  def width(self, text):
+    w = 0
+    for ch in text:
+      a = self.advances.get(ch)
+      if a == None:
+        return None
+      w += a
+    return w
+
+  def glyph(self, gfx, ch, color):
+    if not self.spritesOk:
+      return None
+    key = (ch, color)
+    sprite = self.sprites.get(key)
+    if sprite != None:
+      self.used.remove(key)
+    else:
+      if len(self.used) >= GLYPH_CACHE:
+        self.sprites.pop(self.used.pop(0)).delete()
+      try:
+        sprite = gfx.newCanvas(self.advances[ch], self.height, 16, True)
+      except Exception as e:
+        # no canvas support or no memory left: characters are drawn as text
+        print("Glyph sprites disabled:", e)
+        self.spritesOk = False
+        return None
+      sprite.fillRect(0, 0, self.advances[ch], self.height, self.bg)
+      sprite.setFont(self.font)
+      sprite.setTextSize(self.size)
+      sprite.setTextColor(color, self.bg)
+      sprite.drawString(ch, 0, 0)
+      self.sprites[key] = sprite
+    self.used.append(key)
+    return sprite
+
+class GlyphWidget(render.TextWidget):
+  """
+  TextWidget drawing from a GlyphAtlas of its font and size. After the
+  first layout neither the text nor the label is measured again. A text
+  with a character not in the atlas is drawn as a TextWidget does.
+  """
+  def __init__(self, x, y, w, h, font, size=1, **kwargs):
+    super().__init__(x, y, w, h, font, size, **kwargs)
+    self.atlas = GlyphAtlas(font, size, self.bg)
+    self.labelBox = None # (w, h) of the label
+    self.shown = None # (tx, text, color) on screen, None after invalidate()
+    self.changed = None # rects the last draw changed
+
+  def _layout(self, gfx):
+    atlas = self.atlas
+    atlas.metrics(gfx)
+    tw = atlas.width(self.value[0])
+    if tw == None:
+      return super()._layout(gfx)
+    if self.align == render.CENTER:
+      tx = self.x + int((self.w - tw) / 2)
+    elif self.align == render.RIGHT:
+      tx = self.x + self.w - tw
+    else:
+      tx = self.x
+    rects = [(tx, self.y, tw, atlas.height)]
+    if self.label:
+      if self.labelBox == None:
+        gfx.setFont(self.labelFont)
+        gfx.setTextSize(self.labelSize)
+        self.labelBox = (gfx.textWidth(self.label), gfx.fontHeight())
+        gfx.setTextSize(1)
+      rects.append((tx + tw, self.y + self.labelDy, self.labelBox[0], self.labelBox[1]))
+    return tx, rects
+
+  def invalidate(self):
+    self.shown = None
+
+  def damage(self):
+    return self.changed if self.changed != None else self.rects
+
+  def draw(self, gfx):
+    if self.value is None:
+      return
+    text, color = self.value
+    atlas = self.atlas
+    atlas.metrics(gfx)
+    if atlas.width(text) == None:
+      self.shown = None
+      self.changed = None
+      super().draw(gfx)
+      return
+    tx, rects = self.layout or self._layout(gfx)
+    adv = atlas.advances
+    shown = self.shown
+    full = shown == None or shown[0] != tx or shown[2] != color or len(shown[1]) != len(text)
+    if not full:
+      # a changed character of another width moves the ones after it
+      for old, ch in zip(shown[1], text):
+        if old != ch and adv[old] != adv[ch]:
+          full = True
+          break
+    self.changed = []
+    x = tx
+    for i in range(len(text)):
+      ch = text[i]
+      if full or shown[1][i] != ch:
+        sprite = atlas.glyph(gfx, ch, color)
+        if sprite != None:
+          sprite.push(x, self.y)
+        else:
+          gfx.setFont(self.font)
+          gfx.setTextSize(self.size)
+          gfx.setTextColor(color, self.bg)
+          gfx.drawString(ch, x, self.y)
+          gfx.setTextSize(1)
+        self.changed.append((x, self.y, adv[ch], atlas.height))
+      x += adv[ch]
+    if full and self.label:
+      gfx.setFont(self.labelFont)
+      gfx.setTextSize(self.labelSize)
+      gfx.setTextColor(self.labelColor if self.labelColor != None else color, self.bg)
+      gfx.drawString(self.label, x, self.y + self.labelDy)
+      gfx.setTextSize(1)
+      self.changed.append(rects[1])
+    self.shown = (tx, text, color)
+    self.layout = None
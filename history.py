@@ -0,0 +1,175 @@
+# Glucose history as a fixed capacity ring buffer of (seconds, sgv) readings
+# held in two arrays, so a day of readings costs 6 bytes each and never
+# grows the heap. The file is a fixed binary image of the buffer, saved as
+# the checkpoint when the journal is compacted: only the slots changed since
+# the last save and the header are rewritten, in place.
+#
+# File layout (native byte order):
+#   MAGIC, header array('H') [capacity, head, count, 0],
+#   times array('I') [capacity], values array('H') [capacity]
+from array import array
+import ubinascii
+
+MAGIC = b'SGV1'
+HEADER_SIZE = 4 + 8
+MAX_DIRTY = 16 # more changed slots than this and the whole file is rewritten
+DIRECTIONS = ("NONE", "DoubleUp", "SingleUp", "FortyFiveUp", "Flat", "FortyFiveDown", "SingleDown", "DoubleDown", "NOT COMPUTABLE", "RATE OUT OF RANGE")
+
+def packEntry(seconds, sgv, direction, id):
+  # 19 bytes: seconds, sgv, direction index, 12 byte id (a Mongo ObjectId)
+  d = DIRECTIONS.index(direction) if direction in DIRECTIONS else 0
+  try:
+    raw = ubinascii.unhexlify(id)
+  except:
+    raw = b""
+  if len(raw) != 12:
+    raw = b"\xff" * 12
+  return seconds.to_bytes(4, 'little') + sgv.to_bytes(2, 'little') + bytes((d,)) + raw
+
+def unpackEntry(payload):
+  # (seconds, sgv, direction, id)
+  raw = payload[7:19]
+  id = "" if raw == b"\xff" * 12 else ubinascii.hexlify(raw).decode()
+  return int.from_bytes(payload[0:4], 'little'), int.from_bytes(payload[4:6], 'little'), DIRECTIONS[payload[6]] if payload[6] < len(DIRECTIONS) else "NONE", id
+
+class SgvHistory:
+  """
+  Readings are kept in time order, oldest first, one per timestamp (local
+  epoch seconds). When full, adding a newer reading drops the oldest one.
+  """
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.times = array('I', [0] * capacity)
+    self.values = array('H', [0] * capacity)
+    self.header = array('H', [capacity, 0, 0, 0])
+    self.head = 0 # slot the next reading goes to
+    self.count = 0
+    self.dirty = []
+    self.rewrite = True
+
+  def __len__(self):
+    return self.count
+
+  def slot(self, i):
+    # slot of the i-th oldest reading
+    return (self.head - self.count + i) % self.capacity
+
+  def newest(self):
+    if self.count == 0:
+      return -1
+    return self.times[self.slot(self.count - 1)]
+
+  def markDirty(self, s):
+    if not self.rewrite:
+      if len(self.dirty) >= MAX_DIRTY:
+        self.rewrite = True
+      elif s not in self.dirty:
+        self.dirty.append(s)
+
+  def add(self, seconds, sgv):
+    # returns False when the reading was already kept
+    times = self.times
+    n = self.count
+    # find the position from the newest end, for a new reading no step
+    i = n
+    while i > 0 and times[self.slot(i - 1)] > seconds:
+      i -= 1
+    if i > 0 and times[self.slot(i - 1)] == seconds:
+      s = self.slot(i - 1)
+      if self.values[s] != sgv:
+        self.values[s] = sgv
+        self.markDirty(s)
+        return True
+      return False
+    if i == n:
+      s = self.head
+      times[s] = seconds
+      self.values[s] = sgv
+      self.head = (s + 1) % self.capacity
+      if n < self.capacity:
+        self.count = n + 1
+      self.markDirty(s)
+      return True
+    # a backfilled reading older than the newest one
+    if n == self.capacity:
+      if i == 0:
+        return False
+      # drop the oldest to make room
+      self.count = n = n - 1
+      i -= 1
+    self.head = (self.head + 1) % self.capacity
+    self.count = n + 1
+    for k in range(n, i, -1):
+      dst = self.slot(k)
+      src = self.slot(k - 1)
+      times[dst] = times[src]
+      self.values[dst] = self.values[src]
+    s = self.slot(i)
+    times[s] = seconds
+    self.values[s] = sgv
+    self.rewrite = True
+    return True
+
+  def items(self, since=0):
+    # [(seconds, sgv), ...] oldest first, readings at or after `since`
+    result = []
+    for i in range(self.count):
+      s = self.slot(i)
+      if self.times[s] >= since:
+        result.append((self.times[s], self.values[s]))
+    return result
+
+  def save(self, path):
+    self.header[1] = self.head
+    self.header[2] = self.count
+    if not self.rewrite:
+      try:
+        with open(path, 'r+b') as f:
+          times = memoryview(self.times)
+          values = memoryview(self.values)
+          for s in self.dirty:
+            f.seek(HEADER_SIZE + s * 4)
+            f.write(times[s:s + 1])
+            f.seek(HEADER_SIZE + self.capacity * 4 + s * 2)
+            f.write(values[s:s + 1])
+          f.seek(len(MAGIC))
+          f.write(self.header)
+        self.dirty = []
+        return
+      except OSError:
+        pass
+    with open(path, 'wb') as f:
+      f.write(MAGIC)
+      f.write(self.header)
+      f.write(self.times)
+      f.write(self.values)
+    self.dirty = []
+    self.rewrite = False
+
+  def load(self, path):
+    # returns False (and stays empty) when there is no usable file
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        return False
+      header = array('H', [0] * 4)
+      f.readinto(header)
+      capacity = header[0]
+      times = array('I', [0] * capacity)
+      values = array('H', [0] * capacity)
+      f.readinto(times)
+      f.readinto(values)
+    if capacity == self.capacity:
+      self.times = times
+      self.values = values
+      self.head = header[1]
+      self.count = header[2]
+      self.rewrite = False
+    else:
+      # capacity changed, carry the newest readings over
+      n = header[2]
+      for i in range(max(0, n - self.capacity), n):
+        s = (header[1] - n + i) % capacity
+        self.add(times[s], values[s])
+      self.rewrite = True
+    self.dirty = []
+    return True
@@ -0,0 +1,189 @@
+# Minimal HTTP/1.1 client that keeps one connection (TLS for https) open
+# across requests to the same host. The backend poller asks Nightscout for
+# entries every minute; reusing the socket saves a TCP and TLS handshake per
+# poll, by far the slowest and most power hungry part of a request.
+# Runs on uasyncio streams, other tasks go on while a request waits.
+import uasyncio as asyncio
+import ujson
+import utime
+
+CHUNK_SIZE = 256 # body read size, one buffer reused for every read
+
+class Response:
+  def __init__(self, status_code, headers, content):
+    self.status_code = status_code
+    self.headers = headers
+    self.content = content
+
+  @property
+  def text(self):
+    return self.content.decode()
+
+  def json(self):
+    return ujson.loads(self.content)
+
+  def close(self):
+    # the body is already read, the connection stays with the client
+    pass
+
+def splitUrl(url):
+  # "https://host:port/path?query" -> (https, host, port, "/path?query")
+  scheme, _, rest = url.partition("://")
+  https = scheme == "https"
+  hostport, slash, path = rest.partition("/")
+  host, _, port = hostport.partition(":")
+  port = int(port) if port else (443 if https else 80)
+  return https, host, port, slash + path
+
+class KeepAliveClient:
+  """
+  get() sends the request on the open connection when it goes to the same
+  host, otherwise it connects first. A kept connection the server has
+  closed while idle is detected on first use and the request is sent again
+  on a new one. After every request `handshakeMs` holds the connect + TLS
+  time (0 when the connection was reused) and `requestMs` the time from
+  sending the request to the last byte of the body.
+  """
+  def __init__(self):
+    self.stream = None
+    self.key = None
+    self.fresh = False
+    self.connects = 0
+    self.requests = 0
+    self.handshakeMs = 0
+    self.requestMs = 0
+    self.received = False
+    self.buf = None
+
+  def close(self):
+    if self.stream != None:
+      try: self.stream.close()
+      except: pass
+    self.stream = None
+    self.key = None
+
+  async def connect(self, https, host, port, timeout):
+    self.close()
+    start = utime.ticks_ms()
+    if https:
+      reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=True, server_hostname=host), timeout)
+    else:
+      reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    self.stream = reader
+    self.key = (https, host, port)
+    self.fresh = True
+    self.connects += 1
+    self.handshakeMs = utime.ticks_diff(utime.ticks_ms(), start)
+
+  async def get(self, url, headers=None, timeout=10, sink=None):
+    """
+    Returns a Response. With `sink` the body is not kept: it is passed to
+    sink(chunk) in CHUNK_SIZE pieces as it is read, and content is None.
+    A request not answered within `timeout` seconds raises
+    asyncio.TimeoutError.
+    """
+    https, host, port, path = splitUrl(url)
+    request = "GET " + path + " HTTP/1.1\r\nHost: " + host + "\r\nConnection: keep-alive\r\n"
+    if headers != None:
+      for k in headers:
+        request += k + ": " + str(headers[k]) + "\r\n"
+    request = (request + "\r\n").encode()
+    self.requests += 1
+    reused = self.stream != None and self.key == (https, host, port)
+    if reused:
+      self.handshakeMs = 0
+    else:
+      await self.connect(https, host, port, timeout)
+    self.received = False
+    try:
+      return await asyncio.wait_for(self.send(request, sink), timeout)
+    except OSError:
+      self.close()
+      if not reused or self.received:
+        raise
+    except:
+      self.close()
+      raise
+    # the server dropped the idle connection, once more on a fresh one
+    print("Kept connection was closed by the server, reconnecting")
+    await self.connect(https, host, port, timeout)
+    try:
+      return await asyncio.wait_for(self.send(request, sink), timeout)
+    except:
+      self.close()
+      raise
+
+  async def send(self, request, sink):
+    s = self.stream
+    start = utime.ticks_ms()
+    s.write(request)
+    await s.drain()
+    if self.fresh:
+      # TLS completes on the first write, count it to the handshake
+      self.fresh = False
+      now = utime.ticks_ms()
+      self.handshakeMs += utime.ticks_diff(now, start)
+      start = now
+    line = await s.readline()
+    if not line:
+      raise OSError("connection closed")
+    self.received = True
+    status = int(line.split(None, 2)[1])
+    headers = {}
+    while True:
+      line = await s.readline()
+      if not line or line == b"\r\n":
+        break
+      k, _, v = line.decode().partition(":")
+      headers[k.strip().lower()] = v.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+      content = await self.readChunked(s, sink)
+    elif "content-length" in headers:
+      content = await self.readBody(s, int(headers["content-length"]), sink)
+    else:
+      content = await self.readBody(s, -1, sink)
+      headers["connection"] = "close"
+    if headers.get("connection", "").lower() == "close":
+      self.close()
+    self.requestMs = utime.ticks_diff(utime.ticks_ms(), start)
+    return Response(status, headers, content)
+
+  async def readBody(self, s, n, sink):
+    # n bytes, or up to EOF when n < 0
+    if self.buf == None:
+      self.buf = bytearray(CHUNK_SIZE)
+    parts = None if sink != None else []
+    view = memoryview(self.buf)
+    left = n
+    while left != 0:
+      r = await s.readinto(view if left < 0 or left >= CHUNK_SIZE else view[:left])
+      if not r:
+        if left < 0:
+          break
+        raise OSError("connection closed")
+      if sink != None:
+        sink(view[:r])
+      else:
+        parts.append(bytes(view[:r]))
+      if left > 0:
+        left -= r
+    if sink != None:
+      return None
+    return b"".join(parts)
+
+  async def readChunked(self, s, sink):
+    parts = []
+    while True:
+      size = int((await s.readline()).split(b";")[0].strip(), 16)
+      if size == 0:
+        # skip trailers up to the closing blank line
+        while (await s.readline()) not in (b"", b"\r\n"):
+          pass
+        break
+      part = await self.readBody(s, size, sink)
+      if part != None:
+        parts.append(part)
+      await s.readline()
+    if sink != None:
+      return None
+    return b"".join(parts)
@@ -0,0 +1,212 @@
+# Append-only record store for data the device saves often (new readings,
+# config changes) plus a bounded ring for error reports.
+#
+# Appending a record to a segment file only programs fresh flash; rewriting
+# a whole file on every change costs a block erase each time. Records have a
+# fixed size, segments are one erase block. When all MAX_SEGMENTS are full
+# the journal is compacted: each owner checkpoints its state (e.g. writes
+# its own file) and returns the records still worth carrying, which start a
+# new segment, then the old segments are deleted.
+#
+# Record: 0xA5, type (0x80 set when the payload continues in the next
+# record), payload length, checksum, payload padded to PAYLOAD_SIZE.
+import uos
+
+RECORD_SIZE = 32
+PAYLOAD_SIZE = RECORD_SIZE - 4
+SEGMENT_SIZE = 4096 # one flash erase block
+MAX_SEGMENTS = 4
+MAGIC = 0xA5
+MORE = 0x80
+
+# record types
+READING = 1
+CONFIG = 2
+CONFIG_CHECKPOINT = 3 # config file rewritten, earlier CONFIG records are void
+
+def checksum(type, payload):
+  s = type + len(payload)
+  for b in payload:
+    s += b
+  return s & 0xFF
+
+def fileSize(path):
+  try:
+    return uos.stat(path)[6]
+  except OSError:
+    return -1
+
+class Journal:
+  """
+  Segments are the files name.<n>, n growing. Functions added to
+  `compactors` are called during compaction, must not append, and return
+  a list of (type, payload) records to carry over.
+  """
+  def __init__(self, name, segmentSize=SEGMENT_SIZE, maxSegments=MAX_SEGMENTS):
+    self.name = name
+    self.segmentSize = segmentSize - segmentSize % RECORD_SIZE
+    self.maxSegments = maxSegments
+    self.compactors = []
+    self.record = bytearray(RECORD_SIZE)
+    prefix = name + "."
+    self.segments = sorted([int(f[len(prefix):]) for f in uos.listdir() if f.startswith(prefix) and f[len(prefix):].isdigit()])
+    if not self.segments:
+      self.segments = [0]
+    path = self.path(self.segments[-1])
+    self.size = max(0, fileSize(path))
+    torn = self.size % RECORD_SIZE
+    if torn:
+      # a write torn by a reset: cut the partial record, records appended
+      # after it would be misaligned and lost at replay
+      self.size -= torn
+      with open(path, 'rb') as f:
+        data = f.read(self.size)
+      with open(path, 'wb') as f:
+        f.write(data)
+
+  def path(self, n):
+    return self.name + "." + str(n)
+
+  def append(self, type, payload):
+    count = max(1, (len(payload) + PAYLOAD_SIZE - 1) // PAYLOAD_SIZE)
+    if self.size + count * RECORD_SIZE > self.segmentSize:
+      if len(self.segments) >= self.maxSegments:
+        self.compact()
+      else:
+        self.segments.append(self.segments[-1] + 1)
+        self.size = 0
+    self.write([(type, payload)])
+
+  def write(self, records):
+    with open(self.path(self.segments[-1]), 'ab') as f:
+      for type, payload in records:
+        for i in range(0, max(1, len(payload)), PAYLOAD_SIZE):
+          part = payload[i:i + PAYLOAD_SIZE]
+          t = type | MORE if i + PAYLOAD_SIZE < len(payload) else type
+          r = self.record
+          r[0] = MAGIC
+          r[1] = t
+          r[2] = len(part)
+          r[3] = checksum(t, part)
+          r[4:4 + len(part)] = part
+          for k in range(4 + len(part), RECORD_SIZE):
+            r[k] = 0
+          f.write(r)
+          self.size += RECORD_SIZE
+
+  def compact(self):
+    live = []
+    for c in self.compactors:
+      live.extend(c())
+    old = self.segments
+    self.segments = [old[-1] + 1]
+    self.size = 0
+    self.write(live)
+    for n in old:
+      try: uos.remove(self.path(n))
+      except OSError: pass
+    print("Journal compacted, carried " + str(len(live)) + " records")
+
+  def replay(self, types=None):
+    # [(type, payload), ...] oldest first; a torn record ends its segment
+    result = []
+    for n in self.segments:
+      try:
+        f = open(self.path(n), 'rb')
+      except OSError:
+        continue
+      with f:
+        payload = b""
+        while True:
+          r = f.read(RECORD_SIZE)
+          if len(r) < RECORD_SIZE or r[0] != MAGIC or r[2] > PAYLOAD_SIZE:
+            break
+          part = r[4:4 + r[2]]
+          if checksum(r[1], part) != r[3]:
+            break
+          payload += part
+          if r[1] & MORE:
+            continue
+          if types == None or r[1] in types:
+            result.append((r[1], payload))
+          payload = b""
+    return result
+
+class ErrorRing:
+  """
+  The last `slots` error reports in one fixed size file, a new report
+  overwrites the oldest slot in place. Reports longer than a slot keep
+  their end, where the exception is.
+  """
+  def __init__(self, path, slots=8, slotSize=512):
+    self.path = path
+    self.slots = slots
+    self.slotSize = slotSize
+    self.seq = None # sequence number of the newest report
+    self.slot = 0
+
+  def scan(self):
+    self.seq = 0
+    self.slot = self.slots - 1
+    if fileSize(self.path) != self.slots * self.slotSize:
+      with open(self.path, 'wb') as f:
+        f.write(bytes(self.slots * self.slotSize))
+      return
+    with open(self.path, 'rb') as f:
+      for i in range(self.slots):
+        f.seek(i * self.slotSize)
+        h = f.read(6)
+        seq = int.from_bytes(h[:4], 'little')
+        if seq > self.seq:
+          self.seq = seq
+          self.slot = i
+
+  def write(self, text):
+    if self.seq == None:
+      self.scan()
+    data = utf8Tail(text.encode(), self.slotSize - 6)
+    self.seq += 1
+    self.slot = (self.slot + 1) % self.slots
+    with open(self.path, 'r+b') as f:
+      f.seek(self.slot * self.slotSize)
+      f.write(self.seq.to_bytes(4, 'little') + len(data).to_bytes(2, 'little') + data)
+
+  def entries(self):
+    # [(seq, text), ...] oldest first
+    result = []
+    try:
+      with open(self.path, 'rb') as f:
+        for i in range(self.slots):
+          f.seek(i * self.slotSize)
+          h = f.read(6)
+          if len(h) < 6:
+            break
+          seq = int.from_bytes(h[:4], 'little')
+          if seq > 0:
+            data = f.read(int.from_bytes(h[4:6], 'little'))
+            try:
+              text = data.decode()
+            except UnicodeError:
+              # written by an older version, cut inside a character
+              text = utf8Tail(data, len(data)).decode()
+            result.append((seq, text))
+    except OSError:
+      pass
+    result.sort()
+    return result
+
+def utf8Tail(data, n):
+  # the last n bytes at most, starting on a character boundary
+  i = max(0, len(data) - n)
+  while i < len(data) and data[i] & 0xC0 == 0x80:
+    i += 1
+  return data[i:]
+
+store = None
+
+def get(name="journal"):
+  # the journal shared by main.py and ap.py
+  global store
+  if store == None:
+    store = Journal(name)
+  return store
@@ -0,0 +1,113 @@
+# Streaming parser for the Nightscout entries array. The body is fed in
+# small chunks as it comes off the socket; only the whitelisted keys of each
+# entry are decoded, everything else is skipped byte by byte, so the peak
+# allocation is a few short values instead of the whole body plus a dict
+# with every Nightscout field per entry.
+import ujson
+
+QUOTE = 0x22
+BACKSLASH = 0x5C
+COLON = 0x3A
+COMMA = 0x2C
+OPEN_OBJECT = 0x7B
+CLOSE_OBJECT = 0x7D
+OPEN_ARRAY = 0x5B
+CLOSE_ARRAY = 0x5D
+WHITESPACE = (0x20, 0x09, 0x0A, 0x0D)
+MAX_VALUE = 64 # longer values of a kept key are dropped
+
+class EntryParser:
+  """
+  feed() it the bytes of a JSON array of objects. `entries` receives, in
+  order, a dict per object holding only the keys in `fields`, at most
+  `limit` of them; the rest of the input is ignored (but may still be fed,
+  so the connection can be drained). Nested values are skipped.
+  """
+  def __init__(self, fields, limit):
+    self.fields = [('"' + f + '"').encode() for f in fields]
+    self.limit = limit
+    self.entries = []
+    self.done = False
+    self.depth = 0
+    self.inString = False
+    self.escape = False
+    self.expectKey = False
+    self.buf = bytearray(MAX_VALUE)
+    self.n = 0
+    self.capture = False # bytes go to buf
+    self.key = None # kept key the next value belongs to
+    self.entry = None
+
+  def feed(self, data):
+    if self.done:
+      return
+    for b in data:
+      if self.inString:
+        if self.escape:
+          self.escape = False
+        elif b == BACKSLASH:
+          self.escape = True
+        elif b == QUOTE:
+          self.inString = False
+        if self.capture:
+          self.put(b)
+        continue
+      if b in WHITESPACE:
+        continue
+      depth = self.depth
+      if b == QUOTE:
+        self.inString = True
+        if depth == 2 and self.expectKey:
+          self.n = 0
+          self.capture = True
+        if self.capture:
+          self.put(b)
+      elif depth == 2 and b == COLON:
+        self.expectKey = False
+        self.key = self.matchKey()
+        self.capture = self.key != None
+        self.n = 0
+      elif depth == 2 and b == COMMA:
+        self.endValue()
+        self.expectKey = True
+      elif b == OPEN_OBJECT or b == OPEN_ARRAY:
+        self.depth = depth + 1
+        if depth == 1 and b == OPEN_OBJECT:
+          self.entry = {}
+          self.expectKey = True
+        elif self.capture:
+          # nested value under a kept key, not supported
+          self.capture = False
+          self.key = None
+      elif b == CLOSE_OBJECT or b == CLOSE_ARRAY:
+        self.depth = depth - 1
+        if depth == 2:
+          self.endValue()
+          self.entries.append(self.entry)
+          self.entry = None
+          if len(self.entries) >= self.limit:
+            self.done = True
+            return
+      elif self.capture:
+        self.put(b)
+
+  def put(self, b):
+    if self.n < MAX_VALUE:
+      self.buf[self.n] = b
+    self.n += 1
+
+  def matchKey(self):
+    if self.n > MAX_VALUE:
+      return None
+    key = self.buf[:self.n]
+    for f in self.fields:
+      if key == f:
+        return f[1:-1].decode()
+    return None
+
+  def endValue(self):
+    if self.capture and self.n <= MAX_VALUE:
+      self.entry[self.key] = ujson.loads(bytes(self.buf[:self.n]))
+    self.capture = False
+    self.key = None
+    self.n = 0
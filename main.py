@@ -1,24 +1,38 @@
 #UiFlow2 https://uiflow-micropython.readthedocs.io/en/develop/
 
+import utime
+IMPORT_START_MS = utime.ticks_ms()
 import M5
 import gc
-import ntptime
 from hardware import WDT, I2C, Pin
 import machine
-import requests2
+import jsonstream
 import math
 import time
 import network
 import sys
-import _thread
-import utime
-from collections import OrderedDict
-import re
+import uasyncio as asyncio
 import ap
-import ujson
-from unit import ENVUnit, RGBUnit
-
-TIMEZONE_RE = re.compile(r"^GMT[+-]((0?[0-9]|1[0-1]):([0-5][0-9])|12:00)$")
+import uos
+import render
+import chart
+import arrow
+import glyphs
+import environment
+import forecast
+import history
+import battery
+import power
+import arrival
+import endpoints
+import wifi
+import journal
+import scheduler
+import io
+
+# compare source and .mpy deployments (see build.py)
+gc.collect()
+print("Modules imported in %d ms, %d bytes heap free" % (utime.ticks_diff(utime.ticks_ms(), IMPORT_START_MS), gc.mem_free()))
 
 SGV_LABEL = "mg/dL"
 HPA_LABEL = "hPa"
@@ -27,20 +41,52 @@ TEMPC_LABEL = "C"
 
 EMERGENCY_PAUSE_INTERVAL = 1800  #sec = 30 mins
 MODES = ["full_all", "full_date", "full_battery", "basic", "flip_full_all", "flip_full_date", "flip_full_battery", "chart", "flip_chart"]
-SGVDICT_FILE = 'sgvdict.txt'
-RESPONSE_FILE = 'response.json'
+SGVDICT_FILE = 'sgvdict.txt' # replaced by HISTORY_FILE, read once to migrate
+HISTORY_FILE = 'sgvhistory.bin'
+ERROR_FILE = 'errors.bin'
 POLL_INTERVAL_SEC = 60 # 1-minute interval for dateStr refresh
 REQUEST_TIMEOUT_SEC = 10 # Fast HTTP request timeout for dateStr refresh
 EXPECTED_INTERVAL_SEC = 300 # Expected SGV reading arrival interval (5 minutes)
 LEAD_TIME_SEC = 5 # Wake up 5s before expected arrival for targeted poll
-TARGET_TIMEOUT_SEC = 25 # Short wait timeout for arrival window request
-MAX_SAVED_ENTRIES = 10
+TARGET_TIMEOUT_SEC = 25 # Short wait timeout for arrival window request, the learned timeout is capped to it
+MAX_FETCH_ENTRIES = 10 # entries window kept in response
+TRANSPORT_POLL = 0 # config "transport": poll entries.json
+TRANSPORT_PUSH = 1 # or hold a socket and poll only while it is down
+PUSH_RETRY_SEC = 300 # polling after the socket dropped, then it is opened again
+RACE_LONG_POLLS = True # with mirrors configured the arrival window long-poll goes to two endpoints
+WIFI_FAST_CONNECT_MS = 4000 # the cached access point answers within this or is tried no longer
+WIFI_CONNECT_TIMEOUT_MS = 10000
+NTP_HOSTS = ("0.pool.ntp.org", "1.pool.ntp.org", "2.pool.ntp.org", "3.pool.ntp.org")
+NTP_RETRY_SEC = 2 # pause after a host failed, settime() blocks the loop for its timeout
+NTP_MAX_RETRY_SEC = 3600 # with the RTC set the pause doubles after each failed round up to this
+NTP_DEFER_SEC = 10 # with the RTC still set from before a reset
+ENTRY_FIELDS = ("id", "sgv", "direction", "date", "ago") # entry keys kept from the backend response
+ARROW_ANIMATION = True # a new trend direction is reached by rotating the arrow, not on battery
+ARROW_FRAME_MS = 40 # per arrow.STEP_DEG
+CONFIG_SAVE_DELAY_MS = 3000 # taps and flips are saved once nothing changed for this long
+MAX_SAVED_ENTRIES = 288 # 24 hours of readings in the history ring buffer
+INPUT_MS = 100 # touch and IMU poll period
+INPUT_SAVING_MS = 250 # while power saving and untouched, a touch speeds it up again
+BATTERY_SAMPLE_MS = 10000 # PMIC read period, battery level readers get the cached values
+PREDICTION_ALERTS = False # a confirmed low or high predicted forecast.ALERT_MIN ahead raises the emergency before it is reached
+ENV_SAMPLE_MS = 60000 # ENV unit read period, the screen shows the cached averages
+ENV_TREND = True # pressure and temperature coloured while they change fast
+PRESSURE_TREND_HPA = 1 # per hour, falling is shown orange, rising green
+TEMPERATURE_TREND_C = 1 # per hour, rising is shown orange, falling green
+POWER_SAVE = True # on battery: radio off between readings, light sleep, minute clock, auto-dim
+DIM_AFTER_SEC = 300 # on battery the display dims when untouched for this long
+DIM_BRIGHTNESS = 1
+NIGHT_START_HOUR = 22 # and at night, local time
+NIGHT_END_HOUR = 7
 YEAR = 2025
+EPOCH_OFFSET = 946684800 if utime.gmtime(0)[0] == 2000 else 0 # seconds between the 2000 MicroPython epoch and Unix epoch
+MIN_RTC_TIME = utime.mktime((YEAR, 1, 1, 0, 0, 0, 0, 0)) # an RTC before this was not set by NTP yet
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 720
 MIN_SWIPE_DIST = 250  # Minimum distance in pixels to count as a swipe
 
 SHOW_SECONDS = False
+DOUBLE_BUFFER = True # screens are composed in an off-screen frame in PSRAM and pushed to the panel
 RESET_BRIGHTNESS_AT_STARTUP = True
 MUCH_TOO_OLD_DATA = 70 #mins
 
@@ -51,143 +97,151 @@ ORANGE = 10050560 # 153 × 65536 + 92 × 256 + 0
 RED = 8388608 # 128 x 65536 + 0 × 256 + 0
 DARKGREEN = 16384 # 0 x 65536 + 64 x 256 + 0
 
-drawScreenLock = _thread.allocate_lock()
-
-prevStr = {}
+screen = None
+mainScreen = None
+chartScreen = None
+frame = None # off-screen canvas shared by the screens, see render.py
+inputTicker = None # scheduler.Periodic of readInput
+sgvHistory = history.SgvHistory(MAX_SAVED_ENTRIES) # empty until loadHistory()
+historyLoaded = False
 
 def getBatteryLevel():
-  v = M5.Power.getBatteryVoltage()
-  l = M5.Power.getBatteryLevel()
-  ic = M5.Power.isCharging()
-  c = M5.Power.getBatteryCurrent()
-  #print(f"Voltage: {v}mV, Level: {l}%, Charging: {ic}, Current: {c}")
-  if 5800 < v < 8500 and abs(c) > 10:
-    return l
-  else:
-    return 101 #no battery present
-
-def isOlderThan(date_str, mins, now_seconds, print_time=False): 
-  the_date = getDateTuple(date_str)
-  the_date_seconds = utime.mktime(the_date)
-  #print("Date: " + str(the_date) + " - " + str(the_date_seconds) + ", Now: " + str(now_seconds))
-  diff = (now_seconds - the_date_seconds)
-  if print_time:
-     printTime(diff, prefix='Entry read', suffix='ago')
-  return (diff > (60 * mins) and getBatteryLevel() >= 5)  
+  # cached by the battery sampler task, 101 when no battery is present
+  return batterySampler.level
+
+def isOlderThan(age, mins, batteryLevel): 
+  # age of an entry in seconds, see entrySeconds and localNow; with an
+  # almost empty battery nothing counts as old
+  return (age > (60 * mins) and batteryLevel >= 5)  
+
+def validTimezone(tz):
+  # GMT+H:MM or GMT-HH:MM up to 12:00, parsed by hand: importing re costs
+  # more boot time than this check
+  if len(tz) < 8 or tz[:3] != "GMT" or tz[3] not in "+-":
+    return False
+  hh, sep, mm = tz[4:].partition(":")
+  if sep != ":" or len(hh) > 2 or len(mm) != 2 or not hh.isdigit() or not mm.isdigit():
+    return False
+  h, m = int(hh), int(mm)
+  return m < 60 and (h < 12 or (h == 12 and m == 0))
 
 def getDateTuple(date_str):
   [yyyy, mm, dd] = [int(i) for i in date_str.split('T')[0].split('-')]
   [HH, MM, SS] = [int(i) for i in date_str.split('T')[1].split(':')]
   return (yyyy, mm, dd, HH, MM, SS, 0, 0)    
 
+def entrySeconds(entry):
+  # local epoch seconds of the entry date, parsed once and kept on the entry
+  seconds = entry.get("seconds")
+  if seconds == None:
+    seconds = entry["seconds"] = utime.mktime(getDateTuple(entry["date"]))
+  return seconds
+
 def printTime(seconds, prefix='', suffix=''):
   m, s = divmod(seconds, 60)
   h, m = divmod(m, 60)
   print(prefix + ' {:02d}:{:02d}:{:02d} '.format(h, m, s) + suffix)  
 
-def saveResponseFile():
-  global response
-  with open(RESPONSE_FILE, 'w') as responseFile:
-    ujson.dump(response, responseFile) 
- 
 def readResponseFile():
+  # newest readings kept in the journal, as entries without "ago"
   global response
   try:
-    with open(RESPONSE_FILE, 'r') as responseFile:
-      response = ujson.loads(responseFile.read())
+    readings = [history.unpackEntry(payload) for type, payload in journal.get().replay((journal.READING,))]
+    readings.sort()
+    entries = []
+    for seconds, sgv, direction, id in readings[-MAX_FETCH_ENTRIES:]:
+      t = utime.localtime(seconds)
+      entries.insert(0, {"id": id, "sgv": sgv, "direction": direction, "date": "%04d-%02d-%02dT%02d:%02d:%02d" % t[:6], "seconds": seconds})
+    response = entries if len(entries) > 0 else None
   except Exception as e:
     sys.print_exception(e)
     saveError(e)
     response = None
     
-def saveSgvFile(sgvdict):
-  items = []
-  for key in sgvdict:
-    items.append(str(key) + ':' + str(sgvdict[key]))
-  content = '\n'.join(items)
-  with open(SGVDICT_FILE, 'w') as file:
-    file.write(content)
-
-def readSgvFile():
-  d = OrderedDict()
-  try: 
+def readHistoryFile():
+  # checkpoint file plus the readings journaled since, falls back to the
+  # sgvdict.txt text file written by older versions
+  h = history.SgvHistory(MAX_SAVED_ENTRIES)
+  try:
+    if not h.load(HISTORY_FILE): readSgvFile(h)
+  except OSError:
+    readSgvFile(h)
+  except Exception as e:
+    sys.print_exception(e)
+    saveError(e)
+  try:
+    for type, payload in journal.get().replay((journal.READING,)):
+      seconds, sgv, direction, id = history.unpackEntry(payload)
+      h.add(seconds, sgv)
+  except Exception as e:
+    sys.print_exception(e)
+    saveError(e)
+  return h
+
+def readSgvFile(h):
+  try:
     with open(SGVDICT_FILE, 'r') as f:
-      sgvFile = f.read()
-    if sgvFile != None:
-      entries = sgvFile.split('\n')
-      for entry in entries:
-        if ":" in entry:
-          [s, v] = [int(i) for i in entry.split(':')]
-          d.update({s: v})   
+      for line in f:
+        if ":" in line:
+          [s, v] = [int(i) for i in line.split(':')]
+          h.add(s, v)
+    h.save(HISTORY_FILE)
+    uos.remove(SGVDICT_FILE)
+  except OSError:
+    pass
   except Exception as e:
     sys.print_exception(e)
     saveError(e)
-  return d 
+
+def loadHistory():
+  global sgvHistory, historyLoaded
+  if not historyLoaded:
+    sgvHistory = readHistoryFile()
+    historyLoaded = True
+
+def compactReadings():
+  # journal compaction: checkpoint the history, carry the newest full entries;
+  # before the app loaded the history (AP mode, config fixes) it is loaded
+  # here, saving the empty one would drop the readings only in the journal
+  loadHistory()
+  sgvHistory.save(HISTORY_FILE)
+  return journal.get().replay((journal.READING,))[-MAX_FETCH_ENTRIES:]
 
 def saveError(e):
-  now = utime.ticks_cpu()
-  filename = "error" + str(now) + ".txt"
-  with open(filename, 'w') as file:
-    sys.print_exception(e, file)
+  report = io.StringIO()
+  sys.print_exception(e, report)
+  errorLog.write(report.getvalue())
 
 def persistEntries():
-  global response, sgvDict
-  saveResponseFile()
-  d = OrderedDict()
-  seconds = -1
-  for index, entry in enumerate(response):
-    the_date = getDateTuple(entry['date'])  
-    seconds = utime.mktime(the_date)
-    d.update({seconds: entry['sgv']})
-  
-  dictLen = len(d)  
-  for key in sgvDict:
-    if key < seconds and dictLen < MAX_SAVED_ENTRIES:
-       d.update({key: sgvDict[key]})
-    elif dictLen >= MAX_SAVED_ENTRIES:
-      break  
-    dictLen = len(d)
-
-  sgvDict = d
-  saveSgvFile(d)
-  print('\nPersisted ' + str(dictLen) + " sgv entries")
+  global response
+  store = journal.get()
+  for entry in reversed(response):
+    seconds = entrySeconds(entry)
+    if sgvHistory.add(seconds, entry['sgv']):
+      store.append(journal.READING, history.packEntry(seconds, entry['sgv'], entry['direction'], entry['id']))
+  print('\nPersisted ' + str(len(sgvHistory)) + " sgv entries")
 
 def checkBeeper():
   global USE_BEEPER, BEEPER_START_TIME, BEEPER_END_TIME, secondsDiff
   try:   
     if (USE_BEEPER == 1 and getBatteryLevel() >= 5):
-      d = utime.localtime(0)
-      now_datetime = utime.localtime(utime.time()) 
-      if now_datetime[0] < YEAR:
-        raise ValueError('Invalid datetime: ' + str(now_datetime))
-      now = utime.mktime((now_datetime[0], now_datetime[1], now_datetime[2], now_datetime[3], now_datetime[4], now_datetime[5],0,0))
-      localtime = utime.localtime(now + secondsDiff)
-      
-      c = list(d)
-      c[3] = localtime[3]
-      c[4] = localtime[4]
-      c[5] = localtime[5]
+      # local time of day in seconds
+      c = localNow() % 86400
 
-      d1 = list(d)
       [HH, MM, SS] = [int(i) for i in BEEPER_START_TIME.split(':')]
-      d1[3] = HH
-      d1[4] = MM
-      d1[5] = SS
+      d1 = HH * 3600 + MM * 60 + SS
 
-      d2 = list(d)
       [HH, MM, SS] = [int(i) for i in BEEPER_END_TIME.split(':')]
-      d2[3] = HH
-      d2[4] = MM
-      d2[5] = SS
+      d2 = HH * 3600 + MM * 60 + SS
 
       #print("Compare start: " + str(d1) + ", end: " + str(d2) + ", current: " + str(c))
       
-      if tuple(d1) < tuple(d2):
+      if d1 < d2:
          #d1 start | current | d2 end 
-         return tuple(c) > tuple(d1) and tuple(c) < tuple(d2)
+         return c > d1 and c < d2
       else:
          # current | d2 end | or | d1 start | current 
-         return tuple(c) > tuple(d1) or tuple(c) < tuple(d2)
+         return c > d1 or c < d2
     else:
       return False 
   except Exception as e:
@@ -195,6 +249,21 @@ def checkBeeper():
     saveError(e)
     return False   
 
+def localNow():
+  # Local epoch seconds (UTC + secondsDiff). The RTC is checked once per
+  # second, callers in the same second get the cached value.
+  global nowCache
+  t = utime.time()
+  if t != nowCache[0]:
+    if t < MIN_RTC_TIME:
+      raise ValueError('Invalid datetime: ' + str(utime.localtime(t)))
+    nowCache = (t, t + secondsDiff)
+  return nowCache[1]
+
+def rtcSet():
+  # False after a cold boot until NTP set the clock
+  return utime.time() >= MIN_RTC_TIME
+
 def getRtcDatetime():
   now_datetime = None
   for i in range(3):
@@ -206,628 +275,734 @@ def getRtcDatetime():
 # gui methods ----
 
 def printCenteredText(msg, mode, font=M5.Display.FONTS.DejaVu72, backgroundColor=M5.Display.COLOR.BLACK, textColor=M5.Display.COLOR.WHITE, clear=True):  
-  if mode >= 4:
+  if isFlipped(mode):
     M5.Display.setRotation(3)
   else:        
     M5.Display.setRotation(1)
+
+  # composed in the frame when there is one, the panel gets it in one push
+  gfx = frame if frame != None else M5.Display
     
   if clear:
-    M5.Display.clear(backgroundColor)
+    gfx.clear(backgroundColor)
         
-  M5.Display.setFont(font)
+  gfx.setFont(font)
     
-  M5.Display.setTextColor(textColor, backgroundColor)
+  gfx.setTextColor(textColor, backgroundColor)
     
-  w = M5.Display.textWidth(msg)
-  f = M5.Display.fontHeight()
+  w = gfx.textWidth(msg)
+  f = gfx.fontHeight()
   x = int((SCREEN_WIDTH-w)/2)
   y = int((SCREEN_HEIGHT-f)/2)
 
-  M5.Display.drawString(msg, x, y)
-
-def printText(msg, x, y, font=None, backgroundColor=M5.Display.COLOR.BLACK, textColor=DARKGREY, rotate=-1, silent=False):
-  if rotate > 0:
-    M5.Display.setRotation(rotate)  
-    
-  if font != None:       
-    M5.Display.setFont(font)
+  gfx.drawString(msg, x, y)
 
-  #TODO set different text color depending on screen brightness  
-    
-  M5.Display.setTextColor(textColor, backgroundColor)
-    
-  M5.Display.drawString(msg, x, y)
-  
-  if not silent:
-    print("Printing " + msg)
-
-def drawArrow(cx, cy, radius=60, angle_degrees=0, color=DARKGREY, is_double=False):
-    """
-    Draws a polished arrow centered on (cx, cy).
-    """
-    # Base radius for length calculations
-    r = radius + 16
-    
-    if is_double:
-        tri_h = r * 0.7
-        tri_w = r * 0.9
-        stem_l = r * 0.4
-        stem_w = r * 0.3
-        
-        # Head 1 tip at off1, Head 2 tip at off2
-        # For 50% overlap: off2 = off1 - 0.5 * tri_h
-        off1 = r * 0.5
-        off2 = off1 - tri_h * 0.5
-        offsets = [off1, off2]
-        
-        # Total span: from (off2 - tri_h - stem_l) to off1
-        total_len = off1 - (off2 - tri_h - stem_l)
-        shift = off1 - total_len / 2
-        circle_r = int(total_len / 2) + 6
+  if frame != None:
+    if clear:
+      frame.push(0, 0)
     else:
-        tri_h = r * 0.75
-        tri_w = r * 1.0
-        stem_l = r * 0.6
-        total_len = tri_h + stem_l
-        # Tip is at 'r', end is at 'r - total_len'
-        # Shift to center the span on cy
-        shift = r - total_len / 2
-        circle_r = int(total_len / 2) + 6
-        stem_w = r * 0.3
-
-    M5.Lcd.fillCircle(cx, cy, circle_r, M5.Display.COLOR.BLACK)
-    rad = math.radians(angle_degrees - 90)
-    
-    def get_rotated(px, py):
-        # Subtract shift to center the arrow on the origin before rotation
-        px -= shift
-        qx = cx + px * math.cos(rad) - py * math.sin(rad)
-        qy = cy + px * math.sin(rad) + py * math.cos(rad)
-        return int(qx), int(qy)
-
-    if is_double:
-        for off in offsets:
-            p1 = get_rotated(off, 0)
-            p2 = get_rotated(off - tri_h, -tri_w/2)
-            p3 = get_rotated(off - tri_h, tri_w/2)
-            M5.Lcd.fillTriangle(p1[0], p1[1], p2[0], p2[1], p3[0], p3[1], color)
-        # Draw stem from the base of the second arrow
-        s_off = offsets[1] - tri_h
-        s1 = get_rotated(s_off, -stem_w/2)
-        s2 = get_rotated(s_off, stem_w/2)
-        s3 = get_rotated(s_off - stem_l, stem_w/2)
-        s4 = get_rotated(s_off - stem_l, -stem_w/2)
-        M5.Lcd.fillTriangle(s1[0], s1[1], s2[0], s2[1], s3[0], s3[1], color)
-        M5.Lcd.fillTriangle(s1[0], s1[1], s3[0], s3[1], s4[0], s4[1], color)
+      render.pushRects(M5.Display, frame, [(x, y, w, f)])
+
+  if screen != None and clear:
+    screen.invalidate()
+
+def paintBatteryLevel(gfx, widget):
+  batteryLevel, isCharging = widget.value
+  batteryLevelStr = f"{batteryLevel}%"
+  gfx.fillRect(widget.x, widget.y, widget.w, widget.h, M5.Display.COLOR.BLACK)
+  gfx.setFont(M5.Display.FONTS.DejaVu40)
+  gfx.setTextSize(1)
+  w = gfx.textWidth(batteryLevelStr)
+  y = 170
+  # Dynamically center indicator to the current text width
+  x = int(SCREEN_WIDTH - w/2 - 20 - 25/2)
+
+  if batteryLevel <= 20: textcolor=RED
+  elif batteryLevel <= 50: textcolor=ORANGE
+  else: textcolor=DARKGREY
+  gfx.setTextColor(textcolor, M5.Display.COLOR.BLACK)
+  gfx.drawString(batteryLevelStr, SCREEN_WIDTH-w-20, y)
+
+  b = y-40
+  nb = int(b/100*batteryLevel)
+  if batteryLevel <= 20: color=RED
+  elif batteryLevel <= 50: color=ORANGE
+  else: color=DARKGREEN
+
+  # Draw frame if charging
+  if isCharging and batteryLevel < 100:
+    gfx.drawRect(x-5, 20-5, 25+10, b+10, DARKGREY)
+    gfx.drawRect(x-4, 20-4, 25+8, b+8, DARKGREY)
+
+  # Draw battery bar (width 25)
+  gfx.fillRect(x, 20, 25, b-nb, DARKGREY)
+  gfx.fillRect(x, 20+b-nb, 25, nb, color)
+
+def paintBatteryText(gfx, widget):
+  batteryLevel, isCharging = widget.value
+  if batteryLevel <= 20: textcolor=RED
+  elif batteryLevel <= 50: textcolor=ORANGE
+  else: textcolor=DARKGREY
+  batteryLevelStr = f"{batteryLevel}%"
+  if isCharging and batteryLevel < 100: batteryLevelStr = "+" + batteryLevelStr
+  gfx.setFont(M5.Display.FONTS.DejaVu40)
+  gfx.setTextSize(1)
+  w = gfx.textWidth(batteryLevelStr)
+  gfx.fillRect(widget.x, widget.y, widget.w - w, widget.h, M5.Display.COLOR.BLACK)
+  gfx.setTextColor(textcolor, M5.Display.COLOR.BLACK)
+  gfx.drawString(batteryLevelStr, widget.x + widget.w - w, widget.y)
+
+def isFlipped(mode):
+  return MODES[mode].startswith("flip")
+
+def isChart(mode):
+  return MODES[mode].endswith("chart")
+
+def flipMode(mode, flipped):
+  # maps a mode to its flipped or normal variant, e.g. chart <-> flip_chart
+  name = MODES[mode]
+  if name.startswith("flip_"): name = name[5:]
+  if flipped: name = "flip_" + name
+  return MODES.index(name)
+
+def getChartPoints():
+  # persisted history of the chart window plus the latest response, oldest first
+  points = {}
+  if response != None:
+    for entry in response:
+      points[entrySeconds(entry)] = entry['sgv']
+  newest = max(sgvHistory.newest(), max(points) if points else -1)
+  for seconds, sgv in sgvHistory.items(newest - chart.CHART_WINDOW_SEC):
+    if seconds not in points: points[seconds] = sgv
+  return sorted(points.items())
+
+def buildChartScreen():
+  # Header with the current reading above the history chart
+  global chartScreen
+  d = M5.Display
+  fonts = M5.Display.FONTS
+  chartScreen = render.Compositor(d, frame=frame)
+
+  d.setFont(fonts.DejaVu72)
+  d.setTextSize(1)
+  f = d.fontHeight()
+  wsgv = d.textWidth("888")
+  d.setFont(fonts.DejaVu24)
+  lw = d.textWidth(SGV_LABEL)
+  d.setFont(fonts.DejaVu40)
+  fh = d.fontHeight()
+  wd = d.textWidth("(+99)")
+  chartScreen.add("sgv", render.TextWidget(20, 10, wsgv, f, fonts.DejaVu72, label=SGV_LABEL, labelFont=fonts.DejaVu24, labelDy=f-30, labelColor=DARKGREY))
+  x = 20 + wsgv + lw + 20
+  chartScreen.add("sgvDiff", render.TextWidget(x, 10 + int((f-fh)/2), wd, fh, fonts.DejaVu40))
+  x += wd + 10
+  ar = 30 + 17 + 6 # radius 30, see buildScreen
+  chartScreen.add("arrow", arrow.ArrowWidget(x, 10 + int(f/2) - ar, 2*ar, 2*ar, 30))
+  x += 2*ar + 20
+  chartScreen.add("dateStr", render.TextWidget(x, 10 + int((f-fh)/2), 400, fh, fonts.DejaVu40))
+  chartScreen.add("time", render.TextWidget(SCREEN_WIDTH-400, 10, 240, f, fonts.DejaVu72, align=render.RIGHT))
+  chartScreen.add("battery", render.PaintWidget(SCREEN_WIDTH-140, 10 + int((f-fh)/2), 120, fh, paintBatteryText))
+
+  top = 10 + max(f, 2*ar) + 10
+  history = chart.ChartWidget(0, top, SCREEN_WIDTH, SCREEN_HEIGHT - top, getChartPoints, font=fonts.DejaVu18)
+  history.configure(MIN, MAX, EMERGENCY_MIN, EMERGENCY_MAX, (RED, DARKGREEN, ORANGE, DARKGREY))
+  chartScreen.add("chart", history)
+
+def selectScreen(mode):
+  # switches between the glucose and chart screens, built on first use
+  global screen
+  if isChart(mode):
+    if chartScreen == None: buildChartScreen()
+    target = chartScreen
+  else:
+    target = mainScreen
+  if target is not screen:
+    screen = target
+    screen.invalidate()
+  screen.setRotation(3 if isFlipped(mode) else 1)
+
+def buildScreen():
+  # Widget layout of the 1280 x 720 glucose screen, every element keeps a fixed box
+  global screen, mainScreen
+  d = M5.Display
+  fonts = M5.Display.FONTS
+  screen = render.Compositor(d, frame=frame)
+  radius = 60
+
+  # widgets are added in paint order (back to front): glyph cells of the big
+  # fonts overlap the separator lines and each other, the small frequently
+  # updated clock and battery go on top so their repaints stay local
+  d.setFont(fonts.DejaVu72)
+  d.setTextSize(3)
+  time = glyphs.GlyphWidget(0, 15, SCREEN_WIDTH, d.fontHeight(), fonts.DejaVu72, size=3, align=render.CENTER)
+
+  d.setFont(fonts.DejaVu40)
+  d.setTextSize(1)
+  fh = d.fontHeight()
+  leftmost_x = int(SCREEN_WIDTH - d.textWidth("100%") - 20 - 10) # 10 is margin for frame
+  battery = render.PaintWidget(leftmost_x, 15, SCREEN_WIDTH - leftmost_x, 170+fh-15+5, paintBatteryLevel)
+
+  d.setFont(fonts.DejaVu72)
+  d.setTextSize(4)
+  f = d.fontHeight()
+  wsgv = d.textWidth("888")
+  y = int((SCREEN_HEIGHT - f) / 2) + 30
+  line1 = render.LineWidget(10, y, SCREEN_WIDTH-10, DARKGREY)
+
+  y += 30
+  ly = y+f-100
+  screen.add("sgv", glyphs.GlyphWidget(10, y, wsgv, f, fonts.DejaVu72, size=4, label=SGV_LABEL, labelFont=fonts.DejaVu40, labelDy=ly-y, labelColor=DARKGREY))
+
+  d.setTextSize(2)
+  f = d.fontHeight()
+  wd = d.textWidth("(+99)")
+  right = SCREEN_WIDTH - 20 - (2*radius)
+  lx = right - wd
+  screen.add("sgvDiff", glyphs.GlyphWidget(lx, y+20, wd, f, fonts.DejaVu72, size=2, align=render.RIGHT))
+
+  # arrow circle is at most radius+16 long plus margin, see arrow.shape
+  ar = radius + 17 + 6
+  y += int(f / 2)
+  screen.add("arrow", arrow.ArrowWidget(right + radius - ar, y + 20 - ar, 2*ar, 2*ar, radius))
+
+  d.setFont(fonts.DejaVu40)
+  d.setTextSize(1)
+  screen.add("dateStr", render.TextWidget(lx, ly, SCREEN_WIDTH - lx, d.fontHeight(), fonts.DejaVu40, align=render.CENTER))
+
+  y += f+55
+  line2 = render.LineWidget(10, y, SCREEN_WIDTH-10, DARKGREY)
+  y += 10
+
+  d.setFont(fonts.DejaVu72)
+  d.setTextSize(1.5)
+  f = d.fontHeight()
+  fy = int(y+(SCREEN_HEIGHT-y)/2)-20 - 5
+  y = int(y+(SCREEN_HEIGHT-y-f)/2) + 5
+  d.setTextSize(1)
+  screen.add("tempStr", render.TextWidget(20, y, SCREEN_WIDTH, f, fonts.DejaVu72, size=1.5, label=TEMPC_LABEL, labelFont=fonts.DejaVu40, labelSize=1.5, labelDy=fy-y, labelColor=DARKGREY))
+  screen.add("pressureStr", render.TextWidget(0, y, SCREEN_WIDTH-120, f, fonts.DejaVu72, size=1.5, align=render.CENTER, label=HPA_LABEL, labelFont=fonts.DejaVu40, labelSize=1.5, labelDy=fy-y, labelColor=DARKGREY))
+  screen.add("humidityStr", render.TextWidget(0, y, SCREEN_WIDTH-20-90, f, fonts.DejaVu72, size=1.5, align=render.RIGHT, label=HUMIDITY_LABEL, labelFont=fonts.DejaVu40, labelSize=1.5, labelDy=fy-y, labelColor=DARKGREY))
+
+  screen.add("line1", line1)
+  screen.add("line2", line2)
+  screen.add("battery", battery)
+  screen.add("time", time)
+  mainScreen = screen
+
+def requestFlush(name, priority):
+  # Partial repaint of one widget by the render task. A screen update queued
+  # meanwhile is painted first and takes the widget along.
+  renderQueue.request(name, lambda: screen.flush(only=[name]), priority)
+
+def requestScreen(noNetwork=False, clear=True):
+  # drawScreen of the newest entry by the render task, requests coalesce
+  # into one draw that clears if any of them asked for it
+  global pendingClear
+  pendingClear = pendingClear or clear
+  renderQueue.request("screen", lambda: paintScreen(noNetwork), scheduler.RENDER_SCREEN)
+
+def paintScreen(noNetwork):
+  global pendingClear
+  clear = pendingClear
+  pendingClear = False
+  if response != None:
+    drawScreen(response[0], noNetwork=noNetwork, clear=clear)
+
+def printLocaltime(mode, secondsDiff, localtime=None, flush=True, firstRun=False):
+  try:
+    if localtime == None and not rtcSet():
+      h, m, s = None, None, None
+    elif localtime == None:
+      s = localNow() % 86400
+      h, m, s = s // 3600, s // 60 % 60, s % 60
     else:
-        p1 = get_rotated(r, 0)
-        p2 = get_rotated(r - tri_h, -tri_w/2)
-        p3 = get_rotated(r - tri_h, tri_w/2)
-        M5.Lcd.fillTriangle(p1[0], p1[1], p2[0], p2[1], p3[0], p3[1], color)
-        s_off = r - tri_h
-        s1 = get_rotated(s_off, -stem_w/2)
-        s2 = get_rotated(s_off, stem_w/2)
-        s3 = get_rotated(s_off - stem_l, stem_w/2)
-        s4 = get_rotated(s_off - stem_l, -stem_w/2)
-        M5.Lcd.fillTriangle(s1[0], s1[1], s2[0], s2[1], s3[0], s3[1], color)
-        M5.Lcd.fillTriangle(s1[0], s1[1], s3[0], s3[1], s4[0], s4[1], color)
-
-def printLocaltime(mode, secondsDiff, localtime=None, useLock=False, silent=False, firstRun=False):
-  global prevStr
-  try: 
-    if localtime == None:
-      now_datetime = getRtcDatetime()
-      now = utime.mktime((now_datetime[0], now_datetime[1], now_datetime[2], now_datetime[3], now_datetime[4], now_datetime[5],0,0))  + secondsDiff
-      localtime = utime.localtime(now)
-    h, m, s = localtime[3:6]
-    timeStr = f"{h:02d}:{m:02d}"
-    if SHOW_SECONDS:
-      timeStr += f":{s:02d}"
-    if not firstRun and ("timeStr" not in prevStr or prevStr["timeStr"] != timeStr):
-      locked = False 
-      if not useLock and not drawScreenLock.locked():
-        locked = drawScreenLock.acquire()
-      if locked or useLock:
-        M5.Display.setFont(M5.Display.FONTS.DejaVu72)  
-        M5.Display.setTextSize(3)
-        w = M5.Display.textWidth(timeStr)
-        y = 15
-        if "timeStr" in prevStr and len(prevStr["timeStr"]) > len(timeStr):
-          f = M5.Display.fontHeight()
-          wp = M5.Display.textWidth("00:00:00")
-          M5.Display.fillRect(int((SCREEN_WIDTH-wp)/2), y, wp, f, M5.Display.COLOR.BLACK)
-        printText(timeStr, int((SCREEN_WIDTH-w)/2), y, silent=silent)  
-        M5.Display.setTextSize(1)
-        if not useLock and locked:
-          drawScreenLock.release()
-      prevStr["timeStr"] = timeStr    
+      h, m, s = localtime[3:6]
+    if h == None:
+      timeStr = "--:--" # not set by NTP yet
+    elif SHOW_SECONDS:
+      timeStr = f"{h:02d}:{m:02d}:{s:02d}"
+    else:
+      timeStr = f"{h:02d}:{m:02d}"
+    screen.set("time", (timeStr, DARKGREY))
+    if flush and not firstRun:
+      requestFlush("time", scheduler.RENDER_CLOCK)
   except Exception as e:
     sys.print_exception(e)
     saveError(e)
 
-def printBatteryLevel(useLock=False, silent=False):
-  global prevStr
+def printBatteryLevel(flush=True):
   try:
-    batteryLevel = getBatteryLevel()
-    if batteryLevel < 0: batteryLevel = 0 
-    elif batteryLevel > 100: batteryLevel = 100 
-    isCharging = M5.Power.isCharging()
-
-    if "batteryLevel" not in prevStr or "isCharging" not in prevStr or prevStr["batteryLevel"] != batteryLevel or prevStr.get("isCharging") != isCharging:
-      locked = False 
-      if not useLock and not drawScreenLock.locked():
-        locked = drawScreenLock.acquire()
-      
-      if locked or useLock:
-        batteryLevelStr = f"{batteryLevel}%"
-        M5.Display.setFont(M5.Display.FONTS.DejaVu40)  
-        M5.Display.setTextSize(1)
-        w = M5.Display.textWidth(batteryLevelStr) 
-        fh = M5.Display.fontHeight()
-        y = 170
-        wo = M5.Display.textWidth("100%")
-        
-        # Dynamically center indicator to the current text width
-        x = int(SCREEN_WIDTH - w/2 - 20 - 25/2)
-        
-        # Comprehensive clear: cover max possible area where text or indicator could be
-        leftmost_x = int(SCREEN_WIDTH - wo - 20 - 10) # 10 is margin for frame
-        M5.Display.fillRect(leftmost_x, 15, SCREEN_WIDTH - leftmost_x, y+fh-15+5, M5.Display.COLOR.BLACK)
-
-        if batteryLevel <= 20: textcolor=RED
-        elif batteryLevel <= 50: textcolor=ORANGE
-        else: textcolor=DARKGREY 
-        printText(batteryLevelStr, SCREEN_WIDTH-w-20, y, font=M5.Display.FONTS.DejaVu40, textColor=textcolor, silent=silent)
-        
-        b = y-40
-        nb = int(b/100*batteryLevel)
-        if batteryLevel <= 20: color=RED
-        elif batteryLevel <= 50: color=ORANGE
-        else: color=DARKGREEN
-        
-        # Draw frame if charging 
-        if isCharging and batteryLevel < 100:
-          M5.Display.drawRect(x-5, 20-5, 25+10, b+10, DARKGREY)
-          M5.Display.drawRect(x-4, 20-4, 25+8, b+8, DARKGREY)
-        else:
-          # Clear frame area (redundant due to fillRect BLACK, but safe)
-          M5.Display.drawRect(x-5, 20-5, 25+10, b+10, M5.Display.COLOR.BLACK)
-          M5.Display.drawRect(x-4, 20-4, 25+8, b+8, M5.Display.COLOR.BLACK)
-          
-        # Draw battery bar (width 25)
-        M5.Display.fillRect(x, 20, 25, b, DARKGREY)
-        M5.Display.fillRect(x, 20+b-nb, 25, nb, color)
-        
-        if not useLock and locked:
-          drawScreenLock.release()
-      
-      prevStr["batteryLevel"] = batteryLevel
-      prevStr["isCharging"] = isCharging
+    batteryLevel = min(100, getBatteryLevel())
+    screen.set("battery", (batteryLevel, batterySampler.charging))
+    if flush and not firstRun:
+      requestFlush("battery", scheduler.RENDER_BATTERY)
   except Exception as e:
     sys.print_exception(e)
     saveError(e)
 
 def drawScreen(newestEntry, noNetwork=False, clear=True):
-  global response, mode, brightness, emergency, emergencyPause, MIN, MAX, EMERGENCY_MIN, EMERGENCY_MAX, startTime, rgbUnit, secondsDiff, OLD_DATA, OLD_DATA_EMERGENCY, envUnit, secondsDiff, humidityStr, pressureStr, tempStr, firstRun, prevStr
-  
+  global response, mode, brightness, emergency, emergencyPause, prediction, MIN, MAX, EMERGENCY_MIN, EMERGENCY_MAX, startTime, rgbUnit, secondsDiff, OLD_DATA, OLD_DATA_EMERGENCY, envUnit, secondsDiff, humidityStr, pressureStr, tempStr, firstRun, firstReadingMs, freshReadingMs
+
   #1280 x 720
-  
-  now_datetime = getRtcDatetime()
-    
-  locked = drawScreenLock.acquire()
 
-  if locked: 
+  if rtcSet():
+    now = localNow()
+  else:
+    now = None # cold boot before NTP: the age of a cached reading is unknown, it is shown as stale
 
-    if firstRun:
-      clear = True
+  s = utime.time()
 
-    s = utime.time()
+  print('Printing screen in ' + MODES[mode] + ' mode')
 
-    acceleration = M5.Imu.getAccel()
-    print("Current acceleration: " + str(acceleration))
+  sgv = newestEntry['sgv']
+  sgvStr = str(sgv)
 
-    print('Printing screen in ' + MODES[mode] + ' mode')
-  
-    sgv = newestEntry['sgv']
-    sgvStr = str(sgv)
-  
-    directionStr = newestEntry['direction']
-    sgvDateStr = newestEntry['date']
-  
-    now = utime.mktime((now_datetime[0], now_datetime[1], now_datetime[2], now_datetime[3], now_datetime[4], now_datetime[5],0,0))  + secondsDiff
-    
-    tooOld = False
-    try:
-      tooOld = isOlderThan(sgvDateStr, OLD_DATA, now, print_time=True)
-    except Exception as e:
-      sys.print_exception(e)
-      saveError(e)
-    #print("Is sgv data older than " + str(OLD_DATA) + " minutes?", tooOld)  
+  directionStr = newestEntry['direction']
+  if directionStr not in arrow.ANGLES:
+    directionStr = forecaster.direction() # local trend, see trackTrend
+  sgvDateStr = newestEntry['date']
 
-    emergencyNew = None
-  
-    if tooOld: backgroundColor=DARKGREY; emergencyNew=False
-    elif sgv <= EMERGENCY_MIN: backgroundColor=RED; emergencyNew=(utime.time() > emergencyPause and not tooOld)  
-    elif sgv >= (MIN-10) and sgv < MIN and directionStr.endswith("Up"): backgroundColor=DARKGREEN; emergencyNew=False
-    elif sgv > EMERGENCY_MIN and sgv < MIN: backgroundColor=RED; emergencyNew=False
-    elif sgv >= MIN and sgv <= MAX: backgroundColor=DARKGREEN; emergencyNew=False 
-    elif sgv > MAX and sgv <= (MAX+10) and directionStr.endswith("Down"): backgroundColor=DARKGREEN; emergencyNew=False
-    elif sgv > MAX and sgv <= EMERGENCY_MAX: backgroundColor=ORANGE; emergencyNew=False
-    elif sgv > EMERGENCY_MAX: backgroundColor=ORANGE; emergencyNew=(utime.time() > emergencyPause and not tooOld)  
-  
-    #battery level emergency
-    batteryLevel = getBatteryLevel()
-    if batteryLevel < 0: batteryLevel = 0 
-    elif batteryLevel > 100: batteryLevel = 100 
-
-    uptime = utime.time() - startTime  
-    if (batteryLevel < 10 and batteryLevel > 0 and uptime > 300) and (utime.time() > emergencyPause) and not M5.Power.isCharging(): 
-      emergencyNew = True
-
-    #old data emergency
-    if utime.time() > emergencyPause and isOlderThan(sgvDateStr, OLD_DATA_EMERGENCY, now):
-      emergencyNew = True
-      clear = True   
-
-    emergency = emergencyNew  
-
-    if not emergency and rgbUnit != None:
-      rgbUnit.set_color(0, M5.Display.COLOR.BLACK)
-      rgbUnit.set_color(1, backgroundColor)
-      rgbUnit.set_color(2, M5.Display.COLOR.BLACK)
-
-    if not noNetwork  and "ago" in newestEntry: 
-      dateStr = newestEntry['ago']
-    else:   
-      dateStr = sgvDateStr.replace("T", " ")[:-3] #remove seconds
-  
-    if not tooOld and directionStr == 'DoubleUp' and sgv+20>=MAX and sgv<MAX: arrowColor = ORANGE
-    elif not tooOld and directionStr == 'DoubleUp' and sgv>=MAX: arrowColor = RED
-    elif not tooOld and directionStr == 'DoubleDown' and sgv-20<=MIN: arrowColor = RED
-    elif not tooOld and directionStr.endswith('Up') and sgv+10>=MAX and sgv<MAX: arrowColor = ORANGE
-    elif not tooOld and directionStr.endswith('Down') and sgv-10<=MIN: arrowColor = RED
-    else: arrowColor = backgroundColor  
-
-    tempStr = "--"
-    pressureStr = "---"
-    humidityStr = "--"
-    try:
-      if envUnit != None:
-        tempStr = "%.0f" % envUnit.read_temperature()
-        pressureStr = "%.0f" % envUnit.read_pressure()
-        humidityStr = "%.0f" % envUnit.read_humidity()
-    except Exception as e:
-      sys.print_exception(e)
-      #saveError(e)
+  batteryLevel = min(100, getBatteryLevel())
 
-    sgvDiff = 0
-    if len(response) > 1: 
-       sgvDiff = sgv - response[1]['sgv']
-       if sgvDiff >= 100: sgvDiff = 99
-       elif sgvDiff <= -100: sgvDiff = -99
-    sgvDiffStr = f"({'+' if sgvDiff > 0 else ''}{sgvDiff})"
+  age = 0
+  try:
+    if now != None: age = now - entrySeconds(newestEntry)
+  except Exception as e:
+    sys.print_exception(e)
+    saveError(e)
+  if now != None: printTime(age, prefix='Entry read', suffix='ago')
+
+  tooOld = now == None or isOlderThan(age, OLD_DATA, batteryLevel)
+  #print("Is sgv data older than " + str(OLD_DATA) + " minutes?", tooOld)
+
+  emergencyNew = None
+
+  if tooOld: backgroundColor=DARKGREY; emergencyNew=False
+  elif sgv <= EMERGENCY_MIN: backgroundColor=RED; emergencyNew=(utime.time() > emergencyPause and not tooOld)
+  elif sgv >= (MIN-10) and sgv < MIN and directionStr.endswith("Up"): backgroundColor=DARKGREEN; emergencyNew=False
+  elif sgv > EMERGENCY_MIN and sgv < MIN: backgroundColor=RED; emergencyNew=False
+  elif sgv >= MIN and sgv <= MAX: backgroundColor=DARKGREEN; emergencyNew=False
+  elif sgv > MAX and sgv <= (MAX+10) and directionStr.endswith("Down"): backgroundColor=DARKGREEN; emergencyNew=False
+  elif sgv > MAX and sgv <= EMERGENCY_MAX: backgroundColor=ORANGE; emergencyNew=False
+  elif sgv > EMERGENCY_MAX: backgroundColor=ORANGE; emergencyNew=(utime.time() > emergencyPause and not tooOld)
+
+  #predicted low or high emergency
+  prediction = None
+  if PREDICTION_ALERTS and not emergencyNew and not tooOld and forecaster.alert != None and utime.time() > emergencyPause:
+    emergencyNew = True
+    prediction = forecaster.alert
+
+  #battery level emergency
+  uptime = utime.time() - startTime
+  if (batteryLevel < 10 and batteryLevel > 0 and uptime > 300) and (utime.time() > emergencyPause) and not batterySampler.charging:
+    emergencyNew = True
+
+  #old data emergency
+  if utime.time() > emergencyPause and isOlderThan(age, OLD_DATA_EMERGENCY, batteryLevel):
+    emergencyNew = True
+    clear = True
+
+  emergency = emergencyNew
+
+  if not emergency and rgbUnit != None:
+    rgbUnit.set_color(0, M5.Display.COLOR.BLACK)
+    rgbUnit.set_color(1, backgroundColor)
+    rgbUnit.set_color(2, M5.Display.COLOR.BLACK)
+
+  if not noNetwork  and "ago" in newestEntry:
+    dateStr = newestEntry['ago']
+  else:
+    dateStr = sgvDateStr.replace("T", " ")[:-3] #remove seconds
+
+  if not tooOld and directionStr == 'DoubleUp' and sgv+20>=MAX and sgv<MAX: arrowColor = ORANGE
+  elif not tooOld and directionStr == 'DoubleUp' and sgv>=MAX: arrowColor = RED
+  elif not tooOld and directionStr == 'DoubleDown' and sgv-20<=MIN: arrowColor = RED
+  elif not tooOld and directionStr.endswith('Up') and sgv+10>=MAX and sgv<MAX: arrowColor = ORANGE
+  elif not tooOld and directionStr.endswith('Down') and sgv-10<=MIN: arrowColor = RED
+  else: arrowColor = backgroundColor
+
+  # sampled by the env task, no I2C here
+  temp, pressure, humidity = envValues()
+  tempStr, pressureStr, humidityStr = temp[0], pressure[0], humidity[0]
+
+  sgvDiff = 0
+  if len(response) > 1:
+     sgvDiff = sgv - response[1]['sgv']
+     if sgvDiff >= 100: sgvDiff = 99
+     elif sgvDiff <= -100: sgvDiff = -99
+  sgvDiffStr = f"({'+' if sgvDiff > 0 else ''}{sgvDiff})"
+
+  muchTooOld = isOlderThan(age, MUCH_TOO_OLD_DATA, batteryLevel) #older than MUCH_TOO_OLD_DATA mins
+
+  if muchTooOld:
+    sgvStr = "---"
+    sgvDiffStr = "(--)"
+    arrowColor = M5.Display.COLOR.BLACK #hide arrow
+
+  sgvDiffColor = DARKGREY
+  if not tooOld and not muchTooOld:
+    fabsSgvDiff = math.fabs(sgvDiff)
+    if sgv <= EMERGENCY_MIN:
+      sgvDiffColor = DARKGREEN if sgvDiff > 0 else RED
+    elif sgv >= EMERGENCY_MAX:
+      sgvDiffColor = DARKGREEN if sgvDiff < 0 else RED
+    elif sgv < MIN:
+      sgvDiffColor = DARKGREEN if sgvDiff > 0 else RED
+    elif sgv > MAX:
+      sgvDiffColor = DARKGREEN if sgvDiff < 0 else RED
+    else:
+      sgvDiffColor = ORANGE if fabsSgvDiff >= 30 else DARKGREY
 
-    rotate = 1
-    if mode >= 4:
-      rotate = 3
-    M5.Display.setRotation(rotate)  
+  dateColor = DARKGREY
+  if now == None or isOlderThan(age, 10, batteryLevel):
+     dateColor = RED
 
-    if clear:
-      M5.Display.clear(M5.Display.COLOR.BLACK)
-      prevStr = {}
+  # everything above is computed, below only paints
 
-    muchTooOld = False
-    try:
-      muchTooOld = isOlderThan(sgvDateStr, MUCH_TOO_OLD_DATA, now, print_time=True) #older than MUCH_TOO_OLD_DATA mins
-    except Exception as e:
-      sys.print_exception(e)
-      saveError(e)
-    
-    if muchTooOld:
-      sgvStr = "---"
-      sgvDiffStr = "(--)"
-      arrowColor = M5.Display.COLOR.BLACK #hide arrow
-
-    #draw current time
-    printLocaltime(mode, secondsDiff, useLock=True)  
- 
-    #draw battery level 
-    printBatteryLevel(useLock=True)
- 
-    M5.Display.setFont(M5.Display.FONTS.DejaVu72)  
-    M5.Display.setTextSize(4)
-    x = 10
-    w = M5.Display.textWidth(sgvStr) 
-    f = M5.Display.fontHeight()
-    y = int((SCREEN_HEIGHT - f) / 2) + 30
-    
-    if clear:
-      M5.Display.drawLine(10, y, SCREEN_WIDTH-10, y, DARKGREY)
-    
-    #draw sgv
-    y += 30
-    drawSgv = False
-    if ("sgvStr" in prevStr and prevStr["sgvStr"] != sgvStr) or ("sgvStrColor" in prevStr and prevStr["sgvStrColor"] != backgroundColor):
-       M5.Display.fillRect(x, y, M5.Display.textWidth("8888")-40, f, M5.Display.COLOR.BLACK)
-       drawSgv = True
-    if drawSgv or "sgvStr" not in prevStr:  
-       printText(sgvStr, x, y, textColor=backgroundColor)
-    M5.Display.setTextSize(1)
-    
-    ly = y+f-100
-    if drawSgv or "sgvStr" not in prevStr:  
-       printText(SGV_LABEL, x+w, ly, font=M5.Display.FONTS.DejaVu40)
-    
-    prevStr["sgvStr"] = sgvStr
-    prevStr["sgvStrColor"] = backgroundColor
-
-    #draw sgv diff
-    radius = 60
-    gap = 0
-    M5.Display.setFont(M5.Display.FONTS.DejaVu72)  
-    M5.Display.setTextSize(2)
-    f = M5.Display.fontHeight()
-    w = M5.Display.textWidth(sgvDiffStr)
-    x = SCREEN_WIDTH - 20 - (2*radius) - gap - w
-    drawSgvDiff = False
-    if "sgvDiffStr" in prevStr:
-       fx = SCREEN_WIDTH - 20 - (2*radius) - gap - M5.Display.textWidth(prevStr["sgvDiffStr"])
-       if prevStr["sgvDiffStr"] != sgvDiffStr:
-         M5.Display.fillRect(fx, y, M5.Display.textWidth(prevStr["sgvDiffStr"]), f+5, M5.Display.COLOR.BLACK)
-         drawSgvDiff = True
-    if drawSgvDiff or "sgvDiffStr" not in prevStr:  
-       sgvDiffColor = DARKGREY
-       if not tooOld and not muchTooOld:
-         fabsSgvDiff = math.fabs(sgvDiff)
-         if sgv <= EMERGENCY_MIN: 
-           sgvDiffColor = DARKGREEN if sgvDiff > 0 else RED
-         elif sgv >= EMERGENCY_MAX:
-           sgvDiffColor = DARKGREEN if sgvDiff < 0 else RED  
-         elif sgv < MIN:
-           sgvDiffColor = DARKGREEN if sgvDiff > 0 else RED
-         elif sgv > MAX:
-           sgvDiffColor = DARKGREEN if sgvDiff < 0 else RED
-         else:
-           sgvDiffColor = ORANGE if fabsSgvDiff >= 30 else DARKGREY         
-       printText(sgvDiffStr, x, y+20, textColor=sgvDiffColor)
-    M5.Display.setTextSize(1)
-    lx = x
-    prevStr["sgvDiffStr"] = sgvDiffStr
-    
-    #draw arrow
-    x += w + gap + radius
-    y += int(f / 2) 
-
-    if "directionStr" not in prevStr or prevStr["directionStr"] != directionStr or "directionStrColor" not in prevStr or prevStr["directionStrColor"] != arrowColor:     
-       if directionStr == 'DoubleUp': drawArrow(x, y+20, radius=radius, color=arrowColor, is_double=True)
-       elif directionStr == 'DoubleDown': drawArrow(x, y+20, radius=radius, angle_degrees=180, color=arrowColor, is_double=True) 
-       elif directionStr == 'SingleUp': drawArrow(x, y+20, radius=radius, color=arrowColor)
-       elif directionStr == 'SingleDown': drawArrow(x, y+20, radius=radius, angle_degrees=180, color=arrowColor)
-       elif directionStr == 'Flat': drawArrow(x, y+20, radius=radius, angle_degrees=90, color=arrowColor)
-       elif directionStr == 'FortyFiveUp': drawArrow(x, y+20, radius=radius, angle_degrees=45, color=arrowColor)
-       elif directionStr == 'FortyFiveDown': drawArrow(x, y+20, radius=radius, angle_degrees=135, color=arrowColor)
-    prevStr["directionStr"] = directionStr
-    prevStr["directionStrColor"] = arrowColor
-
-    #draw dateStr
-    M5.Display.setFont(M5.Display.FONTS.DejaVu40)
-    textColor = DARKGREY
-    if isOlderThan(sgvDateStr, 10, now): 
-       textColor = RED
-    w = M5.Display.textWidth(dateStr)
-    x = lx + int((SCREEN_WIDTH-lx-w)/2)
-    fh = M5.Display.fontHeight()
-    drawDateStr = False
-    if "dateStr" in prevStr and prevStr["dateStr"] != dateStr:
-       clear_x = max(0, lx - 20)
-       clear_w = SCREEN_WIDTH - clear_x - 10
-       M5.Display.fillRect(clear_x, ly - 5, clear_w, fh + 10, M5.Display.COLOR.BLACK)
-       drawDateStr = True
-    if drawDateStr or "dateStr" not in prevStr:  
-       printText(dateStr, x, ly, textColor=textColor)  
-    prevStr["dateStr"] = dateStr
-
-    y += f+55
-    M5.Display.drawLine(10, y, SCREEN_WIDTH-10, y, DARKGREY)
-    y += 10
-
-    #draw tempStr
-    M5.Display.setFont(M5.Display.FONTS.DejaVu72)
-    M5.Display.setTextSize(1.5)
-    f = M5.Display.fontHeight()
-    w = M5.Display.textWidth(tempStr)
-    y = int(y+(SCREEN_HEIGHT-y-f)/2) + 5
-    fy = int(y+(SCREEN_HEIGHT-y)/2)-20 - 5
-    if "tempStr" not in prevStr or prevStr["tempStr"] != tempStr:
-       printText(tempStr, 20, y)
-       printText(TEMPC_LABEL, 20+w, fy, font=M5.Display.FONTS.DejaVu40)
-    prevStr["tempStr"] = tempStr
-
-    #draw pressureStr
-    M5.Display.setFont(M5.Display.FONTS.DejaVu72)
-    w = M5.Display.textWidth(pressureStr)
-    drawPressure = False
-    if "pressureStr" in prevStr and prevStr["pressureStr"] != pressureStr:
-       prevPressureStr = prevStr["pressureStr"] + " hPa"
-       fx = int((SCREEN_WIDTH-M5.Display.textWidth(prevPressureStr))/2)-60
-       M5.Display.fillRect(fx, y, M5.Display.textWidth(prevPressureStr), f, M5.Display.COLOR.BLACK)
-       drawPressure = True
-    if "pressureStr" not in prevStr or drawPressure:   
-       printText(pressureStr, int((SCREEN_WIDTH-w)/2)-60, y)
-       printText(HPA_LABEL, int((SCREEN_WIDTH-w)/2)-60+w, fy, font=M5.Display.FONTS.DejaVu40)
-    prevStr["pressureStr"] = pressureStr
-
-    #draw humidityStr
-    M5.Display.setFont(M5.Display.FONTS.DejaVu72)
-    w = M5.Display.textWidth(humidityStr)
-    if "humidityStr" not in prevStr or prevStr["humidityStr"] != humidityStr:
-       printText(humidityStr, SCREEN_WIDTH-w-20-90, y)
-       printText(HUMIDITY_LABEL, SCREEN_WIDTH-20-90, fy, font=M5.Display.FONTS.DejaVu40)
-    prevStr["humidityStr"] = humidityStr
-
-    if firstRun: firstRun = False
-
-    drawScreenLock.release()
-    print("Printing screen finished in " + str((utime.time() - s)) + " secs ...")  
-  else:    
-    print("Printing locked!")
+  if firstRun:
+    clear = True
+
+  selectScreen(mode)
+  if clear:
+    screen.invalidate()
+
+  #current time and battery level
+  printLocaltime(mode, secondsDiff, flush=False)
+  printBatteryLevel(flush=False)
+
+  screen.set("sgv", (sgvStr, backgroundColor))
+  screen.set("sgvDiff", (sgvDiffStr, sgvDiffColor))
+  arrowWidget = screen.get("arrow")
+  arrowWidget.animate = ARROW_ANIMATION and not powerManager.saving
+  screen.set("arrow", (directionStr, arrowColor))
+  screen.set("dateStr", (dateStr, dateColor))
+  screen.set("tempStr", temp)
+  screen.set("pressureStr", pressure)
+  screen.set("humidityStr", humidity)
+  screen.set("chart", entrySeconds(newestEntry))
+
+  drawn = screen.flush()
+  if arrowWidget.moving() and not arrowAnimating:
+    scheduler.start("arrow", animateArrow())
+
+  if firstRun:
+    firstRun = False
+    firstReadingMs = utime.ticks_ms()
+    print("First reading shown %d ms after boot%s" % (firstReadingMs, "" if responseFresh else " (cached)"))
+  if freshReadingMs == None and responseFresh:
+    freshReadingMs = utime.ticks_ms()
+    print("Fresh reading shown %d ms after boot" % freshReadingMs)
+
+  print("Printing screen finished in " + str((utime.time() - s)) + " secs, " + str(drawn) + " widgets repainted ...")
+
+async def animateArrow():
+  # one rotation step per frame, painted by the render task like the clock
+  global arrowAnimating
+  arrowAnimating = True
+  try:
+    while True:
+      await asyncio.sleep_ms(ARROW_FRAME_MS)
+      w = screen.get("arrow")
+      if w == None or not w.moving():
+        break
+      w.step()
+      requestFlush("arrow", scheduler.RENDER_ARROW)
+  finally:
+    arrowAnimating = False
 
 # ------
 
-def connectToWifi(printText = True):
-  global wifi_ssid, wifi_password, config, mode
+async def waitForWifi(nic, timeoutMs):
+  start = utime.ticks_ms()
+  while utime.ticks_diff(utime.ticks_ms(), start) < timeoutMs:
+    if nic.isconnected():
+      return True
+    await asyncio.sleep_ms(100)
+  return nic.isconnected()
+
+async def connectToWifi(printText = True):
+  # straight to the cached access point with its lease, scanning for the
+  # strongest known network only when that fails
+  global config, mode
   nic = network.WLAN(network.STA_IF)
-  nic.active(True)
+  powerManager.radio(True)
   
   if nic.isconnected():
     return True
 
+  start = utime.ticks_ms()
+  networks = config.get("wifi", [])
+  cached = wifiCache.entry(networks)
+  if cached != None:
+    ssid, password, bssid, channel, lease = cached
+    if printText == True:
+      printCenteredText("Connecting wifi...", mode, backgroundColor=DARKGREY)
+    print('Connecting wifi ' + ssid + ' (cached access point)')
+    nic.ifconfig(lease)
+    try: nic.config(channel=channel) # a hint, the BSSID alone already narrows the driver's search
+    except: pass
+    nic.connect(ssid, password, bssid=bssid)
+    if await waitForWifi(nic, WIFI_FAST_CONNECT_MS):
+      print("WiFi connected in %d ms (cached access point)" % utime.ticks_diff(utime.ticks_ms(), start))
+      return True
+    print("Cached access point not reachable, scanning...")
+    nic.disconnect()
+
+  try: nic.ifconfig("dhcp")
+  except: pass
+
   if printText == True:
     printCenteredText("Scanning wifi...", mode, backgroundColor=DARKGREY)
   
-  wifi_password = None
-  wifi_ssid = None  
-  
+  found = None
   retry = 0
-  while wifi_password == None and retry < 10:
+  while found == None and retry < 10:
     try: 
-      nets = nic.scan()
-      for result in nets:
-        security_type = result[4]
-        is_hidden = result[5]
-        if security_type > 0 and is_hidden == 0:
-          temp_ssid = result[0].decode()
-          for wifi_entry in config.get("wifi", []):
-            if wifi_entry.get("ssid") == temp_ssid:
-              wifi_ssid = temp_ssid
-              wifi_password = wifi_entry.get("password")
-              break
-        if wifi_password != None: break
+      found = wifi.strongest(nic.scan(), networks)
     except Exception as e:
       sys.print_exception(e)
       saveError(e)
     
-    if wifi_password == None:
+    if found == None:
       retry += 1
-      time.sleep(1)
+      await asyncio.sleep(1)
 
-  if wifi_password != None:
-    if printText == True:
-       printCenteredText("Connecting wifi...", mode, backgroundColor=DARKGREY) 
-    print('Connecting wifi ' + wifi_ssid)
-    nic.connect(wifi_ssid, wifi_password)
-    # Wait up to 10 seconds for connection
-    for _ in range(40):
-      if nic.isconnected():
-        print("WiFi connected.")
-        return True
-      time.sleep(0.25)
+  if found == None:
+    return False
+  ssid, password, bssid, channel = found
+  if printText == True:
+     printCenteredText("Connecting wifi...", mode, backgroundColor=DARKGREY) 
+  print('Connecting wifi ' + ssid)
+  try: nic.config(channel=channel)
+  except: pass
+  nic.connect(ssid, password, bssid=bssid)
+  if await waitForWifi(nic, WIFI_CONNECT_TIMEOUT_MS):
+    print("WiFi connected in %d ms (scan)" % utime.ticks_diff(utime.ticks_ms(), start))
+    wifiCache.save(ssid, bssid, channel, nic.ifconfig())
+    return True
   return False
 
-def backendMonitor():
-  global response, API_ENDPOINT, API_TOKEN, LOCALE, TIMEZONE, startTime, sgvDict, secondsDiff, backendResponse, mode, wifi_ssid, wifi_password
+def copyAgo(entry):
+  # the server's "ago" of the shown reading, when it sends one
+  ago = entry.get("ago")
+  if ago != None:
+    response[0]["ago"] = ago
+
+def trackTrend():
+  # the entries go to the local trend as they arrive, oldest first; those
+  # it has seen are skipped, a new one prints the trend once
+  added = False
+  for i in range(len(response) - 1, -1, -1):
+    added = forecaster.add(entrySeconds(response[i]), response[i]['sgv']) or added
+  if added and forecaster.rate10 != None:
+    print("Trend %.1f mg/dL/min, predicted %d in 15 and %d in 30 mins" % (forecaster.rate10 / 10, forecaster.predict(15), forecaster.predict(30)))
+
+def mergeEntries(newer, older):
+  # newest first, duplicates dropped by id, at most MAX_FETCH_ENTRIES kept.
+  # When the new entries alone fill the window (a gap) they replace it.
+  merged = list(newer)
+  if older != None and len(merged) < MAX_FETCH_ENTRIES:
+    ids = [entry["id"] for entry in newer]
+    for entry in older:
+      if len(merged) >= MAX_FETCH_ENTRIES: break
+      if entry["id"] not in ids: merged.append(entry)
+  return merged[:MAX_FETCH_ENTRIES]
+
+async def fetchEntries(query, timeout, longPoll=False):
+  # From the healthiest endpoint, failing over to the next one at once.
+  # A long-poll goes to the two healthiest with RACE_LONG_POLLS, the first
+  # answer is kept.
+  candidates = endpointPool.ranked()
+  if longPoll and RACE_LONG_POLLS and len(candidates) > 1:
+    return await raceEntries(candidates[:2], query, timeout)
+  tries = candidates[:2]
+  for i in range(len(tries)):
+    try:
+      return await fetchEntriesFrom(tries[i], query, timeout, longPoll)
+    except Exception as e:
+      if i + 1 == len(tries):
+        raise
+      sys.print_exception(e)
+      print("Failing over to " + tries[i + 1].host)
+
+async def fetchEntriesFrom(endpoint, query, timeout, longPoll=False):
+  # entries are parsed while they are read, keeping only ENTRY_FIELDS
+  global backendResponse
+  parser = jsonstream.EntryParser(ENTRY_FIELDS, MAX_FETCH_ENTRIES)
+  client = endpoint.client
+  try:
+    backendResponse = await client.get(
+      f"{endpoint.url}/entries.json?{query}",
+      headers={"api-secret": endpoint.token, "accept-language": LOCALE, "accept-charset": "ascii", "x-gms-tz": TIMEZONE},
+      timeout=timeout,
+      sink=parser.feed
+    )
+    print(f"Response status code: {backendResponse.status_code} from {endpoint.host} (handshake {client.handshakeMs} ms, request {client.requestMs} ms)")
+    if backendResponse.status_code != 200:
+      raise ValueError("Backend response error code " + str(backendResponse.status_code))
+  except Exception:
+    endpoint.failed()
+    raise
+  endpoint.succeeded(None if longPoll else client.handshakeMs + client.requestMs)
+  backendResponse.close()
+  backendResponse = None
+  return parser.entries
+
+async def raceEntries(candidates, query, timeout):
+  # the same long-poll to each candidate, the first successful answer wins
+  # and the others are cancelled
+  done = asyncio.Event()
+  results = []
+  async def fetch(endpoint):
+    try:
+      results.append((endpoint, await fetchEntriesFrom(endpoint, query, timeout, True)))
+    except Exception as e:
+      results.append((endpoint, e))
+    done.set()
+  tasks = [asyncio.create_task(fetch(endpoint)) for endpoint in candidates]
+  winner = None
+  while winner == None and len(results) < len(tasks):
+    await done.wait()
+    done.clear()
+    for endpoint, result in results:
+      if not isinstance(result, Exception):
+        winner = (endpoint, result)
+        break
+  for task in tasks:
+    task.cancel()
+  if winner == None:
+    raise results[0][1]
+  print("Long-poll answered first by " + winner[0].host)
+  return winner[1]
+
+async def backendMonitor():
+  global response, responseFresh, API_ENDPOINT, API_TOKEN, LOCALE, TIMEZONE, startTime, secondsDiff, backendResponse, mode
   lastid = -1
   last_entry_time = -1
+  last_entry_millis = 0
   retry_count = 0
   
   while True:
     try:
       # Check and reconnect WiFi if needed
       if not network.WLAN(network.STA_IF).isconnected():
-        print("WiFi connection lost. Attempting to reconnect...")
-        if not connectToWifi(printText = False):
+        if powerManager.radioOn:
+          print("WiFi connection lost. Attempting to reconnect...")
+        else:
+          print("Switching WiFi on...")
+        if not await connectToWifi(printText = False):
             print("Reconnection failed. Retrying in 10s...")
-            time.sleep(10)
+            await asyncio.sleep(10)
             continue
 
       printTime((utime.time() - startTime), prefix="Uptime is")
       s = utime.time()
 
-      # Calculate time relative to the last known SGV reading
-      now_datetime = getRtcDatetime()
-      now = utime.mktime((now_datetime[0], now_datetime[1], now_datetime[2], now_datetime[3], now_datetime[4], now_datetime[5], 0, 0)) + secondsDiff
-      diff = max(0, now - last_entry_time) if last_entry_time > 0 else 0
-      time_until_target = EXPECTED_INTERVAL_SEC - diff
-
-      # Target window: if near 5-minute expected arrival (~5s before) or reading is overdue
-      in_arrival_window = (lastid != -1 and (time_until_target <= LEAD_TIME_SEC or diff >= EXPECTED_INTERVAL_SEC))
+      # Target window: from the predicted poll time on, the reading may be overdue
+      now = localNow()
+      in_arrival_window = (lastid != -1 and now >= arrivalPredictor.pollTime(last_entry_time))
 
       if in_arrival_window:
-        current_timeout_sec = TARGET_TIMEOUT_SEC if retry_count == 0 else 15
-        backend_url = f"{API_ENDPOINT}/entries.json?count=10&waitfornextid={lastid}&timeout={current_timeout_sec * 1000}"
-        backendResponseTimeout = current_timeout_sec + 5
+        # Long-poll only for entries newer than the last one we have
+        current_timeout_sec = arrivalPredictor.timeout() if retry_count == 0 else 15
         print(f"Calling backend (arrival window, waitfornextid={lastid}, timeout={current_timeout_sec}s)...")
+        newEntries = await fetchEntries(f"count={MAX_FETCH_ENTRIES}&find[date][$gt]={last_entry_millis}&waitfornextid={lastid}&timeout={current_timeout_sec * 1000}", current_timeout_sec + 5, longPoll=True)
+        if len(newEntries) == 0:
+          # overdue: the empty answer carries no "ago", the probe refreshes it
+          print("Calling backend (dateStr refresh after empty long-poll)...")
+          newEntries = await fetchEntries("count=1", REQUEST_TIMEOUT_SEC)
+          if len(newEntries) > 0 and newEntries[0]["id"] == lastid:
+            copyAgo(newEntries[0])
+            newEntries = []
+      elif lastid == -1 or response == None:
+        print(f"Calling backend (full window, retry={retry_count})...")
+        newEntries = await fetchEntries(f"count={MAX_FETCH_ENTRIES}", REQUEST_TIMEOUT_SEC)
       else:
-        backend_url = f"{API_ENDPOINT}/entries.json?count=10"
-        backendResponseTimeout = REQUEST_TIMEOUT_SEC
+        # Cheap probe for the 1-minute dateStr ("ago") refresh
         print(f"Calling backend (1-min dateStr refresh, retry={retry_count})...")
-
-      backendResponse = requests2.get(
-        backend_url, 
-        headers={"api-secret": API_TOKEN, "accept-language": LOCALE, "accept-charset": "ascii", "x-gms-tz": TIMEZONE},
-        timeout=backendResponseTimeout
-      )
-      
-      print("Response status code:", backendResponse.status_code)
-      if backendResponse.status_code == 200:
-        retry_count = 0 # Reset retries on success
-        raw_response = backendResponse.json()
-        backendResponse.close()
-        gc.collect()
-        printTime((utime.time() - s), prefix="Received in")
+        newEntries = await fetchEntries("count=1", REQUEST_TIMEOUT_SEC)
+        if len(newEntries) > 0 and newEntries[0]["id"] == lastid:
+          copyAgo(newEntries[0])
+          newEntries = []
+        elif len(newEntries) > 0 and entrySeconds(newEntries[0]) - last_entry_time > EXPECTED_INTERVAL_SEC * 3 / 2:
+          # More than one reading arrived since the last poll, fetch the gap
+          print("Calling backend (entries since last reading)...")
+          newEntries = await fetchEntries(f"count={MAX_FETCH_ENTRIES}&find[date][$gt]={last_entry_millis}", REQUEST_TIMEOUT_SEC)
+
+      retry_count = 0 # Reset retries on success
+      printTime((utime.time() - s), prefix="Received in")
+
+      if len(newEntries) > 0:
+        response = mergeEntries(newEntries, response)
+        trackTrend()
+      responseFresh = True
+
+      if response != None and len(response) > 0:
+        new_id = response[0]["id"]
+        is_new_entry = (new_id != lastid)
+
+        last_entry_time = entrySeconds(response[0])
+        last_entry_millis = (last_entry_time - secondsDiff + EPOCH_OFFSET) * 1000
+
+        if is_new_entry:
+          if lastid != -1 and len(response) > 1 and response[1]["id"] == lastid:
+            # one new reading: learn its interval and when it showed up
+            seen = localNow()
+            arrivalPredictor.observe(last_entry_time, entrySeconds(response[1]), seen, in_arrival_window and seen - now >= 3)
+            print("Arrival: delay %d/%d/%ds (p10/p50/p90), interval %ds" % (arrivalPredictor.low, arrivalPredictor.median, arrivalPredictor.high, arrivalPredictor.interval))
+          lastid = new_id
+          sgv = response[0]["sgv"]
+          sgvDate = response[0]["date"]
+          print("Sgv:", sgv)
+          print("Direction:", response[0]["direction"])
+          print("Read: " + sgvDate + " (" + TIMEZONE + ")")
+          sgvDiff = 0
+          if len(response) > 1: sgvDiff = sgv - response[1]["sgv"]
+          print("Sgv diff from previous read:", sgvDiff)
+          persistEvent.set()
+
+        # without the 1-minute refresh the reading time is shown, not "ago"
+        requestScreen(noNetwork=powerManager.saving, clear=False)
+
+        # Compute next sleep duration based on the predicted arrival of the next SGV reading
+        now = localNow()
+        time_until_target = arrivalPredictor.nextArrival(last_entry_time) - now
+        time_until_poll = arrivalPredictor.pollTime(last_entry_time) - now
         
-        if raw_response and len(raw_response) > 0:
-          response = raw_response
-          new_id = response[0]["id"]
-          is_new_entry = (new_id != lastid)
-          
-          the_date = getDateTuple(response[0]["date"])
-          last_entry_time = utime.mktime(the_date)
-          
-          if is_new_entry:
-            lastid = new_id
-            sgv = response[0]["sgv"]
-            sgvDate = response[0]["date"]
-            print("Sgv:", sgv)
-            print("Direction:", response[0]["direction"])
-            print("Read: " + sgvDate + " (" + TIMEZONE + ")")
-            sgvDiff = 0
-            if len(response) > 1: sgvDiff = sgv - response[1]["sgv"]
-            print("Sgv diff from previous read:", sgvDiff)
-            _thread.start_new_thread(persistEntries, ())
-            
-          drawScreen(response[0], clear=False)
-          
-          # Compute next sleep duration based on time until next 5-minute SGV reading
-          now_datetime = getRtcDatetime()
-          now = utime.mktime((now_datetime[0], now_datetime[1], now_datetime[2], now_datetime[3], now_datetime[4], now_datetime[5], 0, 0)) + secondsDiff
-          diff = max(0, now - last_entry_time)
-          time_until_target = EXPECTED_INTERVAL_SEC - diff
-          
-          if is_new_entry:
-            sleep_time = POLL_INTERVAL_SEC
-          elif time_until_target <= 0:
-            # Overdue reading, short pause before re-checking
-            sleep_time = 10
-          elif time_until_target <= (POLL_INTERVAL_SEC + LEAD_TIME_SEC):
-            # Wake up right before the expected reading arrives
-            sleep_time = max(5, time_until_target - LEAD_TIME_SEC)
-          else:
-            # Normal 1-minute dateStr interval
-            elapsed = utime.time() - s
-            sleep_time = max(5, POLL_INTERVAL_SEC - elapsed)
-            
-          print(f"Next check in {sleep_time}s (next SGV in ~{time_until_target}s)...")
-          time.sleep(sleep_time)
+        overdue = arrivalPredictor.overdue(last_entry_time, now)
+        if time_until_poll <= 0 and not is_new_entry and not overdue:
+          # Still in the usual arrival range, long-poll again right away
+          sleep_time = 1
+        elif powerManager.saving:
+          # Power saving: no dateStr refresh, sleep up to the arrival window,
+          # an overdue reading is checked once a minute
+          sleep_time = max(5, time_until_poll) if time_until_poll > 0 else POLL_INTERVAL_SEC
+        elif is_new_entry:
+          sleep_time = POLL_INTERVAL_SEC
+        elif time_until_poll <= 0:
+          # Overdue reading, short pause before re-checking
+          sleep_time = 10
+        elif time_until_poll <= POLL_INTERVAL_SEC:
+          # Wake up right before the expected reading arrives
+          sleep_time = max(5, time_until_poll)
         else:
-          time.sleep(POLL_INTERVAL_SEC)
+          # Normal 1-minute dateStr interval
+          elapsed = utime.time() - s
+          sleep_time = max(5, POLL_INTERVAL_SEC - elapsed)
+          
+        print(f"Next check in {sleep_time}s (next SGV in ~{time_until_target}s)...")
+        if powerManager.saving and sleep_time >= power.RADIO_OFF_MIN_SEC:
+          endpointPool.close()
+          powerManager.radio(False)
+        await asyncio.sleep(sleep_time)
       else:
-        raise ValueError("Backend response error code " + str(backendResponse.status_code))   
+        await asyncio.sleep(POLL_INTERVAL_SEC)
         
     except Exception as e:
       if backendResponse != None: 
         try: backendResponse.close()
         except: pass
+      endpointPool.close() # state of the kept connections is unknown
       
       retry_count += 1
       sys.print_exception(e)
@@ -835,7 +1010,7 @@ def backendMonitor():
       if response == None: readResponseFile()
       try: 
         if response != None and len(response) >= 1: 
-          drawScreen(response[0], noNetwork=True, clear=False)
+          requestScreen(noNetwork=True, clear=False)
         else:
           printCenteredText("Network error! Please wait.", mode, backgroundColor=RED, clear=True)
       except Exception as e:
@@ -848,16 +1023,76 @@ def backendMonitor():
       
       if retry_count > 5: # Reset WiFi after ~5 consecutive failures
         print("Too many failures. Resetting WiFi...")
-        nic = network.WLAN(network.STA_IF)
-        nic.disconnect()
-        nic.active(False)
-        time.sleep(1)
-        nic.active(True)
+        wifiCache.forget() # the cached lease may be the problem, get a new one
+        powerManager.radio(False)
+        await asyncio.sleep(1)
+        powerManager.radio(True)
         retry_count = 0 
         
-      time.sleep(wait_time)
+      await asyncio.sleep(wait_time)
     print("---------------------------")
 
+def applyPushedUpdate(update):
+  global response, responseFresh
+  import push
+  sgvs = update.get("sgvs")
+  if not sgvs:
+    return
+  newEntries = push.entries(sgvs, MAX_FETCH_ENTRIES, secondsDiff)
+  if len(newEntries) == 0:
+    return
+  newest = response[0] if response != None and len(response) > 0 else None
+  if update.get("delta") and newest != None:
+    # backfilled readings older than the shown one are not shown
+    newEntries = [entry for entry in newEntries if entrySeconds(entry) > entrySeconds(newest)]
+    if len(newEntries) == 0:
+      return
+  response = mergeEntries(newEntries, response)
+  trackTrend()
+  responseFresh = True
+  if newest == None or response[0]["id"] != newest["id"]:
+    print("Pushed sgv:", response[0]["sgv"])
+    print("Direction:", response[0]["direction"])
+    print("Read: " + response[0]["date"] + " (" + TIMEZONE + ")")
+    persistEvent.set()
+  # no "ago" from the server, the reading time is shown
+  requestScreen(noNetwork=True, clear=False)
+
+async def pushRefresh():
+  # nothing polls while the socket holds: the age of the shown reading (grey,
+  # "---", the old data emergency) is re-evaluated without new data
+  while True:
+    await scheduler.sleepAligned(POLL_INTERVAL_SEC * 1000)
+    requestScreen(noNetwork=True, clear=False)
+
+async def pushMonitor():
+  # Push transport: readings come over the socket while it holds. The HTTP
+  # poller runs until it is up, and for PUSH_RETRY_SEC after it dropped.
+  import push # only loaded with this transport
+  poller = scheduler.start("poller", backendMonitor())
+  while True:
+    client = push.PushClient(API_ENDPOINT, API_TOKEN)
+    refresher = None
+    try:
+      if not network.WLAN(network.STA_IF).isconnected():
+        raise OSError("WiFi not connected")
+      print("Connecting push socket...")
+      await client.connect(REQUEST_TIMEOUT_SEC)
+      print("Push socket connected, polling stopped")
+      poller.cancel()
+      refresher = scheduler.start("refresh", pushRefresh())
+      while True:
+        applyPushedUpdate(await client.receive())
+    except Exception as e:
+      sys.print_exception(e)
+    if refresher != None:
+      refresher.cancel()
+    client.close()
+    print(f"Push socket down, polling. Next try in {PUSH_RETRY_SEC}s...")
+    if poller.done():
+      poller = scheduler.start("poller", backendMonitor())
+    await asyncio.sleep(PUSH_RETRY_SEC)
+
 def setEmergencyrgbUnitColor(setBeepColorIndex, beepColor):
   global rgbUnit
   setBlackColorIndex = setBeepColorIndex-1
@@ -867,7 +1102,7 @@ def setEmergencyrgbUnitColor(setBeepColorIndex, beepColor):
     rgbUnit.set_color(setBlackColorIndex, M5.Display.COLOR.BLACK)
     rgbUnit.set_color(setBeepColorIndex, beepColor)
         
-def emergencyMonitor():
+async def emergencyMonitor():
   global emergency, response, rgbUnit, beeperExecuted, EMERGENCY_MAX, EMERGENCY_MIN, OLD_DATA_EMERGENCY
   useBeeper = False
   set_colorIndex = 1
@@ -878,15 +1113,18 @@ def emergencyMonitor():
       batteryLevel = getBatteryLevel()
       sgv = response[0]['sgv']
       if batteryLevel < 10:
-        print('Low battery level ' + str(batteryLevel) + "%!!!")
+        left = batterySampler.timeToEmpty()
+        print('Low battery level ' + str(batteryLevel) + "%!!!" + ("" if left == None else " About " + str(left) + " min left."))
       elif sgv > EMERGENCY_MAX or sgv <= EMERGENCY_MIN:
         print('Emergency glucose level ' + str(sgv) + '!!!')
+      elif prediction != None:
+        print('Emergency glucose level ' + str(prediction) + ' predicted in ' + str(forecast.ALERT_MIN) + ' minutes!!!')
       else:
         print('SGV data is older than ' + str(OLD_DATA_EMERGENCY) + ' minutes!!!')  
       
       if rgbUnit != None:
         beepColor = RED
-        if sgv > EMERGENCY_MAX: beepColor = ORANGE  
+        if sgv > EMERGENCY_MAX or (prediction != None and prediction > EMERGENCY_MAX): beepColor = ORANGE  
         setEmergencyrgbUnitColor(set_colorIndex, beepColor)
         set_colorIndex += 1
         if set_colorIndex > 2: set_colorIndex = 0 
@@ -897,13 +1135,13 @@ def emergencyMonitor():
         M5.Speaker.setVolume(128)
         M5.Speaker.tone(1000, 500)
         M5.Power.setLed(255)
-        time.sleep(1)
+        await asyncio.sleep(1)
         M5.Power.setLed(0)
         beeperExecuted = True   
         useBeeper = False 
       else:
         M5.Power.setLed(255)
-        time.sleep(1)
+        await asyncio.sleep(1)
         M5.Power.setLed(0)
       print("beeperExecuted=" + str(beeperExecuted) + ", useBeeper=" + str(useBeeper))              
     else:
@@ -911,22 +1149,21 @@ def emergencyMonitor():
       beeperExecuted = False
       useBeeper = False
       set_colorIndex = 0
-      time.sleep(1)
+      # on the second, with the clock and input ticks
+      await scheduler.sleepAligned(1000)
 
-def accelCallback(t):
+def readAccel():
   global mode, response, config
   acceleration = M5.Imu.getAccel()
   #print("Current acceleration: " + str(acceleration))
-  if acceleration[0] > 1.0 and mode == 0: 
-    mode = 4 #flip
-    if response != None: drawScreen(response[0])
-    config["screen-mode"] = mode
-    ap.saveConfigFile(config) 
-  elif acceleration[0] < -1.0 and mode == 4: 
-    mode = 0 #normal 
-    if response != None: drawScreen(response[0])
-    config["screen-mode"] = mode  
-    ap.saveConfigFile(config) 
+  if acceleration[0] > 1.0 and not isFlipped(mode): 
+    mode = flipMode(mode, True) #flip
+    requestScreen(clear=False) # the compositor pushes its frame rotated
+    ap.setConfigValue(config, "screen-mode", mode)
+  elif acceleration[0] < -1.0 and isFlipped(mode): 
+    mode = flipMode(mode, False) #normal 
+    requestScreen(clear=False)
+    ap.setConfigValue(config, "screen-mode", mode)
 
 # --- State Variables ---
 was_pressed = False
@@ -935,7 +1172,7 @@ start_y = 0
 last_x = 0
 last_y = 0
 
-def touchPadCallback(t):
+def readTouchPad():
     global was_pressed, start_x, start_y, last_x, last_y, SHOW_SECONDS
     
     M5.update()
@@ -954,6 +1191,7 @@ def touchPadCallback(t):
             start_x = curr_x
             start_y = curr_y
             print("Touch Start:", start_x, start_y)
+            wakeDisplay()
             
         # Continuously update the "last known" position while dragging
         last_x = curr_x
@@ -976,30 +1214,115 @@ def touchPadCallback(t):
                 print(">>> SWIPE RIGHT >>>")
             else:
                 print("<<< SWIPE LEFT <<<")
-            onTouchSwipe(t)    
+            onTouchSwipe()    
         elif abs(dy) > abs(dx) and abs(dy) > MIN_SWIPE_DIST:
             if dy > 0:
                 print("vvv SWIPE DOWN vvv")
             else:
                 print("^^^ SWIPE UP ^^^")
-            onTouchSwipe(t)    
+            onTouchSwipe()    
         else:
             if (last_x < 30 and last_y < 30) or (last_x > SCREEN_WIDTH-30 and last_y > SCREEN_HEIGHT-30):
                SHOW_SECONDS = not SHOW_SECONDS
                print("--- TAP (Show Seconds " + str(SHOW_SECONDS) + ") ---")
-            #elif (last_x > SCREEN_WIDTH-30 and last_y < 30) or (last_x < 30 and last_y > SCREEN_HEIGHT-30):
-            #   print("--- TAP (Power Off) ---")
-            #   M5.Power.powerOff()
+            elif (last_x > SCREEN_WIDTH-30 and last_y < 30) or (last_x < 30 and last_y > SCREEN_HEIGHT-30):
+               print("--- TAP (Toggle Chart) ---")
+               onToggleChart()
             else:
                print("--- TAP (No Swipe) ---")
                onTouchTap(saveConfig=True)
 
 
-def localtimeCallback(t):
+def readInput():
+  # touch and IMU share one tick, slower on battery between touches
+  readTouchPad()
+  readAccel()
+  inputTicker.periodMs = INPUT_SAVING_MS if powerManager.saving and not was_pressed else INPUT_MS
+
+def clockTick():
   global shuttingDown, mode, secondsDiff, firstRun 
   if not shuttingDown:
-    printLocaltime(mode, secondsDiff, silent=True, firstRun=firstRun)
-    printBatteryLevel(useLock=False, silent=True)
+    printLocaltime(mode, secondsDiff, firstRun=firstRun)
+    updateBrightness()
+
+async def clockMonitor():
+  # every second, or on battery without seconds shown on the next minute
+  while True:
+    if powerManager.saving and not SHOW_SECONDS:
+      await asyncio.sleep_ms((60 - localNow() % 60) * 1000 - utime.ticks_ms() % 1000)
+    else:
+      await scheduler.sleepAligned(1000)
+    clockTick()
+
+def batteryTick():
+  batterySampler.sample()
+  updatePowerMode()
+  powerManager.report()
+  if not shuttingDown:
+    printBatteryLevel()
+
+def trendColor(trend, threshold, rising, falling):
+  if not ENV_TREND or abs(trend) < threshold:
+    return DARKGREY
+  return rising if trend > 0 else falling
+
+def envValues():
+  # (text, color) of temperature, pressure and humidity from the sampler
+  s = envSampler
+  if s == None or s.temperature == None:
+    return ("--", DARKGREY), ("---", DARKGREY), ("--", DARKGREY)
+  return (("%.0f" % s.temperature, trendColor(s.temperatureTrend, TEMPERATURE_TREND_C, ORANGE, DARKGREEN)),
+    ("%.0f" % s.pressure, trendColor(s.pressureTrend, PRESSURE_TREND_HPA, DARKGREEN, ORANGE)),
+    ("%.0f" % s.humidity, DARKGREY))
+
+def envTick():
+  # samples the ENV unit and repaints the values that changed
+  if envSampler == None:
+    return
+  envSampler.sample()
+  if shuttingDown or firstRun:
+    return
+  for name, value in zip(("tempStr", "pressureStr", "humidityStr"), envValues()):
+    w = screen.get(name)
+    if w != None:
+      w.set(value)
+      if w.dirty:
+        requestFlush(name, scheduler.RENDER_ENV)
+
+def updatePowerMode():
+  saving = POWER_SAVE and getBatteryLevel() != battery.NO_BATTERY and not batterySampler.charging and not emergency
+  if saving != powerManager.saving:
+    print("Power saving " + ("on" if saving else "off"))
+    powerManager.saving = saving
+    updateBrightness()
+
+def updateBrightness():
+  # on battery the display dims when untouched for a while and at night
+  global dimmed
+  hour = localNow() % 86400 // 3600
+  night = hour >= NIGHT_START_HOUR or hour < NIGHT_END_HOUR
+  dim = powerManager.saving and (night or utime.time() - lastTouch > DIM_AFTER_SEC)
+  if dim != dimmed:
+    dimmed = dim
+    M5.Widgets.setBrightness(min(brightness, DIM_BRIGHTNESS) if dim else brightness)
+
+def wakeDisplay():
+  global lastTouch, dimmed
+  lastTouch = utime.time()
+  if dimmed:
+    dimmed = False
+    M5.Widgets.setBrightness(brightness)
+
+async def persistMonitor():
+  # new readings go to the journal after the screen shows them
+  while True:
+    await persistEvent.wait()
+    persistEvent.clear()
+    try:
+      persistEntries()
+    except Exception as e:
+      sys.print_exception(e)
+      saveError(e)
 
 def onTouchTap(saveConfig=False):
   global emergency, emergencyPause
@@ -1011,15 +1334,25 @@ def onTouchTap(saveConfig=False):
     brightness += 4
     if brightness > 255: brightness = 1
     M5.Widgets.setBrightness(brightness)
-    config["brightness"] = brightness
     print("Setting brightness " + str(brightness))
     if saveConfig:
-      ap.saveConfigFile(config)
-
-def onTouchSwipe(t):
+      ap.setConfigValue(config, "brightness", brightness)
+    else:
+      config["brightness"] = brightness
+
+def onToggleChart():
+  global mode, config
+  flipped = isFlipped(mode)
+  mode = MODES.index("chart") if not isChart(mode) else 0
+  mode = flipMode(mode, flipped)
+  print("Switching to " + MODES[mode] + " mode")
+  requestScreen()
+  ap.setConfigValue(config, "screen-mode", mode)
+
+def onTouchSwipe():
   global shuttingDown, mode, config
-  config[ap.CONFIG] = 1 if config[ap.CONFIG] == 0 else 0
-  ap.saveConfigFile(config)
+  ap.setConfigValue(config, ap.CONFIG, 1 if config[ap.CONFIG] == 0 else 0)
+  ap.flushConfig()
   WDT(timeout=1000)
   shuttingDown = True
   printCenteredText("Restarting...", mode, backgroundColor=RED, clear=True)  
@@ -1027,19 +1360,35 @@ def onTouchSwipe(t):
 # main app code -------------------------------------------------------------------     
 
 config = ap.readConfigFile()
+# registered as soon as the journal is open, before anything appends to it
+journal.get().compactors.append(compactReadings)
 
 M5.begin()
 
+batterySampler = battery.BatterySampler(M5.Power, BATTERY_SAMPLE_MS)
+batterySampler.sample()
+
 response = None
 
 mode = 0 
 if config != None and "screen-mode" in config:
    mode = config["screen-mode"]
 acceleration = M5.Imu.getAccel()
-if acceleration[0] > 1.0: mode = 4 #flip
-elif acceleration[0] < -1.0: mode = 0 #normal
+if mode < 0 or mode >= len(MODES): mode = 0
+if acceleration[0] > 1.0: mode = flipMode(mode, True) #flip
+elif acceleration[0] < -1.0: mode = flipMode(mode, False) #normal
 
 firstRun = True
+firstReadingMs = None # boot to first reading on screen
+freshReadingMs = None # boot to first reading from the server on screen
+responseFresh = False # response came from the server, not the journal
+startTime = utime.time()
+if DOUBLE_BUFFER:
+  try:
+    frame = M5.Display.newCanvas(SCREEN_WIDTH, SCREEN_HEIGHT, 16, True)
+  except Exception as e:
+    print("No off-screen frame, drawing on the panel:", e)
+buildScreen()
 
 brightness = 1
 if config != None and not RESET_BRIGHTNESS_AT_STARTUP: brightness = config["brightness"]
@@ -1048,55 +1397,43 @@ M5.Widgets.setBrightness(brightness)
 printCenteredText("Starting...", mode, backgroundColor=DARKGREY, clear=True)  
 
 envUnit = None
-
-try: 
-   i2c0 = I2C(0, scl=Pin(54), sda=Pin(53), freq=40000)
-   envUnit = ENVUnit(i2c=i2c0, type=3) 
-   tempStr = "%.0f" % envUnit.read_temperature()
-   pressureStr = "%.0f" % envUnit.read_pressure()
-   humidityStr = "%.0f" % envUnit.read_humidity()
-   print('Temperature:', tempStr)
-   print('Humidity:', pressureStr)
-   print('Pressure:', humidityStr) 
-except Exception as e:
-   print('Weather Monitoring Unit not found')
-   sys.print_exception(e)
-
+envSampler = None
 rgbUnit = None
-try: 
-   rgbUnit = RGBUnit((36, 26), 3)
-   rgbUnit.set_color(0, M5.Display.COLOR.BLACK)     
-   rgbUnit.set_color(1, M5.Display.COLOR.DARKGREY)
-   rgbUnit.set_color(2, M5.Display.COLOR.BLACK)
-except Exception as e:
-   print('RGB Unit not found')
-   sys.print_exception(e)
 
 print('Starting ...')
 print('System:', sys.implementation)
 
 emergency = False
 emergencyPause = 0
+nowCache = (-1, 0) # (RTC seconds, local seconds) of the last localNow()
+powerManager = power.PowerManager()
+arrivalPredictor = arrival.ArrivalPredictor(EXPECTED_INTERVAL_SEC, LEAD_TIME_SEC, TARGET_TIMEOUT_SEC)
+lastTouch = 0
+dimmed = False
 shuttingDown = False
 backendResponse = None
+endpointPool = None
+wifiCache = wifi.WifiCache()
+errorLog = journal.ErrorRing(ERROR_FILE)
 beeperExecuted = False
-
-touchPadTimer = machine.Timer(0)
-touchPadTimer.init(period=100, callback=touchPadCallback)
-
-accelTimer = machine.Timer(3)
-accelTimer.init(period=100, callback=accelCallback)
-
-if config == None or config[ap.CONFIG] == 0:
+renderQueue = scheduler.RenderQueue()
+pendingClear = False
+arrowAnimating = False
+forecaster = forecast.Forecaster()
+prediction = None # predicted sgv behind the emergency, None when it is not a predicted one
+persistEvent = asyncio.Event()
+apMode = config == None or config[ap.CONFIG] == 0
+
+if apMode:
    printCenteredText("Connect AP ...", mode, backgroundColor=RED, clear=True)
    print("Connect wifi " + ap.SSID)
    def reboot():
       global shuttingDown 
       print('Restarting after configuration change...')
+      ap.flushConfig()
       WDT(timeout=1000)   
       shuttingDown = True
       printCenteredText("Restarting...", mode, backgroundColor=RED, clear=True)   
-   ap.open_access_point(reboot)  
 else:
    try: 
      API_ENDPOINT = config["api-endpoint"]
@@ -1112,16 +1449,21 @@ else:
      BEEPER_END_TIME = config["beeperEndTime"]
      OLD_DATA = config["oldData"]
      OLD_DATA_EMERGENCY = config["oldDataEmergenc"]
+     TRANSPORT = config.get("transport", TRANSPORT_POLL)
 
      if MIN < 30: MIN=30
      if MAX < 100: MAX=100
      if EMERGENCY_MIN < 30 or MIN <= EMERGENCY_MIN: EMERGENCY_MIN=MIN-10
      if EMERGENCY_MAX < 100 or MAX >= EMERGENCY_MAX: EMERGENCY_MAX=MAX+10  
+     forecaster.configure(EMERGENCY_MIN, EMERGENCY_MAX)
      if len(API_ENDPOINT) == 0: raise Exception("Empty api-endpoint parameter")
+     mirrors = [(m["api-endpoint"], m.get("api-token", "")) for m in config.get("mirrors", []) if m.get("api-endpoint")]
+     endpointPool = endpoints.EndpointPool([(API_ENDPOINT, API_TOKEN)] + mirrors)
      if USE_BEEPER != 1 and USE_BEEPER != 0: USE_BEEPER=1
-     if TIMEZONE_RE.search(TIMEZONE) == None: TIMEZONE="GMT+0:00"
+     if not validTimezone(TIMEZONE): TIMEZONE="GMT+0:00"
      if OLD_DATA < 10: OLD_DATA=10
      if OLD_DATA_EMERGENCY < 15: OLD_DATA_EMERGENCY=15
+     if TRANSPORT != TRANSPORT_PUSH: TRANSPORT=TRANSPORT_POLL
 
      timeStr = TIMEZONE[4:]
      [HH, MM] = [int(i) for i in timeStr.split(':')]
@@ -1139,46 +1481,120 @@ else:
      shuttingDown = True
      printCenteredText("Restarting...", mode, backgroundColor=RED, clear=True)
 
-# from here code runs only if application is properly configured
+async def probeUnits():
+  # ENV and RGB units, probed while WiFi connects
+  global envUnit, envSampler, rgbUnit
+  from unit import ENVUnit, RGBUnit
+  try: 
+    i2c0 = I2C(0, scl=Pin(54), sda=Pin(53), freq=40000)
+    envUnit = ENVUnit(i2c=i2c0, type=3) 
+    sampler = environment.EnvSampler(envUnit, ENV_SAMPLE_MS)
+    if not sampler.sample():
+      raise OSError("no ENV reading")
+    envSampler = sampler
+    print('Temperature:', sampler.temperature)
+    print('Humidity:', sampler.humidity)
+    print('Pressure:', sampler.pressure) 
+  except Exception as e:
+    envUnit = None
+    print('Weather Monitoring Unit not found')
+    sys.print_exception(e)
 
-try:
-  if not connectToWifi():
-    printCenteredText("Wifi not connected! Restarting...", mode, backgroundColor=RED, clear=True)
-    time.sleep(10)
-    machine.reset()
+  await asyncio.sleep_ms(0)
+  try: 
+    rgbUnit = RGBUnit((36, 26), 3)
+    rgbUnit.set_color(0, M5.Display.COLOR.BLACK)     
+    rgbUnit.set_color(1, M5.Display.COLOR.DARKGREY)
+    rgbUnit.set_color(2, M5.Display.COLOR.BLACK)
+  except Exception as e:
+    rgbUnit = None
+    print('RGB Unit not found')
+    sys.print_exception(e)
 
-  time_server = 'pool.ntp.org'
-  printCenteredText("Setting time...", mode, backgroundColor=DARKGREY) 
-  print('Connecting time server ' + time_server)
-  now_datetime = None
-  while now_datetime is None:
+  if envUnit != None and response != None:
+    requestScreen(noNetwork=not responseFresh, clear=False)
+
+async def syncTime():
+  # NTP, trying the pool hosts in turn until one answers
+  global startTime
+  import ntptime
+  if rtcSet():
+    # kept over a reset, only corrected: settime() blocks, the first poll goes first
+    await asyncio.sleep(NTP_DEFER_SEC)
+  i = 0
+  pause = NTP_RETRY_SEC
+  while True:
+    ntptime.host = NTP_HOSTS[i % len(NTP_HOSTS)]
+    print('Connecting time server ' + ntptime.host)
     try:
-      print(".", end="")
-      #TODO use 0.pool.ntp.org, 1.pool.ntp.org, 2.pool.ntp.org, 3.pool.ntp.org
-      ntptime.host = "pool.ntp.org" 
       ntptime.settime()
       now_datetime = getRtcDatetime()
-      startTime = utime.time()
+      break
     except Exception as e:
       sys.print_exception(e)
-      #saveError(e)
-      time.sleep(2)
-  print("\nCurrent UTC datetime " +  str(now_datetime))
-
-  printCenteredText("Loading data...", mode, backgroundColor=DARKGREY) 
-
-  sgvDict = readSgvFile()
-  dictLen = len(sgvDict)
-  print("Loaded " + str(dictLen) + " sgv entries")
+      i += 1
+      if i % len(NTP_HOSTS) == 0 and rtcSet():
+        # a round over all hosts failed, the clock runs on meanwhile
+        pause = min(2 * pause, NTP_MAX_RETRY_SEC)
+      await asyncio.sleep(pause)
+  # uptime is counted from boot, the clock may just have jumped
+  startTime = utime.time() - utime.ticks_ms() // 1000
+  print("Current UTC datetime " +  str(now_datetime))
+
+async def main():
+  global startTime, lastTouch, inputTicker
+  # every task runs on this one loop: input and rendering first, they also
+  # serve the access point screen
+  scheduler.start("render", renderQueue.run())
+  inputTicker = scheduler.every("input", INPUT_MS, readInput, powerManager.lightSleep)
+
+  if apMode:
+    await ap.open_access_point(reboot)
+    return
+
+  # from here code runs only if application is properly configured
 
-  localtimeTimer = machine.Timer(2)
-  localtimeTimer.init(period=1000, callback=localtimeCallback)
-
-  #main method and threads
+  try:
+    # staged start: the last reading is shown at once (stale, the RTC may
+    # not be set), the units are probed and the history is loaded while
+    # WiFi connects, NTP runs in the background unless the RTC is unset
+    readResponseFile()
+    if response != None:
+      trackTrend()
+      requestScreen(noNetwork=True)
+    wifiTask = scheduler.start("wifi", connectToWifi(printText = response == None))
+    scheduler.start("units", probeUnits())
+    await asyncio.sleep_ms(0) # paint, start connecting, probe
+
+    loadHistory()
+    print("Loaded " + str(len(sgvHistory)) + " sgv entries")
+
+    if not await wifiTask:
+      printCenteredText("Wifi not connected! Restarting...", mode, backgroundColor=RED, clear=True)
+      await asyncio.sleep(10)
+      machine.reset()
+
+    timeTask = scheduler.start("ntp", syncTime())
+    if not rtcSet():
+      if response == None:
+        printCenteredText("Setting time...", mode, backgroundColor=DARKGREY) 
+      await timeTask
+
+    # periodic tasks share wakeups: their periods are multiples of each other
+    lastTouch = utime.time()
+    scheduler.start("clock", clockMonitor())
+    scheduler.every("battery", BATTERY_SAMPLE_MS, batteryTick)
+    scheduler.every("env", ENV_SAMPLE_MS, envTick)
+    scheduler.every("config", 1000, lambda: ap.flushConfig(CONFIG_SAVE_DELAY_MS))
+    scheduler.start("persist", persistMonitor())
+    scheduler.start("emergency", emergencyMonitor())
+    if TRANSPORT == TRANSPORT_PUSH:
+      await scheduler.start("backend", pushMonitor())
+    else:
+      await scheduler.start("backend", backendMonitor())
+  except Exception as e:
+    sys.print_exception(e)
+    #saveError(e)
+    printCenteredText("Fix config!", mode, backgroundColor=RED, clear=True)
 
-  _thread.start_new_thread(emergencyMonitor, ())
-  _thread.start_new_thread(backendMonitor, ())
-except Exception as e:
-  sys.print_exception(e)
-  #saveError(e)
-  printCenteredText("Fix config!", mode, backgroundColor=RED, clear=True)
\ No newline at end of file
+asyncio.run(main())
@@ -0,0 +1,71 @@
+# Power saving on battery. Between two readings the poller switches the
+# WiFi radio off, and while it is off the input tick light-sleeps the CPU up
+# to its next run instead of idling in the event loop. Radio on time, light
+# sleep time and wakeups (every input tick, light sleeping or not) are
+# counted and reported every hour so the gain can be measured.
+import machine
+import network
+import utime
+
+RADIO_OFF_MIN_SEC = 30 # shorter waits keep the radio on, reconnecting costs more
+MIN_LIGHT_SLEEP_MS = 20 # below this entering light sleep costs more than it saves
+REPORT_INTERVAL_MS = 3600000
+
+class PowerManager:
+  """
+  `saving` is set by the app (on battery, no emergency). lightSleep(ms) is
+  the scheduler hook, called before every input tick, it only sleeps
+  while saving with the radio off.
+  """
+  def __init__(self):
+    self.saving = False
+    self.radioOn = False
+    self.radioSince = 0
+    self.radioMs = 0
+    self.sleptMs = 0
+    self.wakeups = 0
+    self.lightSleeps = 0
+    self.reportTicks = utime.ticks_ms()
+
+  def radio(self, on):
+    nic = network.WLAN(network.STA_IF)
+    now = utime.ticks_ms()
+    if on:
+      nic.active(True)
+      if not self.radioOn:
+        self.radioOn = True
+        self.radioSince = now
+    elif self.radioOn:
+      nic.disconnect()
+      nic.active(False)
+      self.radioOn = False
+      self.radioMs += utime.ticks_diff(now, self.radioSince)
+      print("WiFi radio off")
+
+  def lightSleep(self, ms):
+    # returns False when the caller has to wait in the event loop instead
+    self.wakeups += 1
+    if not self.saving or self.radioOn or ms < MIN_LIGHT_SLEEP_MS:
+      return False
+    machine.lightsleep(ms)
+    self.sleptMs += ms
+    self.lightSleeps += 1
+    return True
+
+  def report(self):
+    # prints and resets the counters once per REPORT_INTERVAL_MS
+    now = utime.ticks_ms()
+    elapsed = utime.ticks_diff(now, self.reportTicks)
+    if elapsed < REPORT_INTERVAL_MS:
+      return
+    radioMs = self.radioMs
+    if self.radioOn:
+      radioMs += utime.ticks_diff(now, self.radioSince)
+      self.radioSince = now
+    hours = elapsed / 3600000
+    print("Power: radio on %d s/h, light sleep %d s/h, %d wakeups/h (%d from light sleep)" % (radioMs / 1000 / hours, self.sleptMs / 1000 / hours, self.wakeups / hours, self.lightSleeps / hours))
+    self.reportTicks = now
+    self.radioMs = 0
+    self.sleptMs = 0
+    self.wakeups = 0
+    self.lightSleeps = 0
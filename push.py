@@ -0,0 +1,188 @@
+# Server push from Nightscout: one WebSocket held open to its Socket.IO
+# interface (Engine.IO 4), over which the server sends a `dataUpdate`
+# event whenever something changes, new readings in its `sgvs`. Readings
+# show up as soon as the server has them, without a request per minute.
+# The connection is dead when the server's pings stop; the caller falls
+# back to polling then.
+import uasyncio as asyncio
+import ubinascii
+import uhashlib
+import ujson
+import uos
+import utime
+from httpclient import splitUrl
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_FRAME = 65536 # bigger messages (a long first history) are skipped
+HISTORY_HOURS = 1 # readings sent with the first dataUpdate
+EPOCH_OFFSET = 946684800 if utime.gmtime(0)[0] == 2000 else 0
+
+# WebSocket opcodes
+OP_TEXT = 1
+OP_CLOSE = 8
+OP_PING = 9
+OP_PONG = 10
+
+class PushClient:
+  """
+  connect(timeout) opens the WebSocket and authorizes with `secret`,
+  receive() returns the payload (dict) of the next dataUpdate event and
+  raises OSError or asyncio.TimeoutError when the connection is gone.
+  """
+  def __init__(self, apiEndpoint, secret):
+    https, host, port, path = splitUrl(apiEndpoint)
+    self.https = https
+    self.host = host
+    self.port = port
+    self.secret = secret
+    self.reader = None
+    self.writer = None
+    self.deadMs = 45000 # pingInterval + pingTimeout of the server
+    self.updates = 0
+
+  def close(self):
+    if self.writer != None:
+      try: self.writer.close()
+      except: pass
+    self.reader = None
+    self.writer = None
+
+  async def connect(self, timeout):
+    try:
+      await asyncio.wait_for(self.open(), timeout)
+    except:
+      self.close()
+      raise
+
+  async def open(self):
+    if self.https:
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=True, server_hostname=self.host)
+    else:
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    key = ubinascii.b2a_base64(uos.urandom(16)).strip()
+    self.writer.write(b"GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\nHost: " + self.host.encode()
+      + b"\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: " + key
+      + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    await self.writer.drain()
+    status = (await self.reader.readline()).split()
+    if len(status) < 2 or status[1] != b"101":
+      raise OSError("websocket upgrade refused: " + str(status))
+    accept = None
+    while True:
+      line = await self.reader.readline()
+      if not line or line == b"\r\n":
+        break
+      k, _, v = line.partition(b":")
+      if k.strip().lower() == b"sec-websocket-accept":
+        accept = v.strip()
+    if accept != ubinascii.b2a_base64(uhashlib.sha1(key + WS_GUID).digest()).strip():
+      raise OSError("bad websocket accept key")
+    # Engine.IO open, Socket.IO connect, then Nightscout's authorize
+    packet = await self.readPacket()
+    if packet[:1] != "0":
+      raise OSError("no engine.io open packet")
+    params = ujson.loads(packet[1:])
+    self.deadMs = params.get("pingInterval", 25000) + params.get("pingTimeout", 20000)
+    await self.send("40")
+    if (await self.readPacket())[:2] != "40":
+      raise OSError("socket.io connect refused")
+    await self.send("420" + ujson.dumps(["authorize", {"client": "web", "secret": self.secret, "history": HISTORY_HOURS}]))
+    while True:
+      packet = await self.readPacket()
+      if packet[:3] == "430":
+        break
+    ack = ujson.loads(packet[3:])
+    if len(ack) == 0 or not ack[0].get("read"):
+      raise OSError("not authorized to read")
+
+  async def receive(self):
+    while True:
+      # the server pings every pingInterval, a missed ping means the link is dead
+      packet = await asyncio.wait_for(self.readPacket(), self.deadMs / 1000)
+      if packet == "2":
+        await self.send("3")
+      elif packet[:2] == "42":
+        event = ujson.loads(packet[2:])
+        if event[0] == "dataUpdate" and len(event) > 1:
+          self.updates += 1
+          return event[1]
+      elif packet[:1] == "1" or packet[:2] == "41":
+        raise OSError("closed by the server")
+
+  async def readPacket(self):
+    # next text message, control frames are handled here
+    parts = []
+    size = 0
+    while True:
+      head = await self.reader.readexactly(2)
+      fin = head[0] & 0x80
+      op = head[0] & 0x0F
+      n = head[1] & 0x7F
+      if n == 126:
+        n = int.from_bytes(await self.reader.readexactly(2), "big")
+      elif n == 127:
+        n = int.from_bytes(await self.reader.readexactly(8), "big")
+      if head[1] & 0x80:
+        raise OSError("masked frame from the server")
+      if op == OP_CLOSE:
+        raise OSError("websocket closed")
+      if op == OP_PING or op == OP_PONG:
+        data = await self.reader.readexactly(n)
+        if op == OP_PING:
+          await self.sendFrame(OP_PONG, data)
+        continue
+      size += n
+      if size > MAX_FRAME:
+        await self.skip(n)
+        parts = None
+      else:
+        data = await self.reader.readexactly(n)
+        if parts != None:
+          parts.append(data)
+      if fin:
+        if parts == None:
+          print("Skipped a %d bytes push message" % size)
+          parts = []
+          size = 0
+          continue
+        return b"".join(parts).decode()
+
+  async def skip(self, n):
+    while n > 0:
+      r = len(await self.reader.readexactly(min(n, 1024)))
+      n -= r
+
+  async def send(self, text):
+    await self.sendFrame(OP_TEXT, text.encode())
+
+  async def sendFrame(self, op, data):
+    # client frames are masked
+    n = len(data)
+    if n < 126:
+      head = bytes((0x80 | op, 0x80 | n))
+    elif n < 65536:
+      head = bytes((0x80 | op, 0x80 | 126)) + n.to_bytes(2, "big")
+    else:
+      head = bytes((0x80 | op, 0x80 | 127)) + n.to_bytes(8, "big")
+    mask = uos.urandom(4)
+    masked = bytearray(data)
+    for i in range(n):
+      masked[i] ^= mask[i & 3]
+    self.writer.write(head + mask + masked)
+    await self.writer.drain()
+
+def entries(sgvs, count, secondsDiff):
+  # newest `count` readings of a dataUpdate as backend entries (without
+  # "ago", the date is shown), newest first
+  sgvs = sorted(sgvs, key=lambda s: s.get("mills", 0), reverse=True)
+  result = []
+  for s in sgvs:
+    if len(result) >= count:
+      break
+    if s.get("type", "sgv") != "sgv" or "mgdl" not in s or "mills" not in s:
+      continue
+    seconds = s["mills"] // 1000 + secondsDiff
+    t = utime.gmtime(seconds - EPOCH_OFFSET)
+    result.append({"id": s.get("_id", str(s["mills"])), "sgv": s["mgdl"], "direction": s.get("direction", "NONE"),
+      "date": "%04d-%02d-%02dT%02d:%02d:%02d" % t[:6], "seconds": seconds - EPOCH_OFFSET})
+  return result
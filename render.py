@@ -0,0 +1,322 @@
+# Retained-mode widget layer for the glucose screen.
+#
+# Each widget owns a fixed layout box and remembers the rectangles it painted
+# last time. A Compositor repaints only widgets whose value changed: it clears
+# the part of the old painted area the new content will not cover (merged
+# across widgets), then redraws the dirty widgets plus any widget touched by
+# a clear or lying above a redrawn one. Widgets must paint their rects opaquely (text is drawn with a
+# background colour), which is what makes the difference-clear correct.
+#
+# With an off-screen frame (a canvas the size of the screen) widgets are
+# drawn into the frame and only the result reaches the panel: a full repaint
+# in one push, no black flash and no progressive drawing, an update as
+# pushes clipped to the repainted rects. The frame always holds the whole
+# screen, so a rotation change only pushes it again.
+
+BLACK = 0
+
+LEFT = 0
+CENTER = 1
+RIGHT = 2
+
+def intersects(a, b):
+  return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def subtract(a, b):
+  # a minus b as up to 4 non-overlapping rects
+  if not intersects(a, b):
+    return [a]
+  ax, ay, aw, ah = a
+  bx, by, bw, bh = b
+  res = []
+  top = by - ay
+  if top > 0:
+    res.append((ax, ay, aw, top))
+  bottom = (ay + ah) - (by + bh)
+  if bottom > 0:
+    res.append((ax, by + bh, aw, bottom))
+  y0 = max(ay, by)
+  h = min(ay + ah, by + bh) - y0
+  left = bx - ax
+  if left > 0:
+    res.append((ax, y0, left, h))
+  right = (ax + aw) - (bx + bw)
+  if right > 0:
+    res.append((bx + bw, y0, right, h))
+  return res
+
+def subtractAll(rects, covers):
+  for c in covers:
+    out = []
+    for r in rects:
+      out.extend(subtract(r, c))
+    rects = out
+  return rects
+
+def union(a, b):
+  x = min(a[0], b[0])
+  y = min(a[1], b[1])
+  return (x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y)
+
+def mergeRects(rects):
+  # merge pairs whose bounding box costs no more pixels than filling both
+  rects = [r for r in rects if r[2] > 0 and r[3] > 0]
+  merged = True
+  while merged:
+    merged = False
+    for i in range(len(rects)):
+      for j in range(i + 1, len(rects)):
+        a = rects[i]
+        b = rects[j]
+        u = union(a, b)
+        if u[2] * u[3] <= a[2] * a[3] + b[2] * b[3]:
+          rects[i] = u
+          rects.pop(j)
+          merged = True
+          break
+      if merged:
+        break
+  return rects
+
+class Widget:
+  def __init__(self, x, y, w, h):
+    self.x = x
+    self.y = y
+    self.w = w
+    self.h = h
+    self.value = None
+    self.dirty = True
+    self.rects = [] # painted last time
+
+  def set(self, value):
+    if value != self.value:
+      self.value = value
+      self.dirty = True
+
+  def measure(self, gfx):
+    # rects the next draw() will paint opaquely
+    return [(self.x, self.y, self.w, self.h)]
+
+  def invalidate(self):
+    # called before a draw() that must repaint everything, e.g. after the
+    # screen was cleared; widgets drawing incrementally reset their state
+    pass
+
+  def damage(self):
+    # rects the last draw() changed, pushed from the off-screen frame;
+    # widgets drawing incrementally return less than their rects
+    return self.rects
+
+  def draw(self, gfx):
+    pass
+
+class TextWidget(Widget):
+  """
+  Text aligned inside its box, with an optional unit label drawn right after
+  it in a smaller font. Value is a (text, color) tuple.
+  """
+  def __init__(self, x, y, w, h, font, size=1, align=LEFT, label=None, labelFont=None, labelSize=1, labelDy=0, labelColor=None, bg=BLACK):
+    super().__init__(x, y, w, h)
+    self.font = font
+    self.size = size
+    self.align = align
+    self.label = label
+    self.labelFont = labelFont
+    self.labelSize = labelSize
+    self.labelDy = labelDy
+    self.labelColor = labelColor
+    self.bg = bg
+    self.layout = None
+
+  def _layout(self, gfx):
+    text = self.value[0]
+    gfx.setFont(self.font)
+    gfx.setTextSize(self.size)
+    tw = gfx.textWidth(text)
+    fh = gfx.fontHeight()
+    if self.align == CENTER:
+      tx = self.x + int((self.w - tw) / 2)
+    elif self.align == RIGHT:
+      tx = self.x + self.w - tw
+    else:
+      tx = self.x
+    rects = [(tx, self.y, tw, fh)]
+    if self.label:
+      gfx.setFont(self.labelFont)
+      gfx.setTextSize(self.labelSize)
+      rects.append((tx + tw, self.y + self.labelDy, gfx.textWidth(self.label), gfx.fontHeight()))
+    return tx, rects
+
+  def measure(self, gfx):
+    if self.value is None:
+      return []
+    self.layout = self._layout(gfx)
+    return self.layout[1]
+
+  def draw(self, gfx):
+    if self.value is None:
+      return
+    text, color = self.value
+    tx, rects = self.layout or self._layout(gfx)
+    gfx.setFont(self.font)
+    gfx.setTextSize(self.size)
+    gfx.setTextColor(color, self.bg)
+    gfx.drawString(text, tx, self.y)
+    if self.label:
+      gfx.setFont(self.labelFont)
+      gfx.setTextSize(self.labelSize)
+      gfx.setTextColor(self.labelColor if self.labelColor != None else color, self.bg)
+      gfx.drawString(self.label, tx + rects[0][2], self.y + self.labelDy)
+    gfx.setTextSize(1)
+    self.layout = None
+
+class PaintWidget(Widget):
+  """
+  Widget drawn by a callback paint(gfx, widget) which must cover the whole
+  box (or the rects returned by the optional extent(gfx, widget) callback).
+  """
+  def __init__(self, x, y, w, h, paint, extent=None):
+    super().__init__(x, y, w, h)
+    self.paint = paint
+    self.extent = extent
+
+  def measure(self, gfx):
+    if self.extent != None:
+      return self.extent(gfx, self)
+    return super().measure(gfx)
+
+  def draw(self, gfx):
+    self.paint(gfx, self)
+
+class LineWidget(Widget):
+  def __init__(self, x0, y, x1, color):
+    super().__init__(x0, y, x1 - x0 + 1, 1)
+    self.value = color
+
+  def draw(self, gfx):
+    gfx.drawLine(self.x, self.y, self.x + self.w - 1, self.y, self.value)
+
+def pushRects(display, frame, rects):
+  # the parts of the frame inside rects onto the display
+  for r in rects:
+    display.setClipRect(r[0], r[1], r[2], r[3])
+    frame.push(0, 0)
+  display.clearClipRect()
+
+class Compositor:
+  def __init__(self, gfx, bg=BLACK, frame=None):
+    self.display = gfx
+    self.frame = frame
+    self.gfx = frame if frame != None else gfx # widgets draw here
+    self.bg = bg
+    self.widgets = {}
+    self.order = []
+    self.cleared = True
+    self.rotation = None
+    self.repush = False # rotated, the frame is pushed again on the next flush
+
+  def add(self, name, widget):
+    self.widgets[name] = widget
+    self.order.append(widget)
+    return widget
+
+  def get(self, name):
+    return self.widgets.get(name)
+
+  def set(self, name, value):
+    # widgets this screen does not have are ignored
+    w = self.widgets.get(name)
+    if w != None:
+      w.set(value)
+
+  def invalidate(self):
+    # next flush clears the screen and repaints everything
+    self.cleared = True
+
+  def setRotation(self, rotation):
+    if rotation != self.rotation:
+      self.rotation = rotation
+      if self.frame != None:
+        self.repush = True
+      else:
+        self.cleared = True
+
+  def pending(self):
+    if self.cleared or self.repush:
+      return True
+    for w in self.order:
+      if w.dirty:
+        return True
+    return False
+
+  def flush(self, only=None):
+    """
+    Repaints dirty widgets (or just the named ones in `only`) and returns
+    the number of widgets drawn.
+    """
+    gfx = self.gfx
+    frame = self.frame
+    if (self.cleared or self.repush) and only != None:
+      # partial updates wait for the next full repaint
+      return 0
+    if self.rotation != None:
+      self.display.setRotation(self.rotation)
+    if self.cleared:
+      gfx.clear(self.bg)
+      for w in self.order:
+        w.invalidate()
+        w.rects = w.measure(gfx)
+        w.draw(gfx)
+        w.dirty = False
+      self.cleared = False
+      if frame != None:
+        frame.push(0, 0)
+        self.repush = False
+      return len(self.order)
+    if self.repush:
+      frame.push(0, 0)
+      self.repush = False
+
+    if only != None:
+      targets = [self.widgets[n] for n in only if self.widgets[n].dirty]
+    else:
+      targets = [w for w in self.order if w.dirty]
+    if not targets:
+      return 0
+
+    clears = []
+    nextRects = {}
+    while targets:
+      for w in targets:
+        rects = w.measure(gfx)
+        nextRects[id(w)] = rects
+        clears.extend(subtractAll(w.rects, rects))
+      # a pending widget hit by a clear must be brought up to date too
+      targets = [w for w in self.order if w.dirty and id(w) not in nextRects and any(intersects(r, c) for r in w.rects for c in clears)]
+    clears = mergeRects(clears)
+    for r in clears:
+      gfx.fillRect(r[0], r[1], r[2], r[3], self.bg)
+
+    # paint in z-order, a widget overlapping anything painted below it is
+    # painted again so it stays on top
+    drawn = 0
+    painted = clears
+    damaged = list(clears)
+    for w in self.order:
+      if id(w) in nextRects:
+        w.rects = nextRects[id(w)]
+        if any(intersects(r, c) for r in w.rects for c in painted):
+          # drawn over, widgets updating only a part repaint everything
+          w.invalidate()
+      elif any(intersects(r, c) for r in w.rects for c in painted):
+        w.invalidate()
+      else:
+        continue
+      w.draw(gfx)
+      w.dirty = False
+      painted = painted + w.rects
+      damaged.extend(w.damage())
+      drawn += 1
+    if frame != None:
+      pushRects(self.display, frame, mergeRects(damaged))
+    return drawn
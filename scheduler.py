@@ -0,0 +1,104 @@
+# Cooperative runtime on uasyncio. Everything runs as a task of one event
+# loop, so drawing never races: the render task is the only one painting
+# the glucose screen, other tasks post what changed into its queue. Periodic
+# tasks are aligned to multiples of their period, tasks with the same (or a
+# multiple) period wake up together and the CPU sleeps in between.
+import uasyncio as asyncio
+import utime
+import sys
+
+# render priorities, lower is painted first
+RENDER_SCREEN = 0
+RENDER_CLOCK = 1
+RENDER_BATTERY = 2
+RENDER_ARROW = 3
+RENDER_ENV = 4
+
+class RenderQueue:
+  """
+  request(name, paint, priority) queues paint() to run on the render task;
+  a request for a name already queued replaces it (only the newest state is
+  painted). Requests are painted in priority order, each one before the
+  next is picked, so a screen update posted meanwhile goes first.
+  """
+  def __init__(self):
+    self.pending = {} # name -> (priority, paint)
+    self.event = asyncio.Event()
+    self.painted = 0
+
+  def request(self, name, paint, priority):
+    self.pending[name] = (priority, paint)
+    self.event.set()
+
+  async def run(self):
+    while True:
+      await self.event.wait()
+      self.event.clear()
+      while self.pending:
+        name = None
+        for n in self.pending:
+          if name == None or self.pending[n][0] < self.pending[name][0]:
+            name = n
+        priority, paint = self.pending.pop(name)
+        try:
+          paint()
+          self.painted += 1
+        except Exception as e:
+          sys.print_exception(e)
+        await asyncio.sleep_ms(0)
+
+class Periodic:
+  """
+  Calls fn() every periodMs, at multiples of the period on the ticks_ms
+  clock: the period is the deadline of each run. A run ending after the
+  next deadline skips the missed ones (counted in `overruns`). periodMs may
+  be changed between runs. fn may be a plain function or a coroutine
+  function. With `sleeper` the wait for the
+  next run goes to sleeper(ms) first, see sleepAligned.
+  """
+  def __init__(self, name, periodMs, fn, sleeper=None):
+    self.name = name
+    self.periodMs = periodMs
+    self.fn = fn
+    self.sleeper = sleeper
+    self.runs = 0
+    self.overruns = 0
+
+  async def run(self):
+    while True:
+      period = self.periodMs
+      deadline = await sleepAligned(period, self.sleeper)
+      try:
+        r = self.fn()
+        if r != None and hasattr(r, "send"):
+          await r
+      except Exception as e:
+        sys.print_exception(e)
+      self.runs += 1
+      if utime.ticks_diff(utime.ticks_ms(), deadline) >= period:
+        self.overruns += 1
+
+async def sleepAligned(periodMs, sleeper=None):
+  # Sleeps to the next multiple of periodMs on the ticks_ms clock, returns
+  # it. sleeper(ms) may sleep the whole CPU instead (returns True), only the
+  # task with the shortest period can pass one: nothing else is due earlier.
+  now = utime.ticks_ms()
+  wait = periodMs - now % periodMs
+  if sleeper != None and sleeper(wait):
+    # tasks due meanwhile run first
+    await asyncio.sleep_ms(0)
+  else:
+    await asyncio.sleep_ms(wait)
+  return utime.ticks_add(now, wait)
+
+tasks = {}
+
+def start(name, coro):
+  # named task, kept in `tasks` for diagnostics
+  tasks[name] = asyncio.create_task(coro)
+  return tasks[name]
+
+def every(name, periodMs, fn, sleeper=None):
+  p = Periodic(name, periodMs, fn, sleeper)
+  start(name, p.run())
+  return p
@@ -0,0 +1,8 @@
+"""
+Host-side (CPython) simulator for the Tab5 glucose monitor.
+
+Stands in for the UiFlow2/MicroPython modules main.py and ap.py import,
+records every display call on a framebuffer backed canvas and serves
+Nightscout entries from a local stub. See sim/bench.py for the redraw
+cost benchmark.
+"""
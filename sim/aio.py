@@ -0,0 +1,447 @@
+"""
+Fake uasyncio: a deterministic event loop on the simulator clock.
+
+Tasks are plain CPython coroutines. Nothing runs on its own: asyncio.run()
+only creates the main task, the simulator drives the loop with settle()
+(run what is ready, time stands still) and runUntil() (move the clock from
+one due sleep to the next). Every time the clock is moved to wake a task
+counts as a wakeup, the CPU would have been idle in between.
+
+Streams from open_connection() talk to the Nightscout stub through the
+usocket fake, the time a request takes (round trips, TLS handshake,
+long-poll wait) is slept on the loop so other tasks keep running meanwhile.
+A WebSocket upgrade turns the stream over to a sim.pushserver.PushServer,
+reads wait on the loop for its next message.
+"""
+import collections
+import heapq
+
+from sim import fakes
+
+class CancelledError(BaseException):
+  pass
+
+class TimeoutError(Exception):
+  pass
+
+class _Command:
+  # awaitable handing one command to the loop
+  def __init__(self, *cmd):
+    self.cmd = cmd
+
+  def __await__(self):
+    return (yield self.cmd)
+
+class Task:
+  def __init__(self, loop, coro):
+    self.loop = loop
+    self.coro = coro
+    self.token = 0 # bumped when the task is woken, voids other pending wakeups
+    self.throw = None
+    self.finished = False
+    self.result = None
+    self.exc = None
+    self.waiters = []
+
+  def done(self):
+    return self.finished
+
+  def cancel(self):
+    if self.finished:
+      return False
+    self.throw = CancelledError()
+    self.loop.wake(self, self.token, None)
+    return True
+
+  def __await__(self):
+    if not self.finished:
+      yield ("join", self, None)
+    if self.exc is not None:
+      raise self.exc
+    return self.result
+
+class Event:
+  def __init__(self, loop):
+    self.loop = loop
+    self.state = False
+    self.waiting = []
+
+  def set(self):
+    self.state = True
+    for task, token in self.waiting:
+      self.loop.wake(task, token, True)
+    self.waiting = []
+
+  def clear(self):
+    self.state = False
+
+  def is_set(self):
+    return self.state
+
+  async def wait(self):
+    if not self.state:
+      await _Command("wait", self)
+    return True
+
+class Loop:
+  def __init__(self, clock):
+    self.clock = clock
+    self.ready = collections.deque() # (task, token, value)
+    self.timers = [] # heap of (ms, seq, task, token, value)
+    self.seq = 0
+    self.wakeups = 0
+    self.stopAt = None
+    self.main = None
+
+  def create_task(self, coro):
+    t = Task(self, coro)
+    self.ready.append((t, t.token, None))
+    return t
+
+  def wake(self, task, token, value):
+    if token == task.token and not task.finished:
+      task.token += 1
+      self.ready.append((task, task.token, value))
+
+  def at(self, ms, task, value):
+    self.seq += 1
+    heapq.heappush(self.timers, (ms, self.seq, task, task.token, value))
+
+  def step(self, task, value):
+    try:
+      if task.throw is not None:
+        e, task.throw = task.throw, None
+        cmd = task.coro.throw(e)
+      else:
+        cmd = task.coro.send(value)
+    except StopIteration as e:
+      self.finish(task, e.value, None)
+      return
+    except (Exception, CancelledError) as e:
+      if not isinstance(e, CancelledError) and not task.waiters and task is not self.main:
+        fakes.printException(e)
+      self.finish(task, None, e)
+      return
+    kind = cmd[0]
+    if kind == "sleep" and cmd[1] == 0:
+      self.wake(task, task.token, None)
+    elif kind == "sleep":
+      self.at(self.clock.ms + cmd[1], task, None)
+    elif kind == "wait":
+      cmd[1].waiting.append((task, task.token))
+    elif kind == "join":
+      target, timeoutMs = cmd[1], cmd[2]
+      if target.finished:
+        self.wake(task, task.token, True)
+      else:
+        target.waiters.append((task, task.token))
+        if timeoutMs is not None:
+          self.at(self.clock.ms + timeoutMs, task, False)
+
+  def finish(self, task, result, exc):
+    task.finished = True
+    task.result = result
+    task.exc = exc
+    for t, token in task.waiters:
+      self.wake(t, token, True)
+    task.waiters = []
+
+  def settle(self):
+    """
+    Runs the ready tasks until all of them wait. The loop does not move the
+    clock, a task may (machine.lightsleep): sleeps due by then wake up, and
+    a runUntil() stops at its end.
+    """
+    while self.ready:
+      if self.stopAt is not None and self.clock.ms >= self.stopAt:
+        return
+      task, token, value = self.ready.popleft()
+      if token == task.token and not task.finished:
+        ms = self.clock.ms
+        self.step(task, value)
+        if self.clock.ms != ms:
+          self.popDue()
+
+  def popDue(self):
+    while self.timers and self.timers[0][0] <= self.clock.ms:
+      _, _, task, token, value = heapq.heappop(self.timers)
+      self.wake(task, token, value)
+
+  def runUntil(self, ms):
+    """Runs the loop until the clock reaches `ms` (clock.ms)."""
+    self.stopAt = ms
+    try:
+      self.settle()
+      while self.clock.ms < ms and self.timers and self.timers[0][0] <= ms:
+        due = self.timers[0][0]
+        if due > self.clock.ms:
+          self.clock.advance((due - self.clock.ms) / 1000)
+          self.wakeups += 1
+        self.popDue()
+        self.settle()
+    finally:
+      self.stopAt = None
+    if ms > self.clock.ms:
+      self.clock.advance((ms - self.clock.ms) / 1000)
+
+class Stream:
+  """Reader and writer of a client connection, over a fakes.Socket."""
+  def __init__(self, sim, sock):
+    self.sim = sim
+    self.sock = sock
+    self.tx = b""
+    self.pending = None
+    self.ws = None # PushServer after an upgrade
+
+  def write(self, data):
+    if self.sock.closed:
+      raise OSError("EBADF")
+    self.tx += bytes(data)
+
+  async def drain(self):
+    # the request is sent, the response comes with the first read
+    if self.ws is not None:
+      await sleep_ms(self.sim.net["rttMs"] // 2)
+      self.ws.receive(self.tx)
+      self.tx = b""
+      return
+    if b"\r\n\r\n" in self.tx:
+      head, _, self.tx = self.tx.partition(b"\r\n\r\n")
+      self.pending = head.decode()
+      if "upgrade: websocket" in self.pending.lower() and self.sock.alive():
+        url, headers = fakes.parseRequest(self.pending)
+        self.ws = self.sock.stub.upgrade(url)
+        if self.ws is not None:
+          self.pending = None
+          await sleep_ms(self.sim.net["rttMs"])
+          self.ws.handshake(head.decode())
+
+  async def answer(self):
+    head, self.pending = self.pending, None
+    sock = self.sock
+    if sock.alive():
+      url, headers = fakes.parseRequest(head)
+      wait = sock.stub.waitTime(url, headers) + sock.stub.stallSec
+      await sleep_ms(self.sim.net["rttMs"] + int(wait * 1000))
+      sock.reply(url, headers, wait=False)
+    else:
+      sock.reply(None, None)
+
+  async def wsWait(self, n):
+    # until the server sent n bytes (or a line when n is None), or closed
+    ws = self.ws
+    while True:
+      if not self.sim.wifi["connected"]:
+        ws.closed = True
+      if (n is None and b"\n" in ws.out) or (n is not None and len(ws.out) >= n) or ws.closed:
+        return
+      due = ws.nextEventMs()
+      await sleep_ms(3600000 if due is None else due - self.sim.clock.ms)
+      ws.poll()
+
+  def wsTake(self, n):
+    out = self.ws.out
+    if n is None:
+      i = out.find(b"\n")
+      n = len(out) if i < 0 else i + 1
+    data = bytes(out[:n])
+    del out[:n]
+    return data
+
+  async def readline(self):
+    if self.ws is not None:
+      await self.wsWait(None)
+      return self.wsTake(None)
+    if self.pending is not None:
+      await self.answer()
+    return self.sock.readline()
+
+  async def read(self, n=-1):
+    if self.ws is not None:
+      await self.wsWait(1)
+      return self.wsTake(n if n >= 0 else len(self.ws.out))
+    return self.sock.read(n)
+
+  async def readinto(self, buf):
+    return self.sock.readinto(buf)
+
+  async def readexactly(self, n):
+    if self.ws is not None:
+      await self.wsWait(n)
+      data = self.wsTake(n)
+    else:
+      data = self.sock.read(n)
+    if len(data) < n:
+      raise EOFError()
+    return data
+
+  def close(self):
+    self.sock.close()
+
+  async def wait_closed(self):
+    pass
+
+class ServerStream:
+  """
+  Reader and writer of a connection to a server task (the access point's
+  web server), from a client on the simulated link: the request arrives
+  in segments of `mss` bytes, one every rttMs, what the server writes is
+  collected in `out` and takes apBytesPerMs to send on drain().
+  """
+  def __init__(self, sim, request, mss):
+    self.sim = sim
+    self.request = request
+    self.mss = mss
+    self.start = sim.clock.ms
+    self.pos = 0
+    self.out = b""
+    self.unsent = 0
+    self.closed = False
+
+  def arrived(self):
+    segments = 1 + (self.sim.clock.ms - self.start) // max(1, self.sim.net["rttMs"])
+    return min(len(self.request), segments * self.mss)
+
+  async def waitFor(self, n):
+    # until n more bytes arrived or the whole request did
+    while self.arrived() - self.pos < n and self.arrived() < len(self.request):
+      await sleep_ms(self.sim.net["rttMs"])
+
+  async def readline(self):
+    while True:
+      i = self.request.find(b"\n", self.pos, self.arrived())
+      if i >= 0 or self.arrived() == len(self.request):
+        break
+      await self.waitFor(self.arrived() - self.pos + 1)
+    end = i + 1 if i >= 0 else len(self.request)
+    data = self.request[self.pos:end]
+    self.pos = end
+    return data
+
+  async def read(self, n=-1):
+    # what arrived so far, like recv()
+    await self.waitFor(1)
+    end = self.arrived() if n < 0 else min(self.arrived(), self.pos + n)
+    data = self.request[self.pos:end]
+    self.pos = end
+    return data
+
+  async def readexactly(self, n):
+    await self.waitFor(n)
+    data = self.request[self.pos:self.pos + n]
+    self.pos += len(data)
+    if len(data) < n:
+      raise EOFError()
+    return data
+
+  def write(self, data):
+    if isinstance(data, str):
+      data = data.encode()
+    data = bytes(data)
+    self.out += data
+    self.unsent += len(data)
+
+  async def drain(self):
+    if self.unsent:
+      await sleep_ms(self.unsent / self.sim.net["apBytesPerMs"])
+      self.unsent = 0
+
+  def get_extra_info(self, name):
+    return ("192.168.4.2", 50000)
+
+  def close(self):
+    self.closed = True
+
+  async def wait_closed(self):
+    pass
+
+class Server:
+  def __init__(self, sim, port, callback):
+    self.sim = sim
+    self.port = port
+    self.callback = callback
+
+  def close(self):
+    self.sim.servers.pop(self.port, None)
+
+  async def wait_closed(self):
+    pass
+
+# awaitables shared by every loop, the running one comes from the simulator
+
+async def sleep_ms(ms):
+  await _Command("sleep", max(0, int(ms)))
+
+async def sleep(seconds):
+  await sleep_ms(seconds * 1000)
+
+def makeUasyncio(sim):
+  loop = sim.loop = Loop(sim.clock)
+
+  def create_task(coro):
+    return loop.create_task(coro)
+
+  async def wait_for(aw, timeout):
+    t = aw if isinstance(aw, Task) else loop.create_task(aw)
+    if timeout is None:
+      return await t
+    if not await _Command("join", t, int(timeout * 1000)):
+      t.cancel()
+      raise TimeoutError()
+    return await t
+
+  async def wait_for_ms(aw, timeout):
+    return await wait_for(aw, timeout / 1000)
+
+  async def gather(*aws, return_exceptions=False):
+    tasks = [aw if isinstance(aw, Task) else loop.create_task(aw) for aw in aws]
+    results = []
+    for t in tasks:
+      try:
+        results.append(await t)
+      except Exception as e:
+        if not return_exceptions:
+          raise
+        results.append(e)
+    return results
+
+  async def open_connection(host, port, ssl=None, server_hostname=None):
+    if not sim.wifi["connected"]:
+      raise OSError("EHOSTUNREACH")
+    sock = fakes.Socket(sim, host)
+    sim.net["connects"] += 1
+    await sleep_ms(sim.net["rttMs"])
+    if sock.stub.down:
+      raise OSError("ECONNREFUSED")
+    if ssl:
+      sim.net["handshakes"] += 1
+      await sleep_ms(sim.net["tlsMs"])
+    sock.lastActive = sim.clock.rtc
+    s = Stream(sim, sock)
+    return s, s
+
+  async def start_server(callback, host, port, backlog=5):
+    sim.servers[port] = callback
+    return Server(sim, port, callback)
+
+  def run(coro):
+    # the device blocks here for good, the simulator drives the loop instead
+    loop.main = loop.create_task(coro)
+    return None
+
+  return fakes.module("uasyncio",
+    CancelledError=CancelledError,
+    TimeoutError=TimeoutError,
+    Event=lambda: Event(loop),
+    Task=Task,
+    create_task=create_task,
+    sleep=sleep,
+    sleep_ms=sleep_ms,
+    wait_for=wait_for,
+    wait_for_ms=wait_for_ms,
+    gather=gather,
+    open_connection=open_connection,
+    start_server=start_server,
+    run=run,
+    get_event_loop=lambda: loop,
+  )
@@ -0,0 +1,325 @@
+"""
+Redraw cost benchmark.
+
+Boots main.py in the simulator and reports draw calls and pixels touched
+on the panel (and in the off-screen frame and sprites) for drawScreen(),
+the clock tick and the rotation of the trend arrow in the typical
+situations the device goes through during a day, then runs all of
+main.py's tasks for a day on USB power, for 12 hours with a late, jittery uploader, for 12 hours with
+server push, for 4 hours with the primary endpoint stalling (with and
+without a mirror) and for 6 hours on battery (power saving) against the
+Nightscout stub and reports wakeups, radio on and light sleep time,
+requests, bytes received, how long after upload readings are shown, empty
+long-polls, WiFi connects and flash wear. Boot to the first reading on
+screen and to the first fresh one is measured for a first boot, a power
+cycle and a reset, and the access point's config page is loaded and a
+large form posted back:
+
+  python -m sim.bench [--json] [--verbose]
+"""
+import contextlib
+import io
+import json
+import sys
+
+from sim.runner import Simulator
+
+def measure(sim, label, fn, results):
+  stats = sim.display.stats
+  stats.reset()
+  sim.display.offscreen.reset()
+  i2c = sim.i2cReads
+  fn()
+  r = stats.snapshot()
+  r["offscreen"] = sim.display.offscreen.snapshot()
+  r["scenario"] = label
+  r["i2c"] = sim.i2cReads - i2c
+  results.append(r)
+  return r
+
+def run(sim=None):
+  sim = sim or Simulator()
+  m = sim.boot()
+  sim.connectWifi()
+  results = []
+
+  m.response = sim.fetch()
+  m.persistEntries()
+
+  measure(sim, "drawScreen first run", lambda: m.drawScreen(m.response[0]), results)
+  measure(sim, "drawScreen unchanged", lambda: m.drawScreen(m.response[0], clear=False), results)
+
+  def agoRefresh():
+    sim.clock.advance(60)
+    m.response = sim.fetch()
+    m.drawScreen(m.response[0], clear=False)
+  measure(sim, "drawScreen 'ago' refresh", agoRefresh, results)
+
+  def newReading():
+    sim.clock.advance(sim.nightscout.interval)
+    m.response = sim.fetch()
+    m.drawScreen(m.response[0], clear=False)
+  measure(sim, "drawScreen new reading", newReading, results)
+
+  def flip():
+    # what readAccel() requests
+    m.mode = 4
+    m.drawScreen(m.response[0], clear=False)
+  measure(sim, "drawScreen flip", flip, results)
+  m.mode = 0
+  m.drawScreen(m.response[0])
+
+  def clockTick():
+    # what the clock task does each second, painted by the render task
+    m.clockTick()
+    sim.settle()
+
+  # align to the start of a minute so the two ticks below are deterministic
+  sim.clock.advance(60 - sim.clock.time() % 60 + 1)
+  clockTick()
+
+  def tick():
+    sim.clock.advance(1)
+    clockTick()
+  measure(sim, "clock tick", tick, results)
+
+  def minuteTick():
+    sim.clock.advance(60)
+    clockTick()
+  measure(sim, "clock minute", minuteTick, results)
+
+  def rotate():
+    # a new trend direction, up to down: the arrow turns through flat
+    entry = m.response[0]
+    entry["direction"] = "SingleDown" if entry["direction"] != "SingleDown" else "SingleUp"
+    m.drawScreen(entry, clear=False)
+    # the frames animateArrow() has painted
+    arrow = m.screen.get("arrow")
+    while arrow.moving():
+      arrow.step()
+      m.screen.flush(only=["arrow"])
+    sim.settle()
+  measure(sim, "arrow rotation", rotate, results)
+
+  # the incrementally maintained frame must match a full repaint
+  frame = sim.display.checksum()
+  m.drawScreen(m.response[0], clear=True)
+  results.append({"scenario": "frame check", "match": frame == sim.display.checksum()})
+
+  m.mode = m.MODES.index("chart")
+  measure(sim, "chart first draw", lambda: m.drawScreen(m.response[0]), results)
+
+  def chartReading():
+    sim.clock.advance(sim.nightscout.interval)
+    m.response = sim.fetch()
+    m.persistEntries()
+    m.drawScreen(m.response[0], clear=False)
+  measure(sim, "chart new reading", chartReading, results)
+
+  sim.uninstall()
+  return results
+
+def runTasks(sim, label, hours, events=()):
+  # all tasks (polling the stubs, clock, input, ...) for `hours` of
+  # simulated time, events are (hour, fn) run at that hour
+  ns = sim.nightscout
+  stubs = list(sim.stubs.values())
+  sim.display.stats.reset()
+  sim.display.offscreen.reset()
+  sim.flash.stats.reset()
+  i2c = sim.i2cReads
+  wakeups = sim.loop.wakeups + sim.power["lightsleeps"]
+  slept = sim.power["sleptMs"]
+  radio = sim.radioMs()
+  requests = sum(len(stub.requests) for stub in stubs)
+  sent = sum(stub.bytesSent for stub in stubs)
+  latencies = len(ns.latencies)
+  emptyPolls = sum(stub.emptyPolls for stub in stubs)
+  handshakes = sim.net["handshakes"]
+  scans = sim.wifi["scans"]
+  connects = len(sim.wifi["connectMs"])
+  at = 0
+  for hour, fn in events:
+    sim.runFor((hour - at) * 3600)
+    fn()
+    at = hour
+  sim.runFor((hours - at) * 3600)
+  r = sim.display.stats.snapshot()
+  r["offscreen"] = sim.display.offscreen.snapshot()
+  r["scenario"] = "%s %dh" % (label, hours)
+  r["i2c"] = sim.i2cReads - i2c
+  r["hours"] = hours
+  r["wakeups"] = sim.loop.wakeups + sim.power["lightsleeps"] - wakeups
+  r["lightSleepSec"] = (sim.power["sleptMs"] - slept) / 1000
+  r["radioSec"] = (sim.radioMs() - radio) / 1000
+  r["requests"] = sum(len(stub.requests) for stub in stubs) - requests
+  r["bytes"] = sum(stub.bytesSent for stub in stubs) - sent
+  r["handshakes"] = sim.net["handshakes"] - handshakes
+  seen = ns.latencies[latencies:]
+  r["latency"] = sum(seen) / max(1, len(seen))
+  r["maxLatency"] = max(seen or [0])
+  r["emptyPolls"] = sum(stub.emptyPolls for stub in stubs) - emptyPolls
+  connectMs = sim.wifi["connectMs"][connects:]
+  r["wifiConnects"] = len(connectMs)
+  r["wifiScans"] = sim.wifi["scans"] - scans
+  r["wifiMs"] = sum(connectMs) / max(1, len(connectMs))
+  r["flash"] = sim.flash.stats.snapshot()
+  return r
+
+def runBoot():
+  # boot to the first reading on screen and to the first one from the
+  # server: the first boot, a power cycle (files kept, RTC unset) and a
+  # reset (RTC kept too)
+  results = []
+  workdir = None
+  for label, rtcSet in (("first boot", False), ("power cycle", False), ("reset", True)):
+    sim = Simulator(workdir=workdir, rtcSet=rtcSet)
+    sim.battery.update(charging=True, current=500)
+    m = sim.boot()
+    sim.runFor(60)
+    results.append({"scenario": label, "bootMs": m.firstReadingMs, "freshMs": m.freshReadingMs, "wifiMs": sim.wifi["connectMs"][0], "wifiScans": sim.wifi["scans"]})
+    workdir = sim.workdir
+    sim.uninstall()
+  return results
+
+def runSync(hours=24):
+  # a day on USB power, then the config and error writes of a day:
+  # brightness taps, chart toggles, errors
+  sim = Simulator()
+  sim.battery.update(charging=True, current=500)
+  m = sim.boot()
+  results = [runTasks(sim, "all tasks, USB", hours)]
+
+  # brightness is stepped in bursts of taps, each burst and each toggle is
+  # followed by a quiet period long enough for the deferred config save
+  sim.flash.stats.reset()
+  for burst in range(4):
+    for i in range(5):
+      m.onTouchTap(saveConfig=True)
+    m.ap.flushConfig(m.CONFIG_SAVE_DELAY_MS)
+    sim.clock.advance(m.CONFIG_SAVE_DELAY_MS / 1000)
+    m.ap.flushConfig(m.CONFIG_SAVE_DELAY_MS)
+  for i in range(4):
+    m.onToggleChart()
+    sim.clock.advance(m.CONFIG_SAVE_DELAY_MS / 1000)
+    m.ap.flushConfig(m.CONFIG_SAVE_DELAY_MS)
+  for i in range(10):
+    m.saveError(ValueError("bench"))
+  results.append({"scenario": "taps, toggles, errors", "flash": sim.flash.stats.snapshot()})
+  sim.uninstall()
+  return results
+
+def runJitter(hours=12):
+  # an uploader whose readings show up 30 to 60 seconds late, on USB power
+  sim = Simulator()
+  sim.nightscout.latency = 30
+  sim.nightscout.jitter = 30
+  sim.battery.update(charging=True, current=500)
+  sim.boot()
+  results = [runTasks(sim, "all tasks, late uploader", hours)]
+  sim.uninstall()
+  return results
+
+def runPush(hours=12):
+  # readings pushed over the Socket.IO stand-in, on USB power
+  sim = Simulator(config={"transport": 1})
+  sim.battery.update(charging=True, current=500)
+  sim.boot()
+  results = [runTasks(sim, "all tasks, push", hours)]
+  sim.uninstall()
+  return results
+
+def runStall(mirror, hours=4):
+  # the primary endpoint stalls (answers after a minute) in the 2nd and
+  # 3rd hour, with and without a mirror configured
+  config = {"mirrors": [{"api-endpoint": "https://mirror.sim/api/v1", "api-token": "sim-token"}]} if mirror else None
+  sim = Simulator(config=config)
+  sim.addMirror()
+  sim.battery.update(charging=True, current=500)
+  sim.boot()
+  def stall(sec):
+    sim.nightscout.stallSec = sec
+  label = "primary stalls, mirror" if mirror else "primary stalls, no mirror"
+  results = [runTasks(sim, label, hours, [(1, lambda: stall(60)), (3, lambda: stall(0))])]
+  sim.uninstall()
+  return results
+
+def runBattery(hours=6):
+  # on battery the power saving mode is on
+  sim = Simulator()
+  sim.boot()
+  results = [runTasks(sim, "all tasks, battery", hours)]
+  sim.uninstall()
+  return results
+
+def runConfigPage(networks=12):
+  # the access point's config page on a first boot: the page, then a form
+  # with `networks` WiFi networks and a long API token posted back
+  sim = Simulator(config={"config": 0})
+  sim.battery.update(charging=True, current=500)
+  m = sim.boot()
+  results = []
+  out, ms = sim.request(b"GET / HTTP/1.1\r\nHost: 192.168.4.1\r\nAccept-Encoding: gzip, deflate\r\n\r\n")
+  results.append({"scenario": "config page", "httpBytes": len(out), "httpMs": ms})
+
+  form = []
+  for i in range(networks):
+    form += ["ssid=home+net+%d" % i, "wifi_password=p%%C3%%A4ss+%d%%3D" % i]
+  form += ["api-endpoint=https%3A%2F%2Fns.example%2Fapi%2Fv1", "api-token=" + "t" * 300, "timezone=%2B02%3A00", "min=75", "max=180"]
+  body = "&".join(form).encode()
+  out, ms = sim.request(b"POST /config HTTP/1.1\r\nHost: 192.168.4.1\r\nContent-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+  config = m.ap.readConfigFile()
+  saved = config.get("wifi", [])
+  match = (len(saved) == networks and saved[-1] == {"ssid": "home net %d" % (networks - 1), "password": "p\u00e4ss %d=" % (networks - 1)}
+    and config.get("api-token") == "t" * 300 and config.get("timezone") == "+02:00")
+  results.append({"scenario": "config form, %d bytes" % len(body), "httpBytes": len(out), "httpMs": ms, "saved": "%d/%d wifi, token %s" % (len(saved), networks, "ok" if match else "MISMATCH")})
+  sim.uninstall()
+  return results
+
+def report(results, out=sys.stdout):
+  out.write("%-28s %7s %10s %5s  %s\n" % ("scenario", "calls", "pixels", "i2c", "ops"))
+  for r in results:
+    if "bootMs" in r:
+      out.write("%-28s reading shown %d ms after boot, fresh %d ms, wifi connect %d ms, scans=%d\n" % (r["scenario"], r["bootMs"], r["freshMs"], r["wifiMs"], r["wifiScans"]))
+      continue
+    if "httpBytes" in r:
+      out.write("%-28s %d bytes sent in %d ms%s\n" % (r["scenario"], r["httpBytes"], r["httpMs"], ", saved " + r["saved"] if "saved" in r else ""))
+      continue
+    if "match" in r:
+      out.write("%-28s %s\n" % (r["scenario"], "ok" if r["match"] else "MISMATCH"))
+      continue
+    if "requests" in r:
+      out.write("%-28s %7d %10d %5d  requests=%d, bytes=%d, tls handshakes=%d\n" % (r["scenario"], r["calls"], r["pixels"], r["i2c"], r["requests"], r["bytes"], r["handshakes"]))
+      h = r["hours"]
+      offscreen(r, out)
+      out.write("%-28s wakeups=%d/h, radio on=%ds/h, light sleep=%ds/h\n" % ("", r["wakeups"] / h, r["radioSec"] / h, r["lightSleepSec"] / h))
+      out.write("%-28s reading shown %.1fs after upload (max %ds), empty long-polls=%d\n" % ("", r["latency"], r["maxLatency"], r["emptyPolls"]))
+      out.write("%-28s wifi connects=%d (%d ms each), scans=%d\n" % ("", r["wifiConnects"], r["wifiMs"], r["wifiScans"]))
+    elif "flash" in r:
+      out.write("%s\n" % r["scenario"])
+    if "flash" in r:
+      f = r["flash"]
+      files = ", ".join("%s=%d/%d" % (k, v[0], v[1]) for k, v in sorted(f["files"].items()))
+      out.write("%-28s flash programs=%d, erases=%d (%s)\n" % ("", f["programs"], f["erases"], files))
+      continue
+    ops = ", ".join("%s=%d" % kv for kv in sorted(r["ops"].items()))
+    out.write("%-28s %7d %10d %5d  %s\n" % (r["scenario"], r["calls"], r["pixels"], r["i2c"], ops))
+    offscreen(r, out)
+
+def offscreen(r, out):
+  # draw calls into the off-screen frame and sprites, pushed to the panel above
+  o = r.get("offscreen")
+  if o and o["calls"]:
+    ops = ", ".join("%s=%d" % kv for kv in sorted(o["ops"].items()))
+    out.write("%-28s %7d %10d %5s  %s\n" % ("  off-screen", o["calls"], o["pixels"], "", ops))
+
+if __name__ == "__main__":
+  if "--verbose" in sys.argv:
+    results = run() + runBoot() + runSync() + runJitter() + runPush() + runStall(False) + runStall(True) + runBattery() + runConfigPage()
+  else:
+    with contextlib.redirect_stdout(io.StringIO()):
+      results = run() + runBoot() + runSync() + runJitter() + runPush() + runStall(False) + runStall(True) + runBattery() + runConfigPage()
+  if "--json" in sys.argv:
+    print(json.dumps(results, indent=2))
+  else:
+    report(results)
@@ -0,0 +1,286 @@
+from array import array
+import zlib
+
+# Approximate DejaVu glyph cell (advance, height) at text size 1
+FONT_METRICS = {
+  "DejaVu9": (6, 11),
+  "DejaVu12": (7, 14),
+  "DejaVu18": (11, 21),
+  "DejaVu24": (14, 28),
+  "DejaVu40": (24, 47),
+  "DejaVu56": (33, 65),
+  "DejaVu72": (43, 84),
+}
+
+class Font:
+  def __init__(self, name):
+    self.name = name
+    self.advance, self.height = FONT_METRICS[name]
+
+  def __repr__(self):
+    return "<Font " + self.name + ">"
+
+class Fonts:
+  pass
+
+for _name in FONT_METRICS:
+  setattr(Fonts, _name, Font(_name))
+
+class DrawStats:
+  """Draw call and pixel counters for one canvas."""
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.calls = {}
+    self.pixels = 0
+
+  def count(self, op, pixels):
+    self.calls[op] = self.calls.get(op, 0) + 1
+    self.pixels += pixels
+
+  def totalCalls(self):
+    return sum(self.calls.values())
+
+  def snapshot(self):
+    return {"calls": self.totalCalls(), "pixels": self.pixels, "ops": dict(self.calls)}
+
+class Canvas:
+  """
+  Framebuffer backed stand-in for M5.Display (M5GFX).
+
+  Pixels are stored as 24-bit colours in physical landscape orientation.
+  Rotation 1 is the identity mapping and rotation 3 the 180 degree flip,
+  which are the only two the application uses. Text is rendered as a
+  background filled cell per character with a deterministic per-character
+  mark, so different strings produce different frames.
+  """
+
+  FONTS = Fonts
+
+  def __init__(self, width=1280, height=720, root=None):
+    self.width = width
+    self.height = height
+    self.fb = array('I', bytes(4 * width * height))
+    # draw calls on off-screen canvases are counted in the display's
+    # `offscreen` stats, `stats` holds what reaches the panel
+    self.root = root or self
+    self.stats = DrawStats() if root is None else root.offscreen
+    self.offscreen = DrawStats() if root is None else None
+    self.clip = None
+    self.rotation = 1
+    self.font = Fonts.DejaVu9
+    self.textSize = 1
+    self.textColor = 0xFFFFFF
+    self.textBgColor = None
+
+  # --- state ---
+
+  def setRotation(self, r):
+    if r not in (1, 3):
+      raise ValueError("Unsupported rotation " + str(r))
+    self.rotation = r
+
+  def getRotation(self):
+    return self.rotation
+
+  def setClipRect(self, x, y, w, h):
+    self.clip = (int(x), int(y), int(w), int(h))
+
+  def clearClipRect(self):
+    self.clip = None
+
+  def setFont(self, font):
+    self.font = font
+
+  def setTextSize(self, size):
+    self.textSize = size
+
+  def setTextColor(self, fg, bg=None):
+    self.textColor = fg
+    self.textBgColor = bg
+
+  def textWidth(self, s):
+    return int(len(s) * self.font.advance * self.textSize)
+
+  def fontHeight(self):
+    return int(self.font.height * self.textSize)
+
+  # --- raster helpers, logical coordinates ---
+
+  def _clipped(self, x, y, w, h):
+    # logical rect cut to the clip rect
+    if self.clip is None:
+      return x, y, w, h
+    cx, cy, cw, ch = self.clip
+    x0, y0 = max(x, cx), max(y, cy)
+    x1, y1 = min(x + w, cx + cw), min(y + h, cy + ch)
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+  def _rect(self, x, y, w, h, color):
+    x, y, w, h = self._clipped(int(x), int(y), int(w), int(h))
+    if self.rotation == 3:
+      x = self.width - x - w
+      y = self.height - y - h
+    x0 = max(0, int(x))
+    y0 = max(0, int(y))
+    x1 = min(self.width, int(x) + int(w))
+    y1 = min(self.height, int(y) + int(h))
+    if x1 <= x0 or y1 <= y0:
+      return 0
+    row = array('I', [color & 0xFFFFFF]) * (x1 - x0)
+    W = self.width
+    fb = self.fb
+    for yy in range(y0, y1):
+      o = yy * W
+      fb[o + x0:o + x1] = row
+    return (x1 - x0) * (y1 - y0)
+
+  def _span(self, x0, x1, y, color):
+    return self._rect(x0, y, x1 - x0 + 1, 1, color)
+
+  # --- primitives ---
+
+  def clear(self, color=0):
+    self.fb[:] = array('I', [color & 0xFFFFFF]) * (self.width * self.height)
+    self.stats.count("clear", self.width * self.height)
+
+  def fillScreen(self, color=0):
+    self.clear(color)
+
+  def fillRect(self, x, y, w, h, color):
+    self.stats.count("fillRect", self._rect(x, y, w, h, color))
+
+  def drawRect(self, x, y, w, h, color):
+    p = self._rect(x, y, w, 1, color) + self._rect(x, y + h - 1, w, 1, color)
+    p += self._rect(x, y + 1, 1, h - 2, color) + self._rect(x + w - 1, y + 1, 1, h - 2, color)
+    self.stats.count("drawRect", p)
+
+  def drawPixel(self, x, y, color):
+    self.stats.count("drawPixel", self._rect(x, y, 1, 1, color))
+
+  def drawLine(self, x0, y0, x1, y1, color):
+    x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+    if y0 == y1:
+      p = self._span(min(x0, x1), max(x0, x1), y0, color)
+    elif x0 == x1:
+      p = self._rect(x0, min(y0, y1), 1, abs(y1 - y0) + 1, color)
+    else:
+      p = 0
+      dx = abs(x1 - x0)
+      dy = -abs(y1 - y0)
+      sx = 1 if x0 < x1 else -1
+      sy = 1 if y0 < y1 else -1
+      err = dx + dy
+      while True:
+        p += self._rect(x0, y0, 1, 1, color)
+        if x0 == x1 and y0 == y1:
+          break
+        e2 = 2 * err
+        if e2 >= dy:
+          err += dy
+          x0 += sx
+        if e2 <= dx:
+          err += dx
+          y0 += sy
+    self.stats.count("drawLine", p)
+
+  def fillTriangle(self, x0, y0, x1, y1, x2, y2, color):
+    pts = sorted(((int(x0), int(y0)), (int(x1), int(y1)), (int(x2), int(y2))), key=lambda p: p[1])
+    (ax, ay), (bx, by), (cx, cy) = pts
+    p = 0
+
+    def edgeX(px, py, qx, qy, y):
+      if qy == py:
+        return px
+      return px + (qx - px) * (y - py) / (qy - py)
+
+    for y in range(ay, cy + 1):
+      xa = edgeX(ax, ay, cx, cy, y)
+      if y < by:
+        xb = edgeX(ax, ay, bx, by, y)
+      else:
+        xb = edgeX(bx, by, cx, cy, y)
+      lo, hi = int(min(xa, xb)), int(max(xa, xb))
+      p += self._span(lo, hi, y, color)
+    self.stats.count("fillTriangle", p)
+
+  def fillCircle(self, cx, cy, r, color):
+    p = 0
+    r = int(r)
+    for dy in range(-r, r + 1):
+      dx = int((r * r - dy * dy) ** 0.5)
+      p += self._span(cx - dx, cx + dx, cy + dy, color)
+    self.stats.count("fillCircle", p)
+
+  def drawString(self, s, x, y):
+    x, y = int(x), int(y)
+    cw = max(1, int(self.font.advance * self.textSize))
+    ch = self.fontHeight()
+    bg = self.textBgColor
+    fg = self.textColor
+    p = 0
+    for i, c in enumerate(s):
+      cx = x + i * cw
+      if bg is not None:
+        p += self._rect(cx, y, cw, ch, bg)
+      else:
+        p += cw * ch
+      # per-character mark: one vertical and one horizontal bar
+      o = ord(c)
+      bw = max(1, cw // 6)
+      self._rect(cx + (o * 7) % max(1, cw - bw), y + ch // 8, bw, ch - ch // 4, fg)
+      self._rect(cx + 1, y + ch // 8 + (o * 3) % max(1, ch - ch // 4), max(1, cw - 2), bw, fg)
+    self.stats.count("drawString", p)
+
+  # --- off-screen canvases (M5GFX sprites) ---
+
+  def newCanvas(self, w, h, bpp=16, psram=False):
+    """
+    Off-screen canvas pushed onto this one with push(x, y), inside the
+    clip rect. Its draw calls are counted in the display's `offscreen`
+    stats, the push where it lands.
+    """
+    sprite = Canvas(w, h, self.root)
+    sprite.parent = self
+    return sprite
+
+  def push(self, x, y):
+    # copies the canvas into the parent at logical (x, y), as drawn:
+    # on a parent rotated by 180 degrees the rows and columns are reversed
+    parent = self.parent
+    W, H = parent.width, parent.height
+    x, y = int(x), int(y)
+    bx, by, bw, bh = parent._clipped(x, y, self.width, self.height)
+    p = 0
+    for ly in range(max(0, by), min(H, by + bh)):
+      j = ly - y
+      lx0 = max(0, bx)
+      lx1 = min(W, bx + bw)
+      if lx1 <= lx0:
+        continue
+      row = self.fb[j * self.width + lx0 - x:j * self.width + lx1 - x]
+      if parent.rotation == 3:
+        o = (H - 1 - ly) * W
+        row = array('I', reversed(row))
+        parent.fb[o + W - lx1:o + W - lx0] = row
+      else:
+        o = ly * W
+        parent.fb[o + lx0:o + lx1] = row
+      p += lx1 - lx0
+    parent.stats.count("push", p)
+
+  def delete(self):
+    self.fb = array('I')
+
+  # --- inspection ---
+
+  def pixel(self, x, y):
+    if self.rotation == 3:
+      x = self.width - 1 - x
+      y = self.height - 1 - y
+    return self.fb[y * self.width + x]
+
+  def checksum(self):
+    return zlib.crc32(self.fb.tobytes())
@@ -0,0 +1,80 @@
+import calendar
+import time
+
+RTC_RESET_EPOCH = 946684800 # 2000-01-01, what the ESP32 RTC reports after a cold boot
+
+class SimTimer:
+  def __init__(self, clock, id):
+    self.clock = clock
+    self.id = id
+    self.period = 0
+    self.callback = None
+    self.due = None
+
+  def init(self, period=1000, mode=None, callback=None, freq=None):
+    if freq:
+      period = int(1000 / freq)
+    self.period = period
+    self.callback = callback
+    self.due = self.clock.ms + period
+    if self not in self.clock.timers:
+      self.clock.timers.append(self)
+
+  def deinit(self):
+    self.due = None
+    if self in self.clock.timers:
+      self.clock.timers.remove(self)
+
+class SimClock:
+  """
+  Simulated RTC and tick counter. Time only moves when advance() is called
+  (directly or through the fake sleep functions); due machine.Timer callbacks
+  fire in order while it moves.
+  """
+
+  def __init__(self, epoch=RTC_RESET_EPOCH):
+    self.rtc = float(epoch)
+    self.ms = 0
+    self.timers = []
+    self.fireTimers = True
+    self._firing = False
+
+  def time(self):
+    return int(self.rtc)
+
+  def settime(self, epoch):
+    self.rtc = float(epoch)
+
+  def advance(self, seconds):
+    target = self.ms + int(round(seconds * 1000))
+    while True:
+      nxt = None
+      if self.fireTimers and not self._firing:
+        for t in self.timers:
+          if t.due is not None and t.due <= target and (nxt is None or t.due < nxt.due):
+            nxt = t
+      if nxt is None:
+        break
+      self._step(nxt.due - self.ms)
+      nxt.due += max(1, nxt.period)
+      self._firing = True
+      try:
+        nxt.callback(nxt)
+      finally:
+        self._firing = False
+    self._step(target - self.ms)
+
+  def _step(self, ms):
+    if ms > 0:
+      self.ms += ms
+      self.rtc += ms / 1000
+
+# --- utime compatible helpers ---
+
+def localtime(clock, secs=None):
+  if secs is None:
+    secs = clock.time()
+  return tuple(time.gmtime(secs))[:8]
+
+def mktime(t):
+  return calendar.timegm(tuple(t[:6]) + (0, 0, 0))
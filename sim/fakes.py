@@ -0,0 +1,490 @@
+"""
+Fake MicroPython / UiFlow2 modules backed by a Simulator instance.
+
+install() puts them into sys.modules so that main.py and ap.py import them
+unchanged: M5, hardware, requests2, usocket, ussl, ntptime, unit, network,
+esp, machine, utime, ujson, uos, ubinascii, gc and uasyncio (see sim/aio.py).
+"""
+import binascii
+import gc
+import hashlib
+import io
+import json
+import os
+import sys
+import traceback
+import types
+
+from sim import clock as simclock
+
+class SimReset(Exception):
+  """Raised by machine.reset() and by an expired WDT."""
+
+def printException(e, file=None):
+  traceback.print_exception(type(e), e, e.__traceback__, file=file if file is not None else sys.stdout)
+
+def module(name, **attrs):
+  m = types.ModuleType(name)
+  for k, v in attrs.items():
+    setattr(m, k, v)
+  return m
+
+# --- M5 ---
+
+class Color:
+  BLACK = 0x000000
+  WHITE = 0xFFFFFF
+  DARKGREY = 0x808080
+  RED = 0xFF0000
+  GREEN = 0x00FF00
+  BLUE = 0x0000FF
+  ORANGE = 0xFFA500
+
+class Power:
+  def __init__(self, sim):
+    self.sim = sim
+    self.led = 0
+
+  def getBatteryVoltage(self):
+    self.sim.i2cReads += 1
+    return self.sim.battery["voltage"]
+
+  def getBatteryLevel(self):
+    self.sim.i2cReads += 1
+    return self.sim.battery["level"]
+
+  def isCharging(self):
+    self.sim.i2cReads += 1
+    return self.sim.battery["charging"]
+
+  def getBatteryCurrent(self):
+    self.sim.i2cReads += 1
+    return self.sim.battery["current"]
+
+  def setLed(self, v):
+    self.led = v
+
+  def powerOff(self):
+    raise SimReset("powerOff")
+
+class Imu:
+  def __init__(self, sim):
+    self.sim = sim
+
+  def getAccel(self):
+    return self.sim.accel
+
+class Touch:
+  def __init__(self, sim):
+    self.sim = sim
+
+  def getCount(self):
+    return 1 if self.sim.touch else 0
+
+  def getX(self):
+    return self.sim.touch[0] if self.sim.touch else 0
+
+  def getY(self):
+    return self.sim.touch[1] if self.sim.touch else 0
+
+class Speaker:
+  def __init__(self):
+    self.tones = []
+
+  def setVolume(self, v):
+    self.volume = v
+
+  def tone(self, freq, ms):
+    self.tones.append((freq, ms))
+
+class Widgets:
+  def __init__(self, sim):
+    self.sim = sim
+
+  def setBrightness(self, b):
+    self.sim.brightness = b
+
+def makeM5(sim):
+  display = sim.display
+  display.COLOR = Color
+  return module("M5",
+    begin=lambda *a, **k: None,
+    update=lambda: None,
+    Display=display,
+    Lcd=display,
+    Power=Power(sim),
+    Imu=Imu(sim),
+    Touch=Touch(sim),
+    Speaker=Speaker(),
+    Widgets=Widgets(sim),
+  )
+
+# --- hardware / machine ---
+
+class WDT:
+  def __init__(self, id=0, timeout=5000):
+    WDT.armed = timeout
+
+  def feed(self):
+    pass
+
+WDT.armed = None
+
+class I2C:
+  def __init__(self, id, scl=None, sda=None, freq=400000):
+    self.id = id
+    self.freq = freq
+
+class Pin:
+  IN = 0
+  OUT = 1
+
+  def __init__(self, id, *args, **kwargs):
+    self.id = id
+
+def makeMachine(sim):
+  def reset():
+    raise SimReset("machine.reset")
+
+  def lightsleep(ms=0):
+    sim.power["lightsleeps"] += 1
+    sim.power["sleptMs"] += ms
+    sim.clock.advance(ms / 1000)
+
+  return module("machine",
+    Timer=lambda id=-1: simclock.SimTimer(sim.clock, id),
+    WDT=WDT, I2C=I2C, Pin=Pin,
+    reset=reset,
+    soft_reset=reset,
+    lightsleep=lightsleep,
+    deepsleep=lambda ms=0: reset(),
+    unique_id=lambda: b'\x24\x6f\x28\x11\x22\x33',
+    freq=lambda *a: 360000000,
+  )
+
+# --- unit ---
+
+class ENVUnit:
+  def __init__(self, i2c=None, type=3):
+    if Env.sim is None or not Env.sim.envPresent:
+      raise OSError("ENV unit not found")
+    self.sim = Env.sim
+
+  def read_temperature(self):
+    self.sim.i2cReads += 1
+    return self.sim.env["temperature"]
+
+  def read_pressure(self):
+    self.sim.i2cReads += 1
+    return self.sim.env["pressure"]
+
+  def read_humidity(self):
+    self.sim.i2cReads += 1
+    return self.sim.env["humidity"]
+
+class RGBUnit:
+  def __init__(self, pins, n):
+    if Env.sim is None or not Env.sim.rgbPresent:
+      raise OSError("RGB unit not found")
+    self.colors = [0] * n
+
+  def set_color(self, i, c):
+    self.colors[i] = c
+
+class Env:
+  sim = None
+
+# --- network ---
+
+class WLAN:
+  """
+  Station and access point interface. Connecting costs time like on the
+  device: scan() blocks for a scan of all channels, connect() returns at
+  once and isconnected() turns True after the association (with a scan of
+  its own unless the access point's BSSID and channel are given) and the
+  DHCP exchange (skipped with a static ifconfig()).
+  """
+  def __init__(self, sim, iface):
+    self.sim = sim
+    self.iface = iface
+    # driver settings outlive the WLAN object, one set per interface
+    self._config = sim.wifi.setdefault("config", ({}, {}))[iface]
+
+  def active(self, on=None):
+    wifi = self.sim.wifi
+    if on is None:
+      return wifi["active"]
+    now = self.sim.clock.ms
+    if on and not wifi["active"]:
+      wifi["onSince"] = now
+    elif not on and wifi["active"]:
+      wifi["onMs"] += now - wifi["onSince"]
+    wifi["active"] = bool(on)
+    if not on:
+      wifi["connected"] = None
+      wifi["pending"] = None
+
+  def isconnected(self):
+    wifi = self.sim.wifi
+    if wifi["pending"] is not None and self.sim.clock.ms >= wifi["pending"][1]:
+      n, readyMs, startMs = wifi["pending"]
+      wifi["pending"] = None
+      wifi["connected"] = n
+      wifi["connectMs"].append(readyMs - startMs)
+      if not wifi["static"]:
+        wifi["ifconfig"] = wifi["lease"]
+    return wifi["connected"] is not None
+
+  def scan(self):
+    wifi = self.sim.wifi
+    wifi["scans"] += 1
+    self.sim.clock.advance(wifi["scanMs"] / 1000)
+    return [(n["ssid"].encode(), n["bssid"], n["channel"], n["rssi"], n["security"], 0) for n in self.sim.networks]
+
+  def connect(self, ssid=None, password=None, bssid=None):
+    wifi = self.sim.wifi
+    wifi["connects"] += 1
+    wifi["connected"] = None
+    wifi["pending"] = None
+    now = self.sim.clock.ms
+    for n in self.sim.networks:
+      if n["ssid"] == ssid and n["password"] == password and (bssid is None or bssid == n["bssid"]):
+        ms = wifi["authMs"]
+        if bssid is None or self._config.get("channel") != n["channel"]:
+          ms += wifi["scanMs"]
+        if not wifi["static"]:
+          ms += wifi["dhcpMs"]
+        wifi["pending"] = (n, now + ms, now)
+        return
+
+  def disconnect(self):
+    self.sim.wifi["connected"] = None
+    self.sim.wifi["pending"] = None
+
+  def status(self, param=None):
+    if param == "rssi":
+      n = self.sim.wifi["connected"]
+      return n["rssi"] if n else 0
+    return 1010 if self.isconnected() else 1000
+
+  def ifconfig(self, cfg=None):
+    wifi = self.sim.wifi
+    if self.iface == 1:
+      return ("192.168.4.1", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+    if cfg == "dhcp":
+      wifi["static"] = False
+    elif cfg is not None:
+      wifi["static"] = True
+      wifi["ifconfig"] = tuple(cfg)
+    return wifi["ifconfig"]
+
+  def config(self, *args, **kwargs):
+    if args:
+      n = self.sim.wifi["connected"]
+      if args[0] == "mac":
+        return b'\x24\x6f\x28\x11\x22\x33'
+      if args[0] == "essid":
+        return n["ssid"] if n else self._config.get("essid", "")
+      if args[0] == "channel":
+        return n["channel"] if n else 0
+      return self._config.get(args[0])
+    self._config.update(kwargs)
+
+def makeNetwork(sim):
+  return module("network",
+    STA_IF=0, AP_IF=1,
+    WLAN=lambda iface=0: WLAN(sim, iface),
+  )
+
+# --- requests2 ---
+
+class Response:
+  def __init__(self, status_code, content):
+    self.status_code = status_code
+    self.content = content
+    self.closed = False
+
+  @property
+  def text(self):
+    return self.content.decode()
+
+  def json(self):
+    return json.loads(self.content)
+
+  def close(self):
+    self.closed = True
+
+def makeRequests2(sim):
+  def get(url, headers=None, timeout=None, **kwargs):
+    if not sim.wifi["connected"]:
+      raise OSError("ENETUNREACH")
+    status, body = sim.nightscout.handle(url, headers)
+    return Response(status, body)
+
+  return module("requests2", get=get, Response=Response)
+
+# --- usocket / ussl ---
+
+class Socket:
+  """
+  Client socket connected to the Nightscout stub. Costs simulated time for
+  the TCP connect, the TLS handshake and each round trip, and stops
+  answering when the stub's keep-alive timeout passed since the last
+  response, like a server that closed the idle connection.
+  """
+  def __init__(self, sim, host=None):
+    self.sim = sim
+    self.stub = sim.stubFor(host)
+    self.rx = io.BytesIO()
+    self.tx = b""
+    self.lastActive = None
+    self.closed = False
+
+  def settimeout(self, t):
+    self.timeout = t
+
+  def connect(self, addr):
+    if not self.sim.wifi["connected"]:
+      raise OSError("EHOSTUNREACH")
+    self.sim.net["connects"] += 1
+    self.sim.clock.advance(self.sim.net["rttMs"] / 1000)
+    self.lastActive = self.sim.clock.rtc
+
+  def write(self, data):
+    if self.closed:
+      raise OSError("EBADF")
+    self.tx += bytes(data)
+    if b"\r\n\r\n" in self.tx:
+      head, _, self.tx = self.tx.partition(b"\r\n\r\n")
+      if self.alive():
+        url, headers = parseRequest(head.decode())
+        self.sim.clock.advance(self.sim.net["rttMs"] / 1000)
+        self.reply(url, headers)
+      else:
+        self.reply(None, None)
+    return len(data)
+
+  send = write
+
+  def alive(self):
+    # False once the server side closed the connection
+    return self.sim.wifi["connected"] and not self.stub.down and self.sim.clock.rtc - self.lastActive <= self.stub.keepAlive
+
+  def reply(self, url, headers, wait=True):
+    # the response to a GET of url, None when the connection is closed: reads see EOF
+    if url is None:
+      self.rx = io.BytesIO()
+      return
+    sim = self.sim
+    sim.net["requests"] += 1
+    status, body = self.stub.handle(url, headers, wait=wait)
+    reply = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: keep-alive\r\n\r\n" % (status, "OK" if status == 200 else "Error", len(body))
+    self.rx = io.BytesIO(reply.encode() + body)
+    self.lastActive = sim.clock.rtc
+
+  def readline(self):
+    return self.rx.readline()
+
+  def read(self, n=-1):
+    return self.rx.read(n)
+
+  def readinto(self, buf):
+    return self.rx.readinto(buf)
+
+  def recv(self, n):
+    return self.rx.read(n)
+
+  def close(self):
+    self.closed = True
+
+def parseRequest(head):
+  # "GET url HTTP/1.1\r\nheaders" -> (url, headers)
+  lines = head.split("\r\n")
+  headers = {}
+  for line in lines[1:]:
+    k, _, v = line.partition(":")
+    headers[k.strip()] = v.strip()
+  return lines[0].split(" ")[1], headers
+
+def makeUsocket(sim):
+  def getaddrinfo(host, port, *args):
+    if not sim.wifi["connected"]:
+      raise OSError("EAI_FAIL")
+    return [(2, 1, 0, "", ("10.0.0.2", port))]
+
+  return module("usocket",
+    AF_INET=2, SOCK_STREAM=1, SOL_SOCKET=1, SO_REUSEADDR=4,
+    getaddrinfo=getaddrinfo,
+    socket=lambda *a: Socket(sim),
+  )
+
+def makeUssl(sim):
+  def wrap_socket(sock, server_hostname=None, **kwargs):
+    sim.net["handshakes"] += 1
+    sim.clock.advance(sim.net["tlsMs"] / 1000)
+    return sock
+
+  return module("ussl", wrap_socket=wrap_socket)
+
+# --- time ---
+
+def makeUtime(sim):
+  c = sim.clock
+  return module("utime",
+    time=c.time,
+    localtime=lambda secs=None: simclock.localtime(c, secs),
+    gmtime=lambda secs=None: simclock.localtime(c, secs),
+    mktime=simclock.mktime,
+    sleep=c.advance,
+    sleep_ms=lambda ms: c.advance(ms / 1000),
+    sleep_us=lambda us: c.advance(us / 1000000),
+    ticks_ms=lambda: c.ms,
+    ticks_us=lambda: c.ms * 1000,
+    ticks_cpu=lambda: c.ms * 1000,
+    ticks_diff=lambda a, b: a - b,
+    ticks_add=lambda a, b: a + b,
+  )
+
+def makeNtptime(sim):
+  m = module("ntptime", host="pool.ntp.org", timeout=1)
+
+  def settime():
+    # blocking: DNS and the UDP exchange, or the timeout of an unreachable host
+    sim.ntpRequests.append(m.host)
+    if not sim.wifi["connected"] or m.host in sim.ntpDown:
+      sim.clock.advance(m.timeout)
+      raise OSError("ETIMEDOUT")
+    sim.clock.advance(sim.net["ntpMs"] / 1000)
+    sim.clock.settime(sim.wallTime + sim.clock.ms / 1000)
+
+  m.settime = settime
+  return m
+
+def install(sim):
+  from sim import aio
+  Env.sim = sim
+  WDT.armed = None
+  if not hasattr(sys, "print_exception"):
+    sys.print_exception = printException
+  mods = {
+    "M5": makeM5(sim),
+    "hardware": module("hardware", WDT=WDT, I2C=I2C, Pin=Pin),
+    "machine": makeMachine(sim),
+    "unit": module("unit", ENVUnit=ENVUnit, RGBUnit=RGBUnit),
+    "network": makeNetwork(sim),
+    "esp": module("esp", osdebug=lambda *a: None),
+    "requests2": makeRequests2(sim),
+    "usocket": makeUsocket(sim),
+    "ussl": makeUssl(sim),
+    "utime": makeUtime(sim),
+    "ntptime": makeNtptime(sim),
+    "uasyncio": aio.makeUasyncio(sim),
+    "ujson": json,
+    "uos": os,
+    "ubinascii": binascii,
+    "uhashlib": hashlib,
+    # the heap is not modelled
+    "gc": module("gc", collect=gc.collect, mem_free=lambda: 0, mem_alloc=lambda: 0),
+  }
+  sys.modules.update(mods)
+  return mods
@@ -0,0 +1,126 @@
+"""
+Estimates flash wear of the files main.py writes in the simulator workdir.
+
+The device filesystem (LittleFS on NOR flash) programs flash in pages and
+can only program erased space; a block has to be erased before it is
+programmed again. The meter approximates that per open file:
+
+- bytes written to fresh space (a new file, or appended at the end) cost
+  one program per PAGE_SIZE page touched and one erase per BLOCK_SIZE block
+  entered,
+- bytes written over existing data ('r+' writes; a truncating 'w' writes
+  fresh space) copy the block: one erase and BLOCK_SIZE / PAGE_SIZE
+  programs per block touched,
+- every close after a write and every remove commits metadata: one program.
+"""
+import builtins
+import os
+
+PAGE_SIZE = 256
+BLOCK_SIZE = 4096
+
+class FlashStats:
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.programs = 0
+    self.erases = 0
+    self.files = {}
+
+  def add(self, path, programs, erases):
+    self.programs += programs
+    self.erases += erases
+    name = os.path.basename(path)
+    p, e = self.files.get(name, (0, 0))
+    self.files[name] = (p + programs, e + erases)
+
+  def snapshot(self):
+    return {"programs": self.programs, "erases": self.erases, "files": dict(self.files)}
+
+class MeteredFile:
+  def __init__(self, f, path, mode, stats):
+    self._f = f
+    self._path = path
+    self._stats = stats
+    # bytes of old data; 'w' truncated, everything written goes to fresh space
+    self._base = 0 if "w" in mode else os.path.getsize(path)
+    self._append = "a" in mode
+    self._end = self._base
+    self._pages = set()
+    self._copied = set()
+
+  def write(self, data):
+    # in append mode every write goes to the end, whatever tell() says
+    pos = self._end if self._append else self._f.tell()
+    n = self._f.write(data)
+    size = len(data) if n is None else n
+    self._end = max(self._end, pos + size)
+    for page in range(pos // PAGE_SIZE, (pos + size - 1) // PAGE_SIZE + 1):
+      if max(pos, page * PAGE_SIZE) < self._base:
+        self._copied.add(page * PAGE_SIZE // BLOCK_SIZE)
+      else:
+        self._pages.add(page)
+    return n
+
+  def close(self):
+    if self._pages or self._copied:
+      fresh = [p for p in self._pages if p * PAGE_SIZE // BLOCK_SIZE not in self._copied]
+      # a block partly filled before the open is already erased
+      firstFresh = (self._base + BLOCK_SIZE - 1) // BLOCK_SIZE
+      entered = set(p * PAGE_SIZE // BLOCK_SIZE for p in fresh if p * PAGE_SIZE // BLOCK_SIZE >= firstFresh)
+      copied = len(self._copied)
+      self._stats.add(self._path, len(fresh) + copied * (BLOCK_SIZE // PAGE_SIZE) + 1, len(entered) + copied)
+      self._pages = set()
+      self._copied = set()
+    self._f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def __iter__(self):
+    return iter(self._f)
+
+  def __getattr__(self, name):
+    return getattr(self._f, name)
+
+class FlashMeter:
+  """Wraps open() and os.remove() for files under `root` while installed."""
+  def __init__(self, root):
+    self.root = os.path.realpath(root)
+    self.stats = FlashStats()
+    self._open = None
+    self._remove = None
+
+  def inside(self, path):
+    if not isinstance(path, str):
+      return False
+    return os.path.realpath(path).startswith(self.root + os.sep)
+
+  def install(self):
+    realOpen = self._open = builtins.open
+    realRemove = self._remove = os.remove
+    meter = self
+
+    def open(file, mode="r", *args, **kwargs):
+      f = realOpen(file, mode, *args, **kwargs)
+      if meter.inside(file) and any(c in mode for c in "wa+"):
+        return MeteredFile(f, file, mode, meter.stats)
+      return f
+
+    def remove(path):
+      realRemove(path)
+      if meter.inside(path):
+        meter.stats.add(path, 1, 0)
+
+    builtins.open = open
+    os.remove = remove
+
+  def uninstall(self):
+    if self._open is not None:
+      builtins.open = self._open
+      os.remove = self._remove
+      self._open = None
@@ -0,0 +1,196 @@
+import json
+import math
+import time
+
+DIRECTIONS = [
+  (-3.0, "DoubleDown"), (-2.0, "SingleDown"), (-1.0, "FortyFiveDown"),
+  (1.0, "Flat"), (2.0, "FortyFiveUp"), (3.0, "SingleUp"),
+]
+
+def direction(delta_per_min):
+  for limit, name in DIRECTIONS:
+    if delta_per_min < limit:
+      return name
+  return "DoubleUp"
+
+def parseQuery(url):
+  path, _, query = url.partition('?')
+  params = {}
+  for part in query.split('&'):
+    if not part:
+      continue
+    k, _, v = part.partition('=')
+    params[k] = v
+  return path, params
+
+def tzOffset(tz):
+  # "GMT+02:00" -> seconds
+  if not tz or not tz.startswith("GMT") or len(tz) < 5:
+    return 0
+  hh, _, mm = tz[4:].partition(':')
+  secs = int(hh) * 3600 + int(mm or 0) * 60
+  return -secs if tz[3] == '-' else secs
+
+class NightscoutStub:
+  """
+  Canned Nightscout entries API. Readings are generated every `interval`
+  seconds from `base` (UTC epoch) and become visible `latency` seconds after
+  their timestamp, plus up to `jitter` seconds varying from reading to
+  reading, all on the simulator clock. Entries carry the fields of the real
+  server, most of which the device ignores. Idle connections are closed
+  after `keepAlive` seconds. `latencies` collects how long after becoming
+  visible each reading was first served, `emptyPolls` counts long-polls
+  answered without a new reading. With `push` set the Socket.IO interface
+  accepts WebSocket connections (see sim.pushserver), clearing it drops
+  them. `stallSec` delays every answer, with `down` set connections are
+  refused. mirror() makes a stub serving the same readings, their first
+  serve is tracked on the original.
+  """
+
+  def __init__(self, clock, base=None, interval=300, latency=20, jitter=0, trace=None, keepAlive=75):
+    self.clock = clock
+    self.keepAlive = keepAlive
+    self.interval = interval
+    self.latency = latency
+    self.jitter = jitter
+    self.base = base if base is not None else clock.time() - 36 * interval
+    self.trace = trace
+    self.requests = []
+    self.bytesSent = 0
+    self.status = 200
+    self.newestServed = -1
+    self.latencies = []
+    self.emptyPolls = 0
+    self.push = True
+    self.stallSec = 0
+    self.down = False
+    self.origin = None
+
+  def sgv(self, k):
+    if self.trace:
+      return self.trace[k % len(self.trace)]
+    return int(130 + 60 * math.sin(k / 18.0) + 8 * math.sin(k / 2.7))
+
+  def readingTime(self, k):
+    return self.base + k * self.interval
+
+  def visibleTime(self, k):
+    # deterministic jitter, the same reading always shows up at the same time
+    return self.readingTime(k) + self.latency + (k * 7919 % 101) * self.jitter // 100
+
+  def newestIndex(self, now=None):
+    now = self.clock.time() if now is None else now
+    k = int((now - self.latency - self.base) // self.interval)
+    while k >= 0 and self.visibleTime(k) > now:
+      k -= 1
+    return k
+
+  def entry(self, k, tz="GMT+00:00"):
+    t = self.readingTime(k)
+    off = tzOffset(tz)
+    sgv = self.sgv(k)
+    delta = sgv - self.sgv(k - 1)
+    agoMins = max(0, (self.clock.time() - t) // 60)
+    return {
+      "_id": "%024x" % (0x650000000000000000000000 + k),
+      "id": "%024x" % (0x650000000000000000000000 + k),
+      "device": "xDrip-DexcomG6",
+      "date": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t + off)),
+      "dateString": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(t)),
+      "mills": t * 1000,
+      "sysTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(t)),
+      "sgv": sgv,
+      "delta": float(delta),
+      "direction": direction(delta / (self.interval / 60)),
+      "type": "sgv",
+      "filtered": sgv * 1000 + 117,
+      "unfiltered": sgv * 1000 + 245,
+      "rssi": 100,
+      "noise": 1,
+      "utcOffset": off // 60,
+      "ago": str(agoMins) + " min ago",
+    }
+
+  def entries(self, count=10, tz="GMT+00:00", gtMillis=None):
+    newest = self.newestIndex()
+    result = []
+    k = newest
+    while k >= 0 and len(result) < count:
+      if gtMillis is not None and self.readingTime(k) * 1000 <= gtMillis:
+        break
+      result.append(self.entry(k, tz))
+      k -= 1
+    return result
+
+  def waitTime(self, url, headers=None):
+    """Seconds a long-poll (waitfornextid) request of `url` is held open."""
+    headers = headers or {}
+    path, params = parseQuery(url)
+    waitId = params.get("waitfornextid")
+    if waitId is None:
+      return 0
+    timeout = int(params.get("timeout", 25000)) / 1000
+    newest = self.entries(1, headers.get("x-gms-tz", "GMT+00:00"))
+    if not newest or newest[0]["id"] != waitId:
+      return 0
+    # visible on the first whole second after the next reading's latency
+    visible = self.visibleTime(self.newestIndex() + 1)
+    return min(timeout, max(0, math.ceil(visible - self.clock.rtc)))
+
+  def mirror(self):
+    m = NightscoutStub(self.clock, base=self.base, interval=self.interval, latency=self.latency,
+      jitter=self.jitter, trace=self.trace, keepAlive=self.keepAlive)
+    m.origin = self
+    return m
+
+  def markServed(self, newest):
+    # records the latency of readings served for the first time, False when there are none
+    if self.origin is not None:
+      return self.origin.markServed(newest)
+    if newest <= self.newestServed:
+      return False
+    if self.newestServed >= 0:
+      for k in range(self.newestServed + 1, newest + 1):
+        self.latencies.append(self.clock.rtc - self.visibleTime(k))
+    self.newestServed = newest
+    return True
+
+  def upgrade(self, url):
+    """A PushServer for a WebSocket upgrade request of `url`, None when refused."""
+    from sim.pushserver import PushServer
+    self.requests.append(url)
+    if not self.push or not url.startswith("/socket.io/"):
+      return None
+    return PushServer(self)
+
+  def handle(self, url, headers=None, wait=True):
+    """
+    Returns (status, body bytes) for a GET of `url`. A long-poll advances
+    the clock until it is answered, unless `wait` is False (the caller
+    already waited waitTime()).
+    """
+    headers = headers or {}
+    path, params = parseQuery(url)
+    self.requests.append(url)
+    if self.status != 200:
+      return self.status, b'{"error":"stub"}'
+    if not path.endswith("/entries.json"):
+      return 404, b'{"error":"not found"}'
+    tz = headers.get("x-gms-tz", "GMT+00:00")
+    count = int(params.get("count", 10))
+    waitId = params.get("waitfornextid")
+    if waitId is not None and wait:
+      timeout = int(params.get("timeout", 25000)) / 1000
+      waited = 0
+      while waited < timeout and self.entries(1, tz) and self.entries(1, tz)[0]["id"] == waitId:
+        self.clock.advance(1)
+        waited += 1
+    gt = params.get("find[date][$gt]") or params.get("find%5Bdate%5D%5B%24gt%5D")
+    entries = self.entries(count, tz, int(gt) if gt else None)
+    if entries:
+      self.markServed(self.newestIndex())
+    elif waitId is not None:
+      self.emptyPolls += 1
+    body = json.dumps(entries).encode()
+    self.bytesSent += len(body)
+    return 200, body
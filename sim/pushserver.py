@@ -0,0 +1,166 @@
+"""
+Stand-in for Nightscout's Socket.IO interface (Engine.IO 4 over a
+WebSocket), serving the Nightscout stub's readings.
+
+One PushServer is one client connection, without any I/O of its own: the
+fake uasyncio stream passes it what the client writes (receive()), takes
+what it sends from `out` and calls poll() at nextEventMs() on the
+simulator clock. After `authorize` it sends a full dataUpdate with the
+last hour of readings, then a delta dataUpdate as soon as a new reading
+becomes visible, and pings every `pingInterval` ms. A client that does not
+answer a ping within `pingTimeout` ms is disconnected.
+"""
+import base64
+import hashlib
+import json
+import math
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HISTORY_SEC = 3600
+
+def frame(op, data):
+  # server frames are not masked
+  n = len(data)
+  if n < 126:
+    head = bytes((0x80 | op, n))
+  elif n < 65536:
+    head = bytes((0x80 | op, 126)) + n.to_bytes(2, "big")
+  else:
+    head = bytes((0x80 | op, 127)) + n.to_bytes(8, "big")
+  return head + data
+
+def pushSgv(entry):
+  # an entries.json entry in the format of Nightscout's dataUpdate sgvs
+  return {
+    "_id": entry["_id"], "mgdl": entry["sgv"], "mills": entry["mills"], "device": entry["device"],
+    "direction": entry["direction"], "type": "sgv", "filtered": entry["filtered"],
+    "unfiltered": entry["unfiltered"], "noise": entry["noise"], "rssi": entry["rssi"],
+  }
+
+class PushServer:
+  def __init__(self, stub, pingInterval=25000, pingTimeout=20000):
+    self.stub = stub
+    self.clock = stub.clock
+    self.pingInterval = pingInterval
+    self.pingTimeout = pingTimeout
+    self.out = bytearray()
+    self.inbuf = b""
+    self.authorized = False
+    self.closed = False
+    self.newestSent = -1
+    self.nextPingMs = None
+    self.pongDueMs = None
+    self.messages = 0
+
+  def handshake(self, head):
+    # the response to the upgrade request, then the Engine.IO open packet
+    key = None
+    for line in head.split("\r\n")[1:]:
+      k, _, v = line.partition(":")
+      if k.strip().lower() == "sec-websocket-key":
+        key = v.strip().encode()
+    if key is None:
+      self.out += b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n"
+      self.closed = True
+      return
+    accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+    self.out += b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+    self.send("0" + json.dumps({"sid": "sim", "upgrades": [], "pingInterval": self.pingInterval, "pingTimeout": self.pingTimeout}))
+    self.nextPingMs = self.clock.ms + self.pingInterval
+
+  def send(self, text):
+    data = frame(1, text.encode())
+    self.out += data
+    self.stub.bytesSent += len(data)
+    self.messages += 1
+
+  def close(self):
+    if not self.closed:
+      self.out += frame(8, b"")
+      self.closed = True
+
+  def receive(self, data):
+    self.inbuf += data
+    while len(self.inbuf) >= 2:
+      b = self.inbuf
+      op = b[0] & 0x0F
+      n = b[1] & 0x7F
+      i = 2
+      if n == 126:
+        if len(b) < 4: return
+        n = int.from_bytes(b[2:4], "big")
+        i = 4
+      elif n == 127:
+        if len(b) < 10: return
+        n = int.from_bytes(b[2:10], "big")
+        i = 10
+      if not b[1] & 0x80:
+        self.close() # client frames must be masked
+        return
+      if len(b) < i + 4 + n:
+        return
+      mask = b[i:i + 4]
+      payload = bytes(c ^ mask[j & 3] for j, c in enumerate(b[i + 4:i + 4 + n]))
+      self.inbuf = b[i + 4 + n:]
+      if op == 8:
+        self.closed = True
+      elif op == 1:
+        self.packet(payload.decode())
+
+  def packet(self, text):
+    if text == "3":
+      self.pongDueMs = None
+    elif text == "40":
+      self.send('40{"sid":"sim-socket"}')
+    elif text.startswith("42"):
+      ack = ""
+      body = text[2:]
+      while body[:1].isdigit():
+        ack += body[0]
+        body = body[1:]
+      event = json.loads(body)
+      if event[0] == "authorize":
+        self.authorized = True
+        self.send("43" + ack + json.dumps([{"read": True, "write": False, "write_treatment": False}]))
+        self.update(full=True)
+
+  def update(self, full=False):
+    stub = self.stub
+    newest = stub.newestIndex()
+    if full:
+      first = max(0, newest - HISTORY_SEC // stub.interval)
+    elif newest > self.newestSent:
+      first = self.newestSent + 1
+    else:
+      return
+    sgvs = [pushSgv(stub.entry(k)) for k in range(newest, first - 1, -1)]
+    self.newestSent = newest
+    stub.markServed(newest)
+    self.send("42" + json.dumps(["dataUpdate", {"delta": not full, "lastUpdated": self.clock.time() * 1000, "sgvs": sgvs}]))
+
+  def nextEventMs(self):
+    if self.closed:
+      return None
+    due = [t for t in (self.nextPingMs, self.pongDueMs) if t is not None]
+    if self.authorized:
+      # the next reading, on the ms clock
+      visible = self.stub.visibleTime(self.stub.newestIndex() + 1)
+      due.append(self.clock.ms + max(1, math.ceil((visible - self.clock.rtc) * 1000)))
+    return min(due) if due else None
+
+  def poll(self):
+    if self.closed:
+      return
+    if not self.stub.push:
+      self.close()
+      return
+    now = self.clock.ms
+    if self.pongDueMs is not None and now >= self.pongDueMs:
+      self.close()
+      return
+    if self.authorized:
+      self.update()
+    if self.nextPingMs is not None and now >= self.nextPingMs:
+      self.send("2")
+      self.pongDueMs = now + self.pingTimeout
+      self.nextPingMs = now + self.pingInterval
@@ -0,0 +1,147 @@
+"""
+Trend and prediction replay.
+
+Feeds glucose traces reading by reading into forecast.Forecaster, as
+main.py does when readings arrive, and reports the error of the 15 and 30
+minute predictions against the readings that followed, the confirmed
+predicted low and high alerts (how many minutes before the threshold was
+crossed they came, and the ones no crossing followed within
+ALERT_WINDOW_MIN) and the host CPU time per new reading. A trace is a CSV
+file of `seconds,sgv` lines or a Nightscout entries.json export; without
+one a week of the stub's curve, the same with sensor noise and a
+synthetic day with a hypo and a post-meal high are replayed:
+
+  python -m sim.replay [trace ...] [--json]
+"""
+import json
+import math
+import random
+import sys
+import time
+
+import forecast
+
+EMERGENCY_MIN = 55 # as in the simulator's config
+EMERGENCY_MAX = 250
+ALERT_WINDOW_MIN = 30 # an alert no crossing follows within this is a false one
+MATCH_SEC = 150 # the reading compared with a prediction is this close to its time
+
+def stubTrace(n=288):
+  # sim.nightscout.NightscoutStub.sgv, a day of 5 minute readings
+  return [(k * 300, int(130 + 60 * math.sin(k / 18.0) + 8 * math.sin(k / 2.7))) for k in range(n)]
+
+def noisyTrace(n=2016, amplitude=5, seed=1):
+  # the stub's curve with random sensor noise, dipping to the low limit
+  r = random.Random(seed)
+  return [(t, v + r.randint(-amplitude, amplitude)) for t, v in stubTrace(n)]
+
+def excursionTrace(n=288):
+  # a slow night-time drop into a hypo, recovery, and a post-meal high
+  out = []
+  for k in range(n):
+    t = k * 5
+    v = 120 - 75 * math.exp(-((t - 240) / 50.0) ** 2) + 160 * math.exp(-((t - 780) / 70.0) ** 2)
+    v += 4 * math.sin(k / 1.7) # sensor noise
+    out.append((k * 300, int(v)))
+  return out
+
+def loadTrace(path):
+  with open(path) as f:
+    text = f.read()
+  if text.lstrip().startswith("["):
+    readings = []
+    for e in json.loads(text):
+      if "sgv" in e and "date" in e:
+        readings.append((e["date"] // 1000, int(e["sgv"])))
+  else:
+    readings = []
+    for line in text.splitlines():
+      parts = line.split(",")
+      if len(parts) < 2 or not parts[0].strip().isdigit():
+        continue # header or blank
+      readings.append((int(parts[0]), int(parts[1])))
+  readings.sort()
+  return readings
+
+def crossing(value):
+  if value <= EMERGENCY_MIN:
+    return "low"
+  if value > EMERGENCY_MAX:
+    return "high"
+  return None
+
+def replay(name, readings):
+  f = forecast.Forecaster()
+  f.configure(EMERGENCY_MIN, EMERGENCY_MAX)
+  predictions = {15: [], 30: []} # (target seconds, predicted)
+  alerts = [] # (seconds, kind) of each alert that starts while no threshold is crossed
+  alerting = False
+  cpu = 0
+  for seconds, sgv in readings:
+    start = time.perf_counter()
+    f.add(seconds, sgv)
+    p15 = f.predict(15)
+    cpu += time.perf_counter() - start
+    if p15 == None:
+      continue
+    predictions[15].append((seconds + 15 * 60, p15))
+    predictions[30].append((seconds + 30 * 60, f.predict(30)))
+    kind = crossing(f.alert) if f.alert != None else None
+    if kind != None and crossing(sgv) == None and not alerting:
+      alerts.append((seconds, kind))
+    alerting = kind != None
+
+  def errors(horizon):
+    diffs = []
+    i = 0
+    for target, predicted in predictions[horizon]:
+      while i < len(readings) and readings[i][0] < target - MATCH_SEC:
+        i += 1
+      if i < len(readings) and abs(readings[i][0] - target) <= MATCH_SEC:
+        diffs.append(abs(readings[i][1] - predicted))
+    return diffs
+
+  # threshold crossings: the first reading of each run beyond a threshold
+  crossings = []
+  previous = None
+  for seconds, sgv in readings:
+    kind = crossing(sgv)
+    if kind != None and kind != previous:
+      crossings.append((seconds, kind))
+    previous = kind
+  leads = []
+  false = 0
+  for seconds, kind in alerts:
+    following = [c for c in crossings if c[1] == kind and 0 <= c[0] - seconds <= ALERT_WINDOW_MIN * 60]
+    if following:
+      leads.append((following[0][0] - seconds) // 60)
+    else:
+      false += 1
+  r = {"trace": name, "readings": len(readings), "crossings": len(crossings), "alerts": len(alerts), "falseAlerts": false, "leadMin": leads,
+    "usPerReading": cpu * 1e6 / max(1, len(readings))}
+  for horizon in (15, 30):
+    diffs = errors(horizon)
+    r["mae%d" % horizon] = sum(diffs) / len(diffs) if diffs else None
+    r["max%d" % horizon] = max(diffs) if diffs else None
+  return r
+
+def report(results, out=sys.stdout):
+  for r in results:
+    out.write("%s: %d readings, %.1f us per reading\n" % (r["trace"], r["readings"], r["usPerReading"]))
+    for horizon in (15, 30):
+      if r["mae%d" % horizon] != None:
+        out.write("  %d min prediction: mean error %.1f mg/dL, max %d\n" % (horizon, r["mae%d" % horizon], r["max%d" % horizon]))
+    leads = ", ".join(str(m) for m in r["leadMin"]) or "-"
+    out.write("  threshold crossings=%d, predicted alerts=%d (lead minutes: %s), false alerts=%d\n" % (r["crossings"], r["alerts"], leads, r["falseAlerts"]))
+
+if __name__ == "__main__":
+  paths = [a for a in sys.argv[1:] if not a.startswith("--")]
+  if paths:
+    traces = [(p, loadTrace(p)) for p in paths]
+  else:
+    traces = [("stub, a week", stubTrace(2016)), ("stub with noise, a week", noisyTrace()), ("hypo and high", excursionTrace())]
+  results = [replay(name, readings) for name, readings in traces]
+  if "--json" in sys.argv:
+    print(json.dumps(results, indent=2))
+  else:
+    report(results)
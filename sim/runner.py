@@ -0,0 +1,186 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+from sim import fakes
+from sim.canvas import Canvas
+from sim.clock import SimClock
+from sim.flash import FlashMeter
+from sim.nightscout import NightscoutStub
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# repo modules holding state, imported afresh for every simulator
+STATEFUL_MODULES = ("ap", "httpclient", "journal", "scheduler", "battery", "power", "push", "endpoints", "wifi", "main")
+PAGES = ("config.html", "success.html")
+WALL_TIME = 1751371200 # 2025-07-01 12:00:00 UTC
+
+DEFAULT_SIM_CONFIG = {
+  "config": 1,
+  "brightness": 1,
+  "screen-mode": 0,
+  "api-endpoint": "https://nightscout.sim/api/v1",
+  "api-token": "sim-token",
+  "locale": "en-US",
+  "min": 75,
+  "max": 180,
+  "emergencyMin": 55,
+  "emergencyMax": 250,
+  "timezone": "+02:00",
+  "beeper": 0,
+  "beeperStartTime": "00:00:00",
+  "beeperEndTime": "23:59:59",
+  "oldData": 15,
+  "oldDataEmergenc": 1440,
+  "wifi": [{"ssid": "sim-wifi", "password": "sim-password"}],
+}
+
+class Simulator:
+  """
+  Runs main.py on CPython against fake device modules.
+
+  The working directory is a scratch directory holding the device
+  filesystem (config.json, journal segments, ...), writes to it are
+  metered in `flash.stats`. Nothing runs on its own: boot() runs main.py's
+  tasks until they all wait, after that they only run in settle() and
+  runFor(), and time moves when one of these or `clock.advance()` is
+  called.
+  """
+
+  def __init__(self, config=None, workdir=None, wallTime=WALL_TIME, envPresent=True, rgbPresent=True, trace=None, rtcSet=False):
+    self.config = dict(DEFAULT_SIM_CONFIG)
+    if config:
+      self.config.update(config)
+    self.workdir = workdir or tempfile.mkdtemp(prefix="tab5sim-")
+    self.wallTime = wallTime
+    # the RTC starts at 2000 after a power cycle, a reset keeps the time
+    self.clock = SimClock(wallTime) if rtcSet else SimClock()
+    self.display = Canvas()
+    self.nightscout = NightscoutStub(self.clock, base=wallTime - 36 * 300 + 120, trace=trace)
+    self.stubs = {"nightscout.sim": self.nightscout} # host -> stub
+    self.envPresent = envPresent
+    self.rgbPresent = rgbPresent
+    self.env = {"temperature": 23.4, "pressure": 1013.2, "humidity": 41.0}
+    self.battery = {"voltage": 7400, "level": 80, "charging": False, "current": -250}
+    self.accel = (0.0, 0.0, 1.0)
+    self.touch = None
+    self.brightness = None
+    self.i2cReads = 0
+    self.networks = [{"ssid": "sim-wifi", "password": "sim-password", "bssid": b'\x10\x20\x30\x40\x50\x60', "channel": 6, "rssi": -55, "security": 3}]
+    # connect costs: scan of all channels, association, DHCP exchange
+    self.wifi = {"active": False, "connected": None, "pending": None, "scans": 0, "connects": 0, "connectMs": [], "onMs": 0, "onSince": 0,
+      "scanMs": 2200, "authMs": 400, "dhcpMs": 1500, "static": False, "ifconfig": ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0"),
+      "lease": ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")}
+    self.net = {"connects": 0, "handshakes": 0, "requests": 0, "rttMs": 60, "tlsMs": 900, "ntpMs": 300, "apBytesPerMs": 100}
+    self.power = {"lightsleeps": 0, "sleptMs": 0}
+    self.ntpRequests = []
+    self.ntpDown = set() # NTP hosts that do not answer
+    self.servers = {}
+    self.loop = None
+    self.flash = FlashMeter(self.workdir)
+    self.main = None
+    self._saved = {}
+
+  def install(self):
+    for name in ("M5", "hardware", "machine", "unit", "network", "esp", "requests2", "usocket", "ussl", "utime", "ntptime", "uasyncio", "ujson", "uos", "ubinascii", "uhashlib", "gc") + STATEFUL_MODULES:
+      if name not in self._saved:
+        self._saved[name] = sys.modules.get(name)
+    fakes.install(self)
+    for name in STATEFUL_MODULES:
+      sys.modules.pop(name, None)
+    self.flash.install()
+    if REPO_DIR not in sys.path:
+      sys.path.insert(0, REPO_DIR)
+
+  def uninstall(self):
+    self.flash.uninstall()
+    for name, mod in self._saved.items():
+      if mod is None:
+        sys.modules.pop(name, None)
+      else:
+        sys.modules[name] = mod
+    self._saved = {}
+
+  def writeConfig(self):
+    import ap
+    cwd = os.getcwd()
+    os.chdir(self.workdir)
+    try:
+      ap.saveConfigFile(self.config)
+      # the pages copyAll.sh puts next to it
+      for page in PAGES:
+        if not os.path.exists(page):
+          shutil.copy(os.path.join(REPO_DIR, page), page)
+    finally:
+      os.chdir(cwd)
+
+  def boot(self):
+    """Imports main.py as the device would run it and returns the module."""
+    self.install()
+    self.writeConfig()
+    os.chdir(self.workdir)
+    # main.py uses both time and utime, bind both to the simulated clock
+    realTime = sys.modules["time"]
+    sys.modules["time"] = sys.modules["utime"]
+    try:
+      spec = importlib.util.spec_from_file_location("main", os.path.join(REPO_DIR, "main.py"))
+      self.main = importlib.util.module_from_spec(spec)
+      sys.modules["main"] = self.main
+      spec.loader.exec_module(self.main)
+      self.loop.settle()
+    finally:
+      sys.modules["time"] = realTime
+    return self.main
+
+  def settle(self):
+    """Runs the tasks made ready (e.g. by a render request) until they all wait."""
+    self.loop.settle()
+
+  def runFor(self, seconds):
+    """Runs main.py's tasks for `seconds` of simulated time."""
+    self.loop.runUntil(self.clock.ms + int(seconds * 1000))
+
+  def connectWifi(self):
+    """Moves time to the end of a WiFi connect in progress and settles the tasks waiting for it."""
+    pending = self.wifi["pending"]
+    if pending is not None:
+      self.clock.advance(max(0, pending[1] - self.clock.ms) / 1000)
+      self.loop.popDue()
+      self.loop.settle()
+
+  def request(self, data, port=80, mss=536):
+    """
+    Sends the raw request `data` to the server listening on `port` and runs
+    the tasks until it closed the connection. Returns (response bytes, ms).
+    """
+    from sim.aio import ServerStream
+    stream = ServerStream(self, data, mss)
+    start = self.clock.ms
+    self.loop.create_task(self.servers[port](stream, stream))
+    self.loop.settle()
+    for _ in range(6000): # up to a minute
+      if stream.closed:
+        break
+      self.runFor(0.01)
+    return stream.out, self.clock.ms - start
+
+  def addMirror(self, host="mirror.sim"):
+    """Serves the stub's readings on `host` too, returns the mirror stub."""
+    self.stubs[host] = self.nightscout.mirror()
+    return self.stubs[host]
+
+  def stubFor(self, host):
+    return self.stubs.get(host, self.nightscout)
+
+  def radioMs(self):
+    """Milliseconds the WiFi radio has been on so far."""
+    w = self.wifi
+    return w["onMs"] + (self.clock.ms - w["onSince"] if w["active"] else 0)
+
+  def fetch(self, count=10):
+    """Fetches entries from the stub the way backendMonitor does."""
+    import requests2
+    m = self.main
+    r = requests2.get(m.API_ENDPOINT + "/entries.json?count=" + str(count), headers={"x-gms-tz": m.TIMEZONE})
+    return r.json()
@@ -0,0 +1,64 @@
+# HTML pages with {{name}} placeholders. A page is kept split into its
+# static chunks and slot names, alternating, and rendered by putting the
+# values in the slots: no str.replace pass over the whole page per value,
+# each of them copying the page. build.py splits the pages at build time
+# (page.parts) and gzips the static ones (page.gz, next to the plain page
+# for clients without gzip), on the device a page without these is read and
+# split as it is.
+import sys
+
+SEPARATOR = "\x00" # between the parts in page.parts
+
+ERROR_PAGE = "<html><body>Error loading page</body></html>"
+
+def split(html):
+  # [static, slot, static, ..., static]
+  parts = []
+  i = 0
+  while True:
+    j = html.find("{{", i)
+    k = html.find("}}", j + 2) if j >= 0 else -1
+    if k < 0:
+      parts.append(html[i:])
+      return parts
+    parts.append(html[i:j])
+    parts.append(html[j + 2:k])
+    i = k + 2
+
+def load(filename):
+  try:
+    with open(filename + ".parts", 'r') as f:
+      return f.read().split(SEPARATOR)
+  except OSError:
+    pass
+  try:
+    with open(filename, 'r') as f:
+      return split(f.read())
+  except Exception as e:
+    sys.print_exception(e)
+    return [ERROR_PAGE]
+
+def render(parts, values):
+  # the chunks to send, slots without a value stay empty
+  out = []
+  for i in range(len(parts)):
+    if i % 2 == 0:
+      out.append(parts[i])
+    else:
+      out.append(str(values.get(parts[i], "")))
+  return out
+
+def loadStatic(filename, gzipped=True):
+  # (body, gzipped) of a page without slots, gzipped only if asked for
+  if gzipped:
+    try:
+      with open(filename + ".gz", 'rb') as f:
+        return f.read(), True
+    except OSError:
+      pass
+  try:
+    with open(filename, 'r') as f:
+      return f.read(), False
+  except Exception as e:
+    sys.print_exception(e)
+    return ERROR_PAGE, False
@@ -0,0 +1,74 @@
+# Fast WiFi (re)connect. The usual way costs a scan of all channels to find
+# a known network, another one inside the driver to find its access point
+# and a DHCP exchange, seconds of radio time on every reconnect. The access
+# point (BSSID, channel) and IP lease of the last successful connect are
+# cached in a small file: the next connect goes straight to that access
+# point with the lease as static IP configuration. When that fails the
+# networks are scanned, the strongest known one is joined with DHCP and the
+# cache is updated. The file is only rewritten when something changed.
+import ubinascii
+import ujson
+
+CACHE_FILE = "wifi.json"
+
+class WifiCache:
+  """
+  entry(networks) is the cached access point as (ssid, password, bssid,
+  channel, ifconfig) if its SSID is still among `networks` (the config's
+  "wifi" entries), save() records a successful connect. forget() makes the
+  next connect scan and get a new lease, e.g. when the network is unusable
+  with the cached one; the file is kept, it is only rewritten when the new
+  lease differs.
+  """
+  def __init__(self, path=CACHE_FILE):
+    self.path = path
+    self.data = None
+    self.stale = False
+    try:
+      with open(path, 'r') as f:
+        self.data = ujson.load(f)
+    except Exception:
+      pass
+
+  def entry(self, networks):
+    d = self.data
+    if d == None or self.stale:
+      return None
+    password = passwordFor(networks, d.get("ssid"))
+    if password == None or not d.get("bssid") or len(d.get("ifconfig", ())) != 4:
+      return None
+    return (d["ssid"], password, ubinascii.unhexlify(d["bssid"]), d.get("channel", 0), tuple(d["ifconfig"]))
+
+  def save(self, ssid, bssid, channel, ifconfig):
+    data = {"ssid": ssid, "bssid": ubinascii.hexlify(bssid).decode(), "channel": channel, "ifconfig": list(ifconfig)}
+    self.stale = False
+    if data == self.data:
+      return
+    try:
+      with open(self.path, 'w') as f:
+        ujson.dump(data, f)
+      self.data = data
+    except Exception as e:
+      print("Cannot save WiFi cache:", e)
+
+  def forget(self):
+    self.stale = True
+
+def passwordFor(networks, ssid):
+  for entry in networks:
+    if entry.get("ssid") == ssid:
+      return entry.get("password")
+  return None
+
+def strongest(scanResults, networks):
+  # the known network with the best signal as (ssid, password, bssid,
+  # channel), hidden and open networks are not joined
+  best = None
+  for ssid, bssid, channel, rssi, security, hidden in scanResults:
+    if security == 0 or hidden != 0:
+      continue
+    ssid = ssid.decode()
+    password = passwordFor(networks, ssid)
+    if password != None and (best == None or rssi > best[0]):
+      best = (rssi, ssid, password, bssid, channel)
+  return best[1:] if best != None else None